@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Write a synthetic QuPath cell quantification export for benchmarking BinFlow.
+
+The table has the columns the pipeline reads from real exports: `Image`, object
+metadata, `Centroid X µm` / `Centroid Y µm`, a `Classification` column of
+`|`-joined `<marker>+` / `<marker>-` tokens, and `<marker>: <compartment>: <stat>`
+measurements. Every cell has a hidden positive/negative state per marker that drives
+its intensities, and only a `--label-fraction` of cells carry a token for a given
+marker, as with sparse manual annotation. With `--panel-columns` each marker also gets
+a `<marker>+: Cell: Median` column, the channel naming analyze_panel_design reports on.
+Rows are generated and written in chunks,
+so tables with tens of millions of cells need little memory; chunks are written with
+pyarrow's CSV writer when it is installed, which is several times faster than pandas.
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_MARKERS = ["DAPI", "CD3", "CD4", "CD8", "CD20", "CD68", "FOXP3", "PD1", "Ki67", "PanCK"]
+DEFAULT_COMPARTMENTS = ["Nucleus", "Cytoplasm", "Membrane", "Cell"]
+DEFAULT_STATS = ["Mean", "Median", "Min", "Max", "Std.Dev."]
+# Intensity scale of each compartment relative to the whole cell
+COMPARTMENT_SCALE = {"Nucleus": 1.2, "Cytoplasm": 0.8, "Membrane": 0.9, "Cell": 1.0}
+IMAGE_SIZE_UM = 20_000.0
+
+
+def parse_count(text):
+    """'10k' -> 10000, '1M' -> 1000000, '2.5m' -> 2500000."""
+    text = str(text).strip().lower().replace("_", "")
+    for suffix, factor in (("k", 1_000), ("m", 1_000_000), ("g", 1_000_000_000)):
+        if text.endswith(suffix):
+            return int(float(text[:-1]) * factor)
+    return int(text)
+
+
+def measurement_columns(markers, compartments, stats):
+    return [f"{m}: {c}: {s}" for m in markers for c in compartments for s in stats]
+
+
+def marker_profiles(markers, rng):
+    """Per-marker positive rate and the log-intensity of negative and positive cells."""
+    profiles = {}
+    for marker in markers:
+        neg = rng.uniform(4.0, 6.0)
+        profiles[marker] = {
+            "positive_rate": 1.0 if marker == markers[0] else rng.uniform(0.05, 0.4),
+            "neg_log_mean": neg,
+            "pos_log_mean": neg + rng.uniform(1.0, 2.5),
+        }
+    return profiles
+
+
+def image_names(n_images, first_image=0):
+    return [f"Slide_{i + 1:03d}.ome.tif" for i in range(first_image, first_image + n_images)]
+
+
+def classification_strings(states, labelled, markers, label_noise, rng):
+    """`|`-joined tokens for the labelled (cell, marker) pairs; empty string for unlabelled cells."""
+    out = pd.Series("", index=np.arange(states.shape[0]), dtype=object)
+    for j, marker in enumerate(markers):
+        observed = states[:, j] ^ (rng.random(states.shape[0]) < label_noise)
+        tokens = np.where(labelled[:, j], np.where(observed, f"{marker}+", f"{marker}-"), "")
+        out = out.str.cat(pd.Series(tokens, index=out.index), sep="|")
+    return out.str.replace(r"\|{2,}", "|", regex=True).str.strip("|")
+
+
+def generate_chunk(start, n_rows, images, image_bounds, markers, labelled_markers, compartments, stats,
+                   profiles, label_fraction, label_noise, rng, panel_columns=False):
+    image_idx = np.searchsorted(image_bounds, np.arange(start, start + n_rows), side="right") - 1
+    # Cells cluster around a few tissue regions per image
+    centres = rng.uniform(0.2, 0.8, size=(n_rows, 2)) * IMAGE_SIZE_UM
+    xy = np.clip(centres + rng.normal(0.0, IMAGE_SIZE_UM * 0.08, size=(n_rows, 2)), 0.0, IMAGE_SIZE_UM)
+
+    states = np.column_stack([rng.random(n_rows) < profiles[m]["positive_rate"] for m in markers])
+    data = {
+        "Image": np.asarray(images, dtype=object)[image_idx],
+        "Object ID": [f"cell-{i:010d}" for i in range(start, start + n_rows)],
+        "Name": "PathCellObject",
+        "Parent": "Annotation",
+        "ROI": "Polygon",
+        "Centroid X µm": np.round(xy[:, 0], 1),
+        "Centroid Y µm": np.round(xy[:, 1], 1),
+    }
+    label_idx = [markers.index(m) for m in labelled_markers]
+    labelled = rng.random((n_rows, len(labelled_markers))) < label_fraction
+    data["Classification"] = classification_strings(
+        states[:, label_idx], labelled, labelled_markers, label_noise, rng).replace("", np.nan).to_numpy()
+    area = rng.lognormal(3.5, 0.3, n_rows)
+    data["Nucleus: Area µm^2"] = np.round(area * 0.4, 2)
+    data["Cell: Area µm^2"] = np.round(area, 2)
+
+    for j, marker in enumerate(markers):
+        p = profiles[marker]
+        log_mean = np.where(states[:, j], p["pos_log_mean"], p["neg_log_mean"])
+        cell = np.exp(log_mean + rng.normal(0.0, 0.35, n_rows))
+        for compartment in compartments:
+            base = cell * COMPARTMENT_SCALE.get(compartment, 1.0) * np.exp(rng.normal(0.0, 0.1, n_rows))
+            spread = base * rng.uniform(0.2, 0.5, n_rows)
+            values = {
+                "Mean": base,
+                "Median": base * 0.95,
+                "Min": np.maximum(base - 2.0 * spread, 0.0),
+                "Max": base + 3.0 * spread,
+                "Std.Dev.": spread,
+            }
+            for stat in stats:
+                data[f"{marker}: {compartment}: {stat}"] = np.round(values.get(stat, base), 3).astype(np.float32)
+        if panel_columns:
+            data[f"{marker}+: Cell: Median"] = np.round(cell * 0.95, 3).astype(np.float32)
+    return pd.DataFrame(data)
+
+
+def write_chunk(frame, fh, header):
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        frame.to_csv(fh, sep="\t", index=False, header=header)
+        return
+    # Arrow quotes header names, so the header is written by hand like QuPath does
+    if header:
+        fh.write(("\t".join(frame.columns) + "\n").encode("utf-8"))
+    options = pa_csv.WriteOptions(include_header=False, delimiter="\t", quoting_style="none")
+    pa_csv.write_csv(pa.Table.from_pandas(frame, preserve_index=False), fh, options)
+
+
+def write_table(path, n_cells, n_markers=len(DEFAULT_MARKERS), n_images=4, label_fraction=0.05, label_noise=0.02,
+                compartments=DEFAULT_COMPARTMENTS, stats=DEFAULT_STATS, seed=0, first_image=0, chunk_rows=200_000,
+                panel_columns=False):
+    """Write the table to `path` and return its shape as (rows, columns)."""
+    rng = np.random.default_rng(seed)
+    markers = list(DEFAULT_MARKERS[:n_markers])
+    markers += [f"M{i}" for i in range(len(markers), n_markers)]
+    # The first marker is the nuclear stain: it is never annotated
+    labelled_markers = markers[1:]
+    profiles = marker_profiles(markers, rng)
+    images = image_names(n_images, first_image)
+    # Contiguous blocks of rows per image with uneven sizes, like real cohorts
+    weights = rng.uniform(0.5, 1.5, n_images)
+    image_bounds = np.concatenate([[0], np.cumsum(np.round(weights / weights.sum() * n_cells).astype(np.int64))])
+    image_bounds[-1] = n_cells
+
+    n_columns = 0
+    with open(path, "wb") as fh:
+        for start in range(0, n_cells, chunk_rows):
+            chunk = generate_chunk(start, min(chunk_rows, n_cells - start), images, image_bounds, markers, labelled_markers,
+                                   compartments, stats, profiles, label_fraction, label_noise, rng, panel_columns)
+            write_chunk(chunk, fh, header=start == 0)
+            n_columns = chunk.shape[1]
+    return n_cells, n_columns
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Write a synthetic QuPath cell quantification table.")
+    ap.add_argument("output")
+    ap.add_argument("--cells", default="10k", help="Number of cells, e.g. 10k, 1M, 10M")
+    ap.add_argument("--markers", type=int, default=len(DEFAULT_MARKERS), help="Number of markers (the first is the nuclear stain)")
+    ap.add_argument("--images", type=int, default=4)
+    ap.add_argument("--first-image", type=int, default=0, help="Offset of the image names, for tables of one cohort")
+    ap.add_argument("--label-fraction", type=float, default=0.05,
+                    help="Fraction of cells carrying a +/- token for each non-nuclear marker")
+    ap.add_argument("--label-noise", type=float, default=0.02, help="Fraction of tokens that disagree with the cell's state")
+    ap.add_argument("--compartments", default=",".join(DEFAULT_COMPARTMENTS))
+    ap.add_argument("--stats", default=",".join(DEFAULT_STATS))
+    ap.add_argument("--panel-columns", action="store_true",
+                    help="Also write a '<marker>+: Cell: Median' column per marker, as panel design reports expect")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--chunk-rows", type=int, default=200_000)
+    args = ap.parse_args()
+
+    n_rows, n_cols = write_table(
+        args.output, parse_count(args.cells), n_markers=args.markers, n_images=args.images,
+        label_fraction=args.label_fraction, label_noise=args.label_noise,
+        compartments=[c for c in args.compartments.split(",") if c], stats=[s for s in args.stats.split(",") if s],
+        seed=args.seed, first_image=args.first_image, chunk_rows=args.chunk_rows, panel_columns=args.panel_columns,
+    )
+    print(f"Wrote {args.output}: {n_rows} cells x {n_cols} columns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmarks for the scripts in bin/.
+
+For every size (default 10k, 1M and 10M cells in total) a synthetic cohort of QuPath
+exports (`--tables` files with distinct images) is generated once into the data
+directory, then each bin/ script runs in pipeline order in a fresh work directory, so
+later steps consume earlier steps' outputs (label counts, training tables, models,
+predictions, merged tables); a step whose inputs were not produced is skipped. Steps
+the pipeline runs once per table are timed on the first table, cohort-wide steps get
+all of them. Every run records wall time, CPU time and peak RSS (from os.wait4, i.e.
+the largest process in the script's process tree) and the results are compared
+against a stored baseline: a step that got slower or bigger beyond the tolerances, or
+that used to succeed and now fails, is a regression and makes the runner exit non-zero.
+
+    run_benchmarks.py --sizes 10k,1M --baseline benchmarks/baseline.json
+    run_benchmarks.py --sizes 10k --write-baseline benchmarks/baseline.json
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from generate_quant_table import parse_count, write_table
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+BIN_DIR = REPO_DIR / "bin"
+CONTEXT_COLUMNS = "Image,Centroid X µm,Centroid Y µm"
+
+# Pipeline order. Placeholders: {table} (the first input table), {stem}, {marker},
+# {nucleus}, {context}; an argument "{tables}" expands to every input table and
+# "{panel_tables}" to the same cohort generated with panel-design (`<marker>+`) columns,
+# "glob:<pattern>" to every match in the work directory and "first:<pattern>" to the
+# first one. `max_cells` skips steps too slow for big tables; `produces` is a pattern
+# the step must write to count as having done its work (a step that exits 0 without
+# it, e.g. because no input column matched, is recorded as "no_work", not timed as ok).
+CASES = [
+    {"name": "stats_catalog", "argv": ["stats_catalog.py", "{table}"]},
+    {"name": "analyze_panel_design", "argv": ["analyze_panel_design.py", "bench", "{panel_tables}"],
+     "produces": "Marker_Analysis_Report_*.png"},
+    {"name": "extract_label_column", "argv": ["extract_label_column.py", "{table}", "{stem}_label_only.tsv", "Classification"]},
+    {"name": "binary_counter", "argv": ["binary_counter.py", "label_counts.tsv", "Classification", "{tables}"]},
+    {"name": "relabel_synthetic_negatives", "argv": ["relabel_synthetic_negatives.py", "{table}", "label_counts.tsv",
+                                                      "8", "12", "True", "Classification", "{context}"]},
+    {"name": "binary_table", "argv": ["binary_table.py", "perlabel_table.tsv", "Classification", "first:*_mod.tsv"]},
+    {"name": "boxcox_transformer", "argv": ["boxcox_transformer.py", "first:*_mod.tsv", "CellObject", "{nucleus}",
+                                             "Image", "bench", "false"]},
+    {"name": "preprocess_quant_table", "argv": ["preprocess_quant_table.py", "{table}", "--output-table", "{stem}_preprocessed.tsv",
+                                                 "--summary-csv", "{stem}_gmm_summary.csv", "--summary-plot", "{stem}_gmm_summary.png",
+                                                 "--run-gmmgating"]},
+    {"name": "generate_training_sets", "argv": ["generate_training_sets.py", "Classification", "|", "{tables}"]},
+    {"name": "fit_models", "argv": ["fit_models.py", "first:training_{marker}_*.tsv"], "max_cells": 1_000_000},
+    {"name": "best_model_predictions", "argv": ["best_model_predictions.py", "first:*_best_model_*.pkl", "{table}"]},
+    {"name": "merge_preds", "argv": ["merge_preds.py", "{stem}", "glob:*_PRED.tsv"]},
+    {"name": "generate_reports_per_image", "argv": ["generate_reports_per_image.py", "first:{stem}_MERGED.tsv", "{stem}", "glob:*_PRED.tsv"]},
+    {"name": "recombine_predictions_with_context", "argv": ["recombine_predictions_with_context.py", "first:{stem}_MERGED.tsv",
+                                                             "--context-columns", "{context}", "--output", "{stem}_FINAL.tsv", "{tables}"]},
+    {"name": "marker_recovery_pipeline", "argv": ["marker_recovery_pipeline.py", "--marker", "{marker}", "--output-dir",
+                                                   "marker_recovery", "--checkpoint-dir", "", "{tables}"], "max_cells": 1_000_000},
+    {"name": "build_html_report", "argv": ["build_html_report.py", "--format", "json", "--step", "BENCH", "--title", "Benchmark",
+                                            "--output", "bench_summary.json", "--inputs", "{tables}"]},
+    {"name": "aggregate_reports", "argv": ["aggregate_reports.py", "--output-dir", "run_report", "glob:*_summary.json"]},
+]
+
+
+def size_label(n_cells):
+    for factor, suffix in ((1_000_000, "M"), (1_000, "k")):
+        if n_cells >= factor and n_cells % factor == 0:
+            return f"{n_cells // factor}{suffix}"
+    return str(n_cells)
+
+
+def ensure_tables(data_dir, n_cells, n_tables, images_per_table, seed, panel_columns=False):
+    """Generate the synthetic cohort for this size once; later runs reuse it."""
+    data_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for i in range(n_tables):
+        rows = n_cells // n_tables + (1 if i < n_cells % n_tables else 0)
+        kind = "_panel" if panel_columns else ""
+        path = data_dir / f"bench_{size_label(n_cells)}_{n_tables}x_s{seed}{kind}_{i + 1}.tsv"
+        if not path.exists():
+            start = time.perf_counter()
+            tmp = path.with_name(path.name + ".tmp")
+            write_table(tmp, rows, n_images=images_per_table, seed=seed + i, first_image=i * images_per_table,
+                        panel_columns=panel_columns)
+            os.replace(tmp, path)
+            print(f"Generated {path} in {time.perf_counter() - start:.1f}s")
+        paths.append(path)
+    return paths
+
+
+def resolve_argv(template, work_dir, values):
+    argv = []
+    for arg in template:
+        if arg in ("{tables}", "{panel_tables}"):
+            argv.extend(values[arg.strip("{}")])
+            continue
+        arg = arg.format(**values)
+        if arg.startswith(("glob:", "first:")):
+            kind, pattern = arg.split(":", 1)
+            matches = sorted(os.path.relpath(p, work_dir) for p in glob.glob(str(work_dir / pattern)))
+            if not matches:
+                return None, f"no input matching {pattern}"
+            argv.extend(matches if kind == "glob" else matches[:1])
+        else:
+            argv.append(arg)
+    return argv, None
+
+
+def run_measured(argv, cwd, log_path, timeout, env=None):
+    """Run a command and return (returncode, wall seconds, cpu seconds, peak RSS in MB)."""
+    start = time.perf_counter()
+    with open(log_path, "w") as log:
+        proc = subprocess.Popen(argv, cwd=cwd, stdout=log, stderr=subprocess.STDOUT, env=env)
+        while True:
+            pid, status, usage = os.wait4(proc.pid, os.WNOHANG)
+            if pid:
+                break
+            if timeout and time.perf_counter() - start > timeout:
+                proc.kill()
+                pid, status, usage = os.wait4(proc.pid, 0)
+                break
+            time.sleep(0.05)
+    wall = time.perf_counter() - start
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss_mb = usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    return proc.returncode, wall, usage.ru_utime + usage.ru_stime, rss_mb
+
+
+def trace_spans(perf_dir):
+    """Wall seconds per span from the `*_perf.json` traces a step wrote (empty if it has none)."""
+    spans = {}
+    for path in sorted(Path(perf_dir).glob("*_perf.json")):
+        try:
+            trace = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        for span in trace.get("spans", []):
+            spans[span["name"]] = round(spans.get(span["name"], 0.0) + span.get("wall_s", 0.0), 3)
+    return spans
+
+
+def link_tables(tables, work_dir, prefix):
+    """Symlink the tables into the work directory (scripts write outputs next to their inputs)."""
+    names = []
+    for i, table in enumerate(tables):
+        local = work_dir / f"{prefix}_{i + 1}.tsv"
+        os.symlink(table.resolve(), local)
+        names.append(local.name)
+    return names
+
+
+def run_size(n_cells, args):
+    cases = [c for c in CASES if not args.cases or c["name"] in args.cases]
+    tables = ensure_tables(Path(args.data_dir), n_cells, args.tables, args.images_per_table, args.seed)
+    work_dir = Path(args.work_dir) / size_label(n_cells)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    work_dir.mkdir(parents=True)
+    local_tables = link_tables(tables, work_dir, f"bench_{size_label(n_cells)}")
+    # The panel-column cohort is only generated when a selected case reads it
+    panel_tables = []
+    if any("{panel_tables}" in c["argv"] for c in cases):
+        panel_tables = link_tables(ensure_tables(Path(args.data_dir), n_cells, args.tables, args.images_per_table,
+                                                 args.seed, panel_columns=True), work_dir, f"panel_{size_label(n_cells)}")
+    values = {"table": local_tables[0], "tables": local_tables, "panel_tables": panel_tables,
+              "stem": Path(local_tables[0]).stem, "marker": args.marker, "nucleus": args.nucleus_marker,
+              "context": CONTEXT_COLUMNS}
+
+    results = []
+    for case in cases:
+        record = {"case": case["name"], "cells": n_cells}
+        argv, missing = resolve_argv(case["argv"], work_dir, values)
+        if n_cells > case.get("max_cells", float("inf")):
+            record["status"] = "skipped"
+            record["reason"] = f"more than {case['max_cells']} cells"
+        elif argv is None:
+            record["status"] = "skipped"
+            record["reason"] = missing
+        else:
+            log_path = work_dir / f"{case['name']}.log"
+            # The script's own perf trace goes to a directory per case, for the span breakdown
+            perf_dir = work_dir / "perf" / case["name"]
+            env = dict(os.environ, BINFLOW_PERF_DIR=str(perf_dir))
+            rc, wall, cpu, rss = run_measured([sys.executable, str(BIN_DIR / argv[0])] + argv[1:], work_dir, log_path,
+                                              args.timeout, env=env)
+            status = "ok" if rc == 0 else ("timeout" if args.timeout and wall > args.timeout else "failed")
+            if status == "ok" and case.get("produces") and not glob.glob(str(work_dir / case["produces"])):
+                status = "no_work"
+                record["reason"] = f"exited 0 without writing {case['produces']}"
+            record.update({
+                "status": status,
+                "returncode": rc,
+                "wall_s": round(wall, 3),
+                "cpu_s": round(cpu, 3),
+                "max_rss_mb": round(rss, 1),
+                "cells_per_s": round(n_cells / wall, 1) if wall > 0 else None,
+                "spans": trace_spans(perf_dir),
+            })
+        print(format_record(record))
+        results.append(record)
+    if not args.keep_work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def format_record(record):
+    head = f"{record['case']:<38} {size_label(record['cells']):>5}"
+    if record["status"] == "skipped":
+        return f"{head}  skipped ({record['reason']})"
+    line = f"{head}  {record['status']:<7} {record['wall_s']:>9.2f}s {record['max_rss_mb']:>9.1f} MB"
+    return f"{line}  ({record['reason']})" if "reason" in record else line
+
+
+def compare(results, baseline, time_tolerance, rss_tolerance, min_seconds, min_rss_mb):
+    """Regressions of `results` against `baseline`, as human-readable strings."""
+    previous = {(r["case"], r["cells"]): r for r in baseline.get("results", [])}
+    regressions = []
+    for r in results:
+        base = previous.get((r["case"], r["cells"]))
+        if base is None or r["status"] == "skipped" or base.get("status") != "ok":
+            continue
+        key = f"{r['case']} @ {size_label(r['cells'])}"
+        if r["status"] != "ok":
+            regressions.append(f"{key}: {r['status']} (baseline ok)")
+            continue
+        if r["wall_s"] > base["wall_s"] * (1 + time_tolerance) and r["wall_s"] - base["wall_s"] > min_seconds:
+            regressions.append(f"{key}: wall {base['wall_s']:.2f}s -> {r['wall_s']:.2f}s")
+        if r["max_rss_mb"] > base["max_rss_mb"] * (1 + rss_tolerance) and r["max_rss_mb"] - base["max_rss_mb"] > min_rss_mb:
+            regressions.append(f"{key}: peak RSS {base['max_rss_mb']:.0f} MB -> {r['max_rss_mb']:.0f} MB")
+    return regressions
+
+
+def main():
+    here = Path(__file__).resolve().parent
+    ap = argparse.ArgumentParser(description="Benchmark the bin/ scripts on synthetic QuPath tables.")
+    ap.add_argument("--sizes", default="10k,1M,10M", help="Comma-separated table sizes in cells")
+    ap.add_argument("--tables", type=int, default=3, help="Quantification tables the cells are split over")
+    ap.add_argument("--images-per-table", type=int, default=2)
+    ap.add_argument("--cases", default="", help="Comma-separated subset of steps to run (default: all)")
+    ap.add_argument("--marker", default="CD3", help="Marker used by the single-marker steps")
+    ap.add_argument("--nucleus-marker", default="DAPI")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--data-dir", default=str(here / "data"), help="Where generated tables are kept between runs")
+    ap.add_argument("--work-dir", default=str(here / "work"))
+    ap.add_argument("--keep-work-dir", action="store_true")
+    ap.add_argument("--timeout", type=float, default=3600, help="Seconds before a step is killed (0: no limit)")
+    ap.add_argument("--output", default=None, help="Results JSON (default: benchmarks/results/<timestamp>.json)")
+    ap.add_argument("--baseline", default=None, help="Baseline results JSON to compare against")
+    ap.add_argument("--write-baseline", default=None, help="Also write these results as the new baseline")
+    ap.add_argument("--time-tolerance", type=float, default=0.20, help="Allowed relative wall-time increase")
+    ap.add_argument("--rss-tolerance", type=float, default=0.20, help="Allowed relative peak-RSS increase")
+    ap.add_argument("--min-seconds", type=float, default=1.0, help="Ignore wall-time increases smaller than this")
+    ap.add_argument("--min-rss-mb", type=float, default=50.0, help="Ignore peak-RSS increases smaller than this")
+    args = ap.parse_args()
+    args.cases = {c.strip() for c in args.cases.split(",") if c.strip()}
+
+    created = datetime.now(timezone.utc)
+    results = []
+    for size in [s for s in args.sizes.split(",") if s.strip()]:
+        results.extend(run_size(parse_count(size), args))
+
+    report = {
+        "created_utc": created.isoformat(),
+        "git_commit": subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                     capture_output=True, text=True).stdout.strip(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    output = Path(args.output) if args.output else here / "results" / f"{created.strftime('%Y%m%dT%H%M%SZ')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"Wrote {output}")
+    if args.write_baseline:
+        Path(args.write_baseline).write_text(json.dumps(report, indent=2))
+        print(f"Wrote baseline {args.write_baseline}")
+
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.time_tolerance,
+                              args.rss_tolerance, args.min_seconds, args.min_rss_mb)
+        if regressions:
+            print(f"{len(regressions)} regression(s) against {args.baseline}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
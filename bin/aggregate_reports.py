@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Render one indexed HTML report for a whole run from the per-step JSON summaries
+written by `build_html_report.py --format json`.
+
+Each pipeline task only records counts, shapes and timings; the figures are drawn
+here once, in a process pool, at the end of the run.
+"""
+import argparse
+import html
+import json
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from cpu_budget import available_cpus
+
+
+def slugify(text):
+    return re.sub(r'[^A-Za-z0-9]+', '-', text).strip('-').lower() or 'step'
+
+
+def load_summaries(paths):
+    summaries = []
+    for p in paths:
+        try:
+            summary = json.loads(Path(p).read_text(encoding='utf-8'))
+        except (OSError, ValueError) as e:
+            print(f"Skipping unreadable summary {p}: {e}")
+            continue
+        summary['_source'] = os.path.basename(str(p))
+        summaries.append(summary)
+    # Run order: steps appear in the report as they finished in the workflow (group_by_step
+    # keeps first occurrences); summaries without a timestamp go last, names break ties
+    summaries.sort(key=lambda s: ('generated_utc' not in s, s.get('generated_utc', ''),
+                                  s.get('step', ''), s.get('title', ''), s['_source']))
+    return summaries
+
+
+def group_by_step(summaries):
+    steps = OrderedDict()
+    for summary in summaries:
+        steps.setdefault(summary.get('step') or summary.get('title', 'step'), []).append(summary)
+    return steps
+
+
+def draw_histogram(job):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    hist, out_path = job['hist'], job['out_path']
+    edges, counts = hist['edges'], hist['counts']
+    widths = [b - a for a, b in zip(edges[:-1], edges[1:])]
+    fig, ax = plt.subplots(figsize=(5, 3))
+    ax.bar(edges[:-1], counts, width=widths, align='edge')
+    ax.set_title(f"Histogram: {hist['column']}")
+    fig.tight_layout()
+    fig.savefig(out_path, dpi=100)
+    plt.close(fig)
+    return out_path
+
+
+def draw_timings(job):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    labels, totals, out_path = job['labels'], job['totals'], job['out_path']
+    fig, ax = plt.subplots(figsize=(7, max(2, 0.35 * len(labels) + 1)))
+    ax.barh(labels, totals)
+    ax.invert_yaxis()
+    ax.set_xlabel('Total wall time (s)')
+    fig.tight_layout()
+    fig.savefig(out_path, dpi=100)
+    plt.close(fig)
+    return out_path
+
+
+def draw_figure(job):
+    if job['kind'] == 'timings':
+        return draw_timings(job)
+    return draw_histogram(job)
+
+
+def step_timings(steps):
+    rows = []
+    for step, tasks in steps.items():
+        times = [t['elapsed_seconds'] for t in tasks if t.get('elapsed_seconds') is not None]
+        rows.append({
+            'step': step,
+            'tasks': len(tasks),
+            'total_s': round(sum(times), 1) if times else None,
+            'max_s': round(max(times), 1) if times else None,
+        })
+    return rows
+
+
+def plan_figures(steps, fig_dir):
+    """Figure jobs for the timing chart and every summarised table that has a histogram."""
+    jobs = []
+    timings = [r for r in step_timings(steps) if r['total_s'] is not None]
+    if timings:
+        jobs.append({'kind': 'timings', 'labels': [r['step'] for r in timings],
+                     'totals': [r['total_s'] for r in timings], 'out_path': str(fig_dir / 'step_timings.png')})
+    for step, tasks in steps.items():
+        for t_idx, task in enumerate(tasks):
+            for i_idx, entry in enumerate(task.get('inputs', [])):
+                hist = (entry.get('tsv') or {}).get('hist')
+                if not hist or not hist.get('counts'):
+                    continue
+                out_path = fig_dir / f"{slugify(step)}_{t_idx}_{i_idx}.png"
+                entry['_figure'] = str(out_path)
+                jobs.append({'kind': 'hist', 'hist': hist, 'out_path': str(out_path)})
+    return jobs
+
+
+def render_figures(jobs, workers):
+    if not jobs:
+        return
+    workers = max(1, min(len(jobs), workers))
+    if workers == 1:
+        for job in jobs:
+            draw_figure(job)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(draw_figure, jobs, chunksize=max(1, len(jobs) // (4 * workers))))
+
+
+def split_frame(data):
+    if not data:
+        return None
+    return pd.DataFrame(data['data'], columns=data['columns'], index=data.get('index'))
+
+
+def render_entry(entry, out_dir):
+    parts = []
+    name = html.escape(entry.get('name', ''))
+    if not entry.get('exists', True):
+        return f"<h4>{name}</h4><p>Missing</p>"
+    parts.append(f"<h4>{name}</h4>")
+    if entry.get('error'):
+        parts.append(f"<p>Failed to summarize: {html.escape(entry['error'])}</p>")
+    tsv = entry.get('tsv')
+    if tsv:
+        cols = ', '.join(html.escape(c) for c in tsv['columns'])
+        more = '' if tsv['n_columns'] <= len(tsv['columns']) else ' ...'
+        parts.append(f"<p>Rows: {tsv['n_rows']} ({html.escape(tsv['row_source'])}) | Columns: {tsv['n_columns']}</p>")
+        parts.append(f"<p><small>{cols}{more}</small></p>")
+        head = split_frame(tsv.get('head'))
+        if head is not None:
+            parts.append('<h5>Head</h5>' + head.to_html(border=0, index=False, escape=True))
+        describe = split_frame(tsv.get('describe'))
+        if describe is not None and not describe.empty:
+            parts.append(f"<h5>Describe ({html.escape(tsv.get('describe_source') or '')})</h5>"
+                         + describe.to_html(border=0, escape=True, float_format=lambda v: f"{v:.4g}"))
+        if entry.get('_figure') and os.path.exists(entry['_figure']):
+            rel = os.path.relpath(entry['_figure'], out_dir)
+            parts.append(f"<img src='{html.escape(rel)}' style='max-width:600px;'>")
+    else:
+        parts.append(f"<p>{entry.get('kind', 'file')}, {entry.get('size_bytes', 0)} bytes</p>")
+    return '\n'.join(parts)
+
+
+def render_html(steps, title, out_dir, timings_fig=None):
+    toc = []
+    body = []
+    timings = step_timings(steps)
+    for step, tasks in steps.items():
+        anchor = slugify(step)
+        toc.append(f"<li><a href='#{anchor}'>{html.escape(step)}</a> ({len(tasks)})</li>")
+        body.append(f"<h2 id='{anchor}'>{html.escape(step)}</h2>")
+        for t_idx, task in enumerate(tasks):
+            elapsed = task.get('elapsed_seconds')
+            timing = f" &middot; {elapsed:.1f}s" if elapsed is not None else ''
+            body.append(f"<details id='{anchor}-{t_idx}'><summary>{html.escape(task.get('title', step))}"
+                        f" <small>[{html.escape(task['_source'])}{timing}]</small></summary>")
+            if task.get('notes'):
+                body.append(f"<p>{html.escape(task['notes'])}</p>")
+            body.extend(render_entry(entry, out_dir) for entry in task.get('inputs', []))
+            body.append('</details>')
+
+    overview = pd.DataFrame(timings).to_html(border=0, index=False, na_rep='') if timings else ''
+    timing_img = ''
+    if timings_fig and os.path.exists(timings_fig):
+        timing_img = f"<img src='{html.escape(os.path.relpath(timings_fig, out_dir))}' style='max-width:700px;'>"
+    return f"""<!doctype html>
+<html><head><meta charset='utf-8'><title>{html.escape(title)}</title>
+<style>body{{font-family:sans-serif;margin:20px;}} table{{border-collapse:collapse;}} th,td{{padding:4px 8px;border-bottom:1px solid #ddd;}}
+nav{{float:right;max-width:300px;border:1px solid #ddd;padding:8px;margin-left:16px;}} details{{margin:6px 0;}}</style>
+</head><body>
+<nav><h3>Steps</h3><ul>{''.join(toc)}</ul></nav>
+<h1>{html.escape(title)}</h1>
+<h2>Overview</h2>
+{overview}
+{timing_img}
+{''.join(body)}
+</body></html>"""
+
+
+def main():
+    ap = argparse.ArgumentParser(description='Render one run report from per-step JSON summaries.')
+    ap.add_argument('summaries', nargs='+')
+    ap.add_argument('--output-dir', default='run_report')
+    ap.add_argument('--title', default='BinFlow run report')
+    ap.add_argument('--workers', type=int, default=None, help='Processes used to draw figures (default: all CPUs)')
+    args = ap.parse_args()
+
+    out_dir = Path(args.output_dir)
+    fig_dir = out_dir / 'figures'
+    fig_dir.mkdir(parents=True, exist_ok=True)
+
+    steps = group_by_step(load_summaries(args.summaries))
+    jobs = plan_figures(steps, fig_dir)
+    render_figures(jobs, args.workers or available_cpus())
+    timings_fig = next((j['out_path'] for j in jobs if j['kind'] == 'timings'), None)
+
+    out = out_dir / 'index.html'
+    out.write_text(render_html(steps, args.title, out_dir, timings_fig), encoding='utf-8')
+    print(f"Wrote {out} ({sum(len(t) for t in steps.values())} step summaries, {len(jobs)} figures)")
+
+
+if __name__ == '__main__':
+    main()
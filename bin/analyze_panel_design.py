@@ -1,166 +1,230 @@
 #!/usr/bin/env python3
 
 import os
-import re
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
 import matplotlib.pyplot as plt
 import numpy as np
 
+import perf_trace
+from cpu_budget import available_cpus
+from stats_catalog import RESERVOIR_ROWS, catalog_percentile, load_catalog
+from table_reader import iter_table, read_header
+
+HIST_BINS = 20
+QUARTILES = (25, 50, 75)
+
+
+def is_marker_column(col):
+    return "Median" in col and ("+" in col or "-" in col)
+
+
+class MarkerStats:
+    """Running count/sum/sumsq/min/max for all marker columns, updated one 2D block at a time."""
+
+    def __init__(self, n_cols):
+        self.count = np.zeros(n_cols, dtype=np.int64)
+        self.sum = np.zeros(n_cols)
+        self.sumsq = np.zeros(n_cols)
+        self.min = np.full(n_cols, np.inf)
+        self.max = np.full(n_cols, -np.inf)
+
+    def update(self, block):
+        finite = np.isfinite(block)
+        vals = np.where(finite, block, 0.0)
+        self.count += finite.sum(axis=0)
+        self.sum += vals.sum(axis=0)
+        self.sumsq += (vals ** 2).sum(axis=0)
+        self.min = np.minimum(self.min, np.where(finite, block, np.inf).min(axis=0))
+        self.max = np.maximum(self.max, np.where(finite, block, -np.inf).max(axis=0))
+
 
-def load_selected_columns(file_path, chunk_size=40000):
+class FixedEdgeHistograms:
+    """One histogram per column with edges fixed up front, filled with a single bincount per block."""
+
+    def __init__(self, lo, hi, bins=HIST_BINS):
+        self.bins = bins
+        self.lo = np.asarray(lo, dtype=float)
+        span = np.asarray(hi, dtype=float) - self.lo
+        self.width = np.where(span > 0, span / bins, 1.0)
+        self.counts = np.zeros((len(self.lo), bins), dtype=np.int64)
+
+    def update(self, block):
+        finite = np.isfinite(block)
+        idx = np.floor((np.where(finite, block, 0.0) - self.lo) / self.width).astype(np.int64)
+        np.clip(idx, 0, self.bins - 1, out=idx)
+        flat = (idx + np.arange(block.shape[1]) * self.bins)[finite]
+        self.counts += np.bincount(flat, minlength=self.counts.size).reshape(self.counts.shape)
+
+    def edges(self, j):
+        return self.lo[j] + self.width[j] * np.arange(self.bins + 1)
+
+
+class RowReservoir:
     """
-    Load specific columns from a large file in chunks and combine them into a single DataFrame.
-    Excludes columns matching (Cytoplasm|Variance).
+    Uniform sample of up to `rows` rows of the marker block, kept as the rows with the
+    smallest random keys (as in the stats catalog); exact while the table fits in it.
     """
-    selected_columns = []
-    all_chunks = []
-    # Identify columns to keep
-    for first_chunk in pd.read_csv(file_path, chunksize=1, low_memory=False, sep='\t'):
-        columns = first_chunk.columns
-        exclude_regex = re.compile(r"(Cytoplasm|Variance)", re.IGNORECASE)
-        selected_columns = [col for col in columns if not exclude_regex.search(col)]
-        break
-    print(f"Selected columns: {selected_columns}")
-    # Read in chunks
-    with pd.read_csv(file_path, usecols=selected_columns, chunksize=chunk_size, low_memory=True, sep='\t') as reader:
-        for i, chunk in enumerate(reader):
-            all_chunks.append(chunk)
-            print(f"Processed chunk {i + 1}")
-    allLnData = pd.concat(all_chunks, axis=0, ignore_index=True)
-    return allLnData
-
-
-def process_large_file(file_path, stats_text, output_prefix, chunk_size=40000):
-    # Identify columns to keep
-    for first_chunk in pd.read_csv(file_path, chunksize=1, low_memory=False, sep='\t'):
-        columns = first_chunk.columns
-        exclude_regex = re.compile(r"(Cytoplasm|Membrane|Nucleus|Min|Variance|Std\.Dev\.)", re.IGNORECASE)
-        selected_columns = [col for col in columns if not exclude_regex.search(col)]
-        break
 
-    file_basename = os.path.basename(file_path).replace(".tsv", "")
+    def __init__(self, n_cols, rows=RESERVOIR_ROWS, seed=0):
+        self.rows = rows
+        self.rng = np.random.default_rng(seed)
+        self.keys = np.empty(0)
+        self.sample = np.empty((0, n_cols))
 
-    # Running stats: {marker: [count, sum, sumsq, min, max]}
-    running_stats = {}
-    hist_bins = 20
-    hist_data = {}
+    def update(self, block):
+        keys = np.concatenate([self.keys, self.rng.random(len(block))])
+        sample = np.concatenate([self.sample, block], axis=0)
+        if len(keys) > self.rows:
+            keep = np.argpartition(keys, self.rows)[:self.rows]
+            keys, sample = keys[keep], sample[keep]
+        self.keys, self.sample = keys, sample
+
+    def percentiles(self, j, percentiles=QUARTILES):
+        values = self.sample[:, j]
+        values = values[np.isfinite(values)]
+        return [float(v) for v in np.percentile(values, percentiles)] if values.size else [float("nan")] * len(percentiles)
 
-    # Process each chunk
-    for chunk in pd.read_csv(file_path, usecols=selected_columns, chunksize=chunk_size, low_memory=True, sep='\t'):
-        numeric_chunk = chunk.select_dtypes(include=["number"])
-        markers = [col for col in numeric_chunk.columns if "Median" in col and ("+" in col or "-" in col)]
-        if not markers:
-            continue
 
-        # Update running stats and histograms
-        for marker in markers:
-            vals = numeric_chunk[marker].dropna().values
-            if vals.size == 0:
-                continue
-            # Running stats
-            if marker not in running_stats:
-                running_stats[marker] = {
-                    'count': 0, 'sum': 0.0, 'sumsq': 0.0, 'min': np.inf, 'max': -np.inf
-                }
-                hist_data[marker] = np.zeros(hist_bins)
-            rs = running_stats[marker]
-            rs['count'] += vals.size
-            rs['sum'] += vals.sum()
-            rs['sumsq'] += np.sum(vals ** 2)
-            rs['min'] = min(rs['min'], np.min(vals))
-            rs['max'] = max(rs['max'], np.max(vals))
-            # Histogram (aggregate)
-            hist, bin_edges = np.histogram(vals, bins=hist_bins, range=(rs['min'], rs['max']))
-            hist_data[marker][:] += hist
-
-    # Generate histograms and stats for each marker
-    for marker in running_stats:
-        # Plot histogram
-        fig, ax = plt.subplots(figsize=(10, 6))
-        bin_edges = np.linspace(running_stats[marker]['min'], running_stats[marker]['max'], hist_bins + 1)
-        ax.bar((bin_edges[:-1] + bin_edges[1:]) / 2, hist_data[marker], width=(bin_edges[1] - bin_edges[0]), color="steelblue", edgecolor="black")
-        ax.set_title(marker, fontsize=14)
-        ax.set_xlabel("Value", fontsize=12)
-        ax.set_ylabel("Count", fontsize=12)
+def iter_marker_blocks(file_path, markers, chunk_size=None):
+    for chunk in iter_table(file_path, usecols=markers, chunksize=chunk_size):
+        yield chunk[markers].to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def fixed_edges(lo, hi, bins):
+    """`bins` equal-width edges over [lo, hi], as FixedEdgeHistograms draws them."""
+    width = (hi - lo) / bins if hi > lo else 1.0
+    return lo + width * np.arange(bins + 1)
+
+
+def rebin(counts, edges, new_edges):
+    """Counts of one histogram redistributed onto other edges, assuming values spread evenly within each bin."""
+    cdf = np.concatenate([[0.0], np.cumsum(counts, dtype=float)])
+    return np.diff(np.interp(new_edges, edges, cdf))
+
+
+def summarize_from_catalog(catalog, markers, bins=HIST_BINS):
+    """
+    Per-marker stats straight from the ingest stats catalog: quartiles from its quantile
+    sketch, histograms (finer) rebinned to the `bins` equal-width bins of the two-pass
+    path so the plots do not depend on whether a sidecar exists.
+    """
+    results = {}
+    for marker in markers:
+        col_stats = catalog["stats"].get(marker)
+        if not col_stats or not col_stats["count"]:
+            continue
+        results[marker] = {
+            "count": col_stats["count"],
+            "mean": col_stats["mean"],
+            "std": float(np.sqrt(col_stats["variance"])),
+            "min": col_stats["min"],
+            "max": col_stats["max"],
+            "quartiles": [catalog_percentile(catalog, marker, p) for p in QUARTILES],
+        }
+        edges = fixed_edges(col_stats["min"], col_stats["max"], bins)
+        results[marker]["hist_counts"] = rebin(col_stats["hist_counts"], col_stats["hist_edges"], edges)
+        results[marker]["hist_edges"] = edges
+    return results
+
+
+def summarize_two_pass(file_path, markers, bins=HIST_BINS, chunk_size=None):
+    """
+    Pass 1 collects moments, the global min/max and a row sample (for the quartiles) of
+    every marker; pass 2 fills the plot histograms whose edges are fixed from that
+    range, so all chunks share bins.
+    """
+    stats = MarkerStats(len(markers))
+    reservoir = RowReservoir(len(markers))
+    for block in iter_marker_blocks(file_path, markers, chunk_size):
+        stats.update(block)
+        reservoir.update(block)
+    has_data = stats.count > 0
+    hists = FixedEdgeHistograms(np.where(has_data, stats.min, 0.0), np.where(has_data, stats.max, 1.0), bins)
+    for block in iter_marker_blocks(file_path, markers, chunk_size):
+        hists.update(block)
+
+    results = {}
+    for j, marker in enumerate(markers):
+        count = int(stats.count[j])
+        if not count:
+            continue
+        mean = stats.sum[j] / count
+        var = stats.sumsq[j] / count - mean ** 2
+        results[marker] = {
+            "count": count,
+            "mean": float(mean),
+            "std": float(np.sqrt(var)) if var >= 0 else float("nan"),
+            "min": float(stats.min[j]),
+            "max": float(stats.max[j]),
+            "quartiles": reservoir.percentiles(j),
+            "hist_counts": hists.counts[j],
+            "hist_edges": hists.edges(j),
+        }
+    return results
+
+
+def plot_marker_groups(results, output_prefix):
+    markers = list(results)
+    marker_groups = [markers[i:i + 3] for i in range(0, len(markers), 3)]
+    for idx, group in enumerate(marker_groups):
+        fig, axes = plt.subplots(1, len(group), figsize=(15, 5))
+        if len(group) == 1:  # Ensure axes is always iterable
+            axes = [axes]
+        for ax, marker in zip(axes, group):
+            counts, edges = results[marker]["hist_counts"], results[marker]["hist_edges"]
+            ax.bar((edges[:-1] + edges[1:]) / 2, counts, width=np.diff(edges), color="steelblue", edgecolor="black")
+            ax.set_title(marker, fontsize=10)
+            ax.set_xlabel("Value", fontsize=8)
+            ax.set_ylabel("Count", fontsize=8)
         plt.tight_layout()
-        safe_marker = re.sub(r"[^A-Za-z0-9]+", "_", marker).strip("_")
-        out_png = f"{output_prefix}_{safe_marker}.png"
-        fig.savefig(out_png, dpi=150)
+        fig.savefig(f"{output_prefix}_group{idx+1}.png", dpi=150)
         plt.close(fig)
 
-        # Compute statistics
-        count = running_stats[marker]['count']
-        mean = running_stats[marker]['sum'] / count if count else float('nan')
-        var = (running_stats[marker]['sumsq'] / count - mean ** 2) if count else float('nan')
-        std = np.sqrt(var) if var >= 0 else float('nan')
-        minv = running_stats[marker]['min']
-        maxv = running_stats[marker]['max']
 
+def analyze_file(file_path, output_prefix, bins=HIST_BINS):
+    """Worker entry point: summarise, plot and return the statistics text for one table."""
+    file_basename = os.path.basename(file_path).replace(".tsv", "")
+    markers = [col for col in read_header(file_path) if is_marker_column(col)]
+    if not markers:
+        print(f"No markers found in {file_path}.")
+        return []
+
+    catalog = load_catalog(file_path)
+    if catalog is not None:
+        results = summarize_from_catalog(catalog, markers, bins=bins)
+    else:
+        results = summarize_two_pass(file_path, markers, bins=bins)
+    plot_marker_groups(results, f"{output_prefix}_{file_basename}")
+
+    stats_text = [f"Statistics for {file_basename}:", ""]
+    for marker, res in results.items():
         stats_text.append(f"Marker: {marker}")
-        stats_text.append(f"  count: {count}")
-        stats_text.append(f"  mean: {mean:.2f}")
-        stats_text.append(f"  std: {std:.2f}")
-        stats_text.append(f"  min: {minv:.2f}")
-        stats_text.append(f"  max: {maxv:.2f}")
+        stats_text.append(f"  count: {res['count']}")
+        stats_text.append(f"  mean: {res['mean']:.2f}")
+        stats_text.append(f"  std: {res['std']:.2f}")
+        stats_text.append(f"  min: {res['min']:.2f}")
+        for p, value in zip(QUARTILES, res["quartiles"]):
+            stats_text.append(f"  {p}%: {value:.2f}")
+        stats_text.append(f"  max: {res['max']:.2f}")
         stats_text.append("")
+    return stats_text
 
 
-def generate_histograms_and_stats(tsv_files, output_prefix):
-    """Generate histogram PNGs and a TSV statistics report."""
+def generate_histograms_and_stats(tsv_files, output_prefix, max_workers=None):
+    """Generate histogram PNGs and a statistics report, one worker process per input file."""
+    max_workers = max(1, min(len(tsv_files), max_workers or available_cpus()))
     stats_text = []
-
-    for file in tsv_files:
-        try:
-            file_size_mb = os.path.getsize(file) / (1024 * 1024)
-            if file_size_mb > 800:
-                print(f"File {file} is large ({file_size_mb:.1f} MB), using chunked reading.")
-                file_basename = os.path.basename(file).replace(".tsv", "")
-                process_large_file(file, stats_text, f"{output_prefix}_{file_basename}")
-            else:
-                df = pd.read_csv(file, sep="\t", low_memory=False)
-                numeric_df = df.select_dtypes(include=["number"])
-
-                file_basename = os.path.basename(file).replace(".tsv", "")
-                markers = [col for col in numeric_df.columns if "Median" in col and ("+" in col or "-" in col)]
-
-                if not markers:
-                    print(f"No markers found in {file}.")
-                    continue
-
-                # Split markers into groups of three for plotting
-                marker_groups = [markers[i:i + 3] for i in range(0, len(markers), 3)]
-
-                # Generate histograms for each marker group
-                for idx, group in enumerate(marker_groups):
-                    fig, axes = plt.subplots(1, len(group), figsize=(15, 5))
-
-                    if len(group) == 1:  # Ensure axes is always iterable
-                        axes = [axes]
-
-                    for ax, marker in zip(axes, group):
-                        ax.hist(numeric_df[marker].dropna(), bins=20, color="steelblue", edgecolor="black")
-                        ax.set_title(marker, fontsize=10)
-                        ax.set_xlabel("Value", fontsize=8)
-                        ax.set_ylabel("Count", fontsize=8)
-
-                    plt.tight_layout()
-                    out_png = f"{output_prefix}_{file_basename}_group{idx+1}.png"
-                    fig.savefig(out_png, dpi=150)
-                    plt.close(fig)
-
-                # Collect statistics for the file
-                stats_text.append(f"""Statistics for {file_basename}: 
-                """)
-                for marker in markers:
-                    stats = numeric_df[marker].describe()
-                    stats_text.append(f"Marker: {marker}")
-                    for stat_name, value in stats.items():
-                        stats_text.append(f"  {stat_name}: {value:.2f}")
-                    stats_text.append("""
-                     """)
-        except Exception as e:
-            print(f"Error processing {file}: {e}")
-            continue
+    # Workers are separate processes, so the trace times the whole pool from here
+    with perf_trace.span("analyze_files") as pool_span, ProcessPoolExecutor(max_workers=max_workers) as pool:
+        pool_span["n_files"] = len(tsv_files)
+        pool_span["workers"] = max_workers
+        futures = {file: pool.submit(analyze_file, file, output_prefix) for file in tsv_files}
+        for file, future in futures.items():
+            try:
+                stats_text.extend(future.result())
+            except Exception as e:
+                print(f"Error processing {file}: {e}")
 
     stats_file = f"{output_prefix}_statistics.txt"
     with open(stats_file, "w") as fh:
@@ -177,6 +241,5 @@ if __name__ == "__main__":
     _letterhead = sys.argv[1]  # kept for CLI compatibility
     tsv_files = sys.argv[2:]
     output_prefix = "Marker_Analysis_Report"
+    perf_trace.start("analyze_panel_design")
     generate_histograms_and_stats(tsv_files, output_prefix)
-
-
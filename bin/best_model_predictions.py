@@ -4,27 +4,29 @@ import pandas as pd
 import pickle
 from sklearn.pipeline import Pipeline
 
+import perf_trace
+from table_reader import read_header
+
 # Load the best model
 def load_model(model_path):
     with open(model_path, 'rb') as f:
         model = pickle.load(f)
     return model
 
-# Prepare the data for prediction
-def prepare_data(df, model):
-    if isinstance(model, Pipeline):
-        preprocessor = model.named_steps['preprocessor']
-        feature_columns = sum([list(t[2]) for t in preprocessor.transformers_ if len(t) > 2], [])
-    else:
+# Columns the model's preprocessor was fitted on (also used by route_predictions.py)
+def feature_columns(model):
+    if not isinstance(model, Pipeline):
         raise ValueError("Model is not a Pipeline with a preprocessor.")
-    print("Expected columns:", feature_columns)
-    missing = [col for col in feature_columns if col not in df.columns]
-    print("Input columns:", list(df.columns))
+    preprocessor = model.named_steps['preprocessor']
+    return sum([list(t[2]) for t in preprocessor.transformers_ if len(t) > 2 and t[1] != 'drop'], [])
+
+# Feature columns missing from a table, checked from its header before any row is read
+def missing_columns(model, columns):
+    expected = feature_columns(model)
+    print("Expected columns:", expected)
+    missing = [col for col in expected if col not in columns]
     print("Missing columns:", missing)
-    if len(missing) > 1:
-        print("Too many missing columns, returning null DataFrame for prediction.")
-        return None
-    return df[feature_columns]
+    return missing
 
 # Make predictions
 def make_predictions(model, data):
@@ -32,8 +34,9 @@ def make_predictions(model, data):
     prediction_probas = model.predict_proba(data)[:,1]
     return predictions, prediction_probas
 
-# Save the output with only 'Centroid' columns and predictions
-def save_predictions(df, predictions, probabilities, output_path):
+# Save the output with only 'Centroid' columns and predictions, plus the marker's
+# intensity column so report plots don't need to re-read the labeled table
+def save_predictions(df, predictions, probabilities, output_path, intensity_columns=()):
     centroid_and_image_columns = [col for col in df.columns if "centroid" in col.lower() or "image" in col.lower()]
     if not centroid_and_image_columns:
         raise ValueError(f"No centroid or image columns found in input DataFrame. Columns present: {list(df.columns)}")
@@ -43,21 +46,34 @@ def save_predictions(df, predictions, probabilities, output_path):
     else:
         df_output['Predictions'] = predictions
         df_output['Probabilities'] = probabilities # added Probabilities for showing output curve
+        for col in intensity_columns:
+            if col in df.columns:
+                df_output[col] = df[col].values
     df_output.to_csv(output_path, sep='\t', index=False)
     print(f"Predictions saved to {output_path}")
 
 # Main workflow
-def main(model_path, input_data_path, output_path):
-    model = load_model(model_path)
+def main(model_path, input_data_path, output_path, marker=None):
+    with perf_trace.span("load_model"):
+        model = load_model(model_path)
     print(f"Loaded model from {model_path}")
-    df = pd.read_csv(input_data_path, sep='\t')
+    if missing_columns(model, read_header(input_data_path)):
+        # The pipeline routes such pairs away (route_predictions.py); run by hand, write "NA" predictions
+        print("Table lacks the model's feature columns, writing NA predictions.")
+        with perf_trace.span("read"):
+            df = pd.read_csv(input_data_path, sep='\t', usecols=lambda c: "centroid" in c.lower() or "image" in c.lower())
+            perf_trace.add_rows(len(df))
+        save_predictions(df, None, None, output_path)
+        return
+    with perf_trace.span("read"):
+        df = pd.read_csv(input_data_path, sep='\t')
+        perf_trace.add_rows(len(df))
     print(f"Loaded data from {input_data_path}")
-    data_for_prediction = prepare_data(df, model)
-    if data_for_prediction is None:
-        save_predictions(df, None, output_path)
-    else:
-        predictions, probabilities = make_predictions(model, data_for_prediction)
-        save_predictions(df, predictions, probabilities, output_path)
+    with perf_trace.span("predict", rows=len(df)):
+        predictions, probabilities = make_predictions(model, df[feature_columns(model)])
+    intensity_columns = [f"{marker}: Cell: Median"] if marker else []
+    with perf_trace.span("write", rows=len(df)):
+        save_predictions(df, predictions, probabilities, output_path, intensity_columns=intensity_columns)
 
 def extract_marker(filename):
     parts = filename.split("_")
@@ -73,11 +89,13 @@ if __name__ == "__main__":
         sys.exit(1)
     model_path = sys.argv[1]
     input_data_path = sys.argv[2]
+    perf_trace.start("best_model_predictions")
 
     preFh = os.path.basename(input_data_path)
     lblName = extract_marker(model_path)
     print(f"On Marker: {lblName}")
+    perf_trace.annotate(marker=os.path.splitext(lblName)[0])
     output_path = f"{preFh}_predictions_{lblName}_PRED.tsv"
 
-    main(model_path, input_data_path, output_path)
+    main(model_path, input_data_path, output_path, marker=os.path.splitext(lblName)[0])
 
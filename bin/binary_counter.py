@@ -3,6 +3,8 @@ import os
 import sys
 import pandas as pd
 
+import perf_trace
+
 # --- Configuration ---
 if len(sys.argv) < 4:
     print("Usage: binary_counter.py <output_table> <label_column> <file1> [<file2> ...]")
@@ -11,12 +13,15 @@ if len(sys.argv) < 4:
 summary_table = sys.argv[1]
 label_column = sys.argv[2]
 file_list = sys.argv[3:]
+perf_trace.start("binary_counter")
 
 summary_data = []  # List to store the summary counts
 
 for file_path in file_list:
     try:
-        df = pd.read_csv(file_path, sep="\t", usecols=[label_column], low_memory=True)
+        with perf_trace.span("read"):
+            df = pd.read_csv(file_path, sep="\t", usecols=[label_column], low_memory=True)
+            perf_trace.add_rows(len(df))
     except Exception as e:
         print(f"Error reading {file_path}: {e}")
         summary_data.append({"file": os.path.basename(file_path), "label_count": 0})
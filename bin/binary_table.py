@@ -4,6 +4,8 @@ import sys
 import pandas as pd
 from collections import defaultdict
 
+import perf_trace
+
 # --- Configuration ---
 if len(sys.argv) < 4:
     print("Usage: binary_table.py <output_table> <label_column> <file1> [<file2> ...]")
@@ -12,6 +14,7 @@ if len(sys.argv) < 4:
 output_table = sys.argv[1]
 label_column = sys.argv[2]
 file_list = sys.argv[3:]
+perf_trace.start("binary_table")
 
 # Use a set to collect all unique labels across all files
 all_labels = set()
@@ -21,7 +24,9 @@ file_label_counts = {}
 for file_path in file_list:
     try:
         # Read only the label column
-        df = pd.read_csv(file_path, sep="\t", usecols=[label_column], low_memory=True)
+        with perf_trace.span("read"):
+            df = pd.read_csv(file_path, sep="\t", usecols=[label_column], low_memory=True)
+            perf_trace.add_rows(len(df))
     except ValueError:
         print(f"Skipping {file_path}: '{label_column}' column not found.")
         file_label_counts[os.path.basename(file_path)] = {}
@@ -4,11 +4,12 @@ import os
 import re
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from scipy.stats import boxcox
 import sys
 
+import perf_trace
+from stats_catalog import catalog_from_frame, load_catalog, write_catalog
+from table_reader import read_table
+
 # --- Argument parsing ---
 if len(sys.argv) != 7:
     print("Usage: boxcox_transformer.py <quant_table> <qupath_object_type> <nucleus_marker> <grouping_column> <letterhead> <hasFOV>")
@@ -29,7 +30,16 @@ def get_max_value(df):
     filtered_values = values[np.isfinite(values)]
     return np.max(filtered_values) if filtered_values.size > 0 else 65535
 
-def collect_and_transform(df, batchName):
+def clean_column_name(col):
+    # Remove anything in parentheses (and the parentheses)
+    return re.sub(r'\s*\([^)]*\)', '', col)
+
+def collect_and_transform(df, batchName, pre_means=None):
+    # Imported here rather than at load: they dominate the script's startup time
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from scipy.stats import boxcox
+
     # Sample for plotting
     smTble = df.sample(frac=plotFraction, random_state=42) if len(df) > 1 else df.copy()
     # Melt for combined marker distribution (original)
@@ -51,24 +61,32 @@ def collect_and_transform(df, batchName):
     df_batching2 = df_batching2.loc[:, df_batching2.nunique() > 1]
 
     # BoxCox transformation
-    bcDf = df.copy(deep=True).fillna(0)
+    bcDf = df.copy(deep=True)
+    # Only fill measurements; categorical Image/Classification columns cannot take a 0 category
+    num_cols = bcDf.select_dtypes(include="number").columns
+    bcDf[num_cols] = bcDf[num_cols].fillna(0)
     metrics = []
-    for fld in bcDf.filter(regex='(Min|Max|Median|Mean|StdDev)'):
-        try:
-            nArr, mxLambda = boxcox(bcDf[fld].add(1).values)
-            bcDf[fld] = nArr
-            mxLambda = f"{mxLambda:.3f}"
-        except Exception:
-            bcDf[fld] = 0
-            mxLambda = 'Failed'
-        metrics.append([
-            fld,
-            bcDf[fld].mean(),
-            mxLambda,
-            bcDf[fld].mean(),
-            bcDf[fld].min(),
-            bcDf[fld].max()
-        ])
+    pre_means = pre_means or {}
+    with perf_trace.span("boxcox", rows=len(bcDf)):
+        for fld in bcDf.filter(regex='(Min|Max|Median|Mean|StdDev)'):
+            pre_mean = pre_means.get(fld)
+            if pre_mean is None:
+                pre_mean = df[fld].mean()
+            try:
+                nArr, mxLambda = boxcox(bcDf[fld].add(1).values)
+                bcDf[fld] = nArr
+                mxLambda = f"{mxLambda:.3f}"
+            except Exception:
+                bcDf[fld] = 0
+                mxLambda = 'Failed'
+            metrics.append([
+                fld,
+                pre_mean,
+                mxLambda,
+                bcDf[fld].mean(),
+                bcDf[fld].min(),
+                bcDf[fld].max()
+            ])
     bxcxMetrics = pd.DataFrame(metrics, columns=['Feature', 'Pre_Mean', 'Lambda', 'Post_Mean', 'Post_Min', 'Post_Max'])
     bxcxMetrics.to_csv("BoxCoxRecord.csv", index=False)
 
@@ -143,7 +161,10 @@ def collect_and_transform(df, batchName):
         plt.tight_layout()
         plt.savefig(f"normlize_qrq_{i}.png")
         plt.close()
-    bcDf.to_csv(f"{batchName}_boxcox_mod.tsv", sep="\t", index=False)
+    out_table = f"{batchName}_boxcox_mod.tsv"
+    with perf_trace.span("write", rows=len(bcDf)):
+        bcDf.to_csv(out_table, sep="\t", index=False)
+        write_catalog(catalog_from_frame(bcDf), out_table)
 
     if grouping_column not in df_batching.columns:
         raise ValueError(f"Grouping column '{grouping_column}' not found in columns: {list(df_batching.columns)}")
@@ -160,31 +181,26 @@ def collect_and_transform(df, batchName):
     else:
         sns.boxplot(x=grouping_column, y='value', color="#50C878", data=df_melted, showfliers=False)
 
-def get_needed_columns(file_path, grouping_column, nucMark, quantType):
-    """Scan the header and return only columns needed for analysis."""
-    with open(file_path) as f:
-        header = f.readline().strip().split('\t')
-    needed = set()
-    # Always need the grouping column
-    if grouping_column in header:
-        needed.add(grouping_column)
-    # Add all columns with 'Mean', 'Median', or the nucleus marker
-    for col in header:
-        if 'Mean' in col or 'Median' in col or nucMark in col:
-            needed.add(col)
-    return list(needed)
+def needed_columns_regex(nucMark):
+    """Header regex selecting only the columns needed for analysis."""
+    return rf"(Mean|Median|{re.escape(nucMark)})"
 
 if __name__ == "__main__":
+    perf_trace.start("boxcox_transformer")
     file_size_mb = os.path.getsize(quant_table) / (1024 * 1024)
     print(f"Input file size: {file_size_mb:.1f} MB")
-    if file_size_mb > 800:
-        print("Large file detected, reading only needed columns.")
-        needed_cols = get_needed_columns(quant_table, grouping_column, nucMark, quantType)
-        myData = pd.read_csv(quant_table, sep="\t", usecols=needed_cols, low_memory=True)
-    else:
-        myData = pd.read_csv(quant_table, sep="\t", low_memory=False)
+    with perf_trace.span("read") as read_span:
+        if file_size_mb > 800:
+            print("Large file detected, reading only needed columns.")
+            myData = read_table(quant_table, include=needed_columns_regex(nucMark), keep=[grouping_column])
+        else:
+            myData = read_table(quant_table)
+        read_span["rows"] = len(myData)
+    # Pre-transform means come from the ingest stats catalog when it is staged next to the table
+    catalog = load_catalog(quant_table)
+    pre_means = {clean_column_name(col): s["mean"] for col, s in catalog["stats"].items()} if catalog else None
     # Clean column names: remove anything in parentheses (and the parentheses)
-    myData.columns = [re.sub(r'\s*\([^)]*\)', '', col) for col in myData.columns]
+    myData.columns = [clean_column_name(col) for col in myData.columns]
     print("Columns after cleaning:", list(myData.columns))
 
     # Ensure grouping_column exists; if not, add a synthetic group
@@ -202,4 +218,5 @@ if __name__ == "__main__":
     if subset_match:
         myFileIdx += f"_subset{subset_match.group(1)}"
     
-    collect_and_transform(myData, myFileIdx)
+    with perf_trace.span("transform", rows=len(myData)):
+        collect_and_transform(myData, myFileIdx, pre_means=pre_means)
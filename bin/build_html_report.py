@@ -1,28 +1,183 @@
 #!/usr/bin/env python3
 import argparse
 import html
+import io
+import json
+import os
+from datetime import datetime, timezone
 from pathlib import Path
 
-import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 
+from stats_catalog import catalog_describe, load_catalog
+
+SCAN_BLOCK_BYTES = 16 << 20
+HEAD_ROWS = 5
+HIST_BINS = 40
+
+
+def scan_rows(path: Path, sample_size=0, seed=0):
+    """
+    Count data rows by scanning raw bytes for newlines and, optionally, keep a uniform
+    reservoir of data-row start offsets (random keys, smallest `sample_size` kept).
+    """
+    rng = np.random.default_rng(seed)
+    size = os.path.getsize(path)
+    n_newlines = 0
+    offset = 0
+    last_byte = b''
+    keys = np.empty(0)
+    starts = np.empty(0, dtype=np.int64)
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(SCAN_BLOCK_BYTES)
+            if not block:
+                break
+            nl = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10)
+            if sample_size:
+                # A newline at position p starts a data row at p + 1 (the header starts at 0)
+                new_starts = offset + nl + 1
+                new_starts = new_starts[new_starts < size]
+                keys = np.concatenate([keys, rng.random(len(new_starts))])
+                starts = np.concatenate([starts, new_starts])
+                if len(keys) > sample_size:
+                    keep = np.argpartition(keys, sample_size)[:sample_size]
+                    keys, starts = keys[keep], starts[keep]
+            n_newlines += len(nl)
+            offset += len(block)
+            last_byte = block[-1:]
+    n_lines = n_newlines + (1 if last_byte and last_byte != b'\n' else 0)
+    return max(n_lines - 1, 0), np.sort(starts)
+
+
+def read_rows_at(path: Path, offsets):
+    """Parse the rows starting at the given byte offsets, using the file's own header."""
+    with open(path, 'rb') as f:
+        lines = [f.readline()]
+        for off in offsets:
+            f.seek(int(off))
+            line = f.readline()
+            lines.append(line if line.endswith(b'\n') else line + b'\n')
+    return pd.read_csv(io.BytesIO(b''.join(lines)), sep='\t')
+
+
+def load_tsv_summary(path: Path, mode='sampled', sample_rows=10_000, seed=0):
+    """
+    Collect what the report shows for one table.
+
+    `full` parses the whole table. `sampled` counts rows from the stats catalog sidecar
+    (or a newline scan), parses only the head and a reservoir sample, and takes the
+    describe table and histogram from the catalog when one is present.
+    """
+    summary = {}
+    catalog = load_catalog(path)
+    if mode == 'full':
+        df = pd.read_csv(path, sep='\t', low_memory=False)
+        summary.update(n_rows=len(df), row_source='full read', columns=list(df.columns), head=df.head(HEAD_ROWS))
+        sample, sample_note = df, 'all rows'
+    else:
+        head = pd.read_csv(path, sep='\t', nrows=HEAD_ROWS)
+        if catalog is not None:
+            summary.update(n_rows=catalog['n_rows'], row_source='stats catalog')
+            sample, sample_note = None, None
+        else:
+            n_rows, offsets = scan_rows(path, sample_size=sample_rows, seed=seed)
+            sample = read_rows_at(path, offsets) if len(offsets) else head.iloc[0:0]
+            summary.update(n_rows=n_rows, row_source='newline scan')
+            sample_note = f'reservoir sample of {len(sample):,} rows'
+        summary.update(columns=list(head.columns), head=head)
+
+    if sample is None:
+        numeric_cols = list(catalog['stats'])
+    else:
+        numeric_cols = list(sample.select_dtypes(include='number').columns)
+    summary['describe'] = None
+    summary['hist'] = None
+    if numeric_cols:
+        col = numeric_cols[0]
+        if sample is None:
+            summary['describe'] = catalog_describe(catalog, numeric_cols)
+            summary['describe_source'] = 'stats catalog'
+            col_stats = catalog['stats'][col]
+            counts, edges = np.asarray(col_stats['hist_counts']), np.asarray(col_stats['hist_edges'])
+        else:
+            num = sample[numeric_cols]
+            summary['describe'] = catalog_describe(catalog, numeric_cols) if catalog is not None else num.describe().T
+            summary['describe_source'] = 'stats catalog' if catalog is not None else sample_note
+            counts, edges = np.histogram(num[col].dropna(), bins=HIST_BINS)
+        summary['hist'] = {'column': col, 'counts': counts, 'edges': edges}
+    return summary
+
+
+def tsv_summary_to_json(summary):
+    """JSON-friendly form of load_tsv_summary() output, as consumed by aggregate_reports.py."""
+    out = {
+        'n_rows': int(summary['n_rows']),
+        'row_source': summary['row_source'],
+        'n_columns': len(summary['columns']),
+        'columns': [str(c) for c in summary['columns'][:40]],
+        'head': json.loads(summary['head'].to_json(orient='split', index=False, default_handler=str)),
+        'describe': None,
+        'describe_source': summary.get('describe_source'),
+        'hist': None,
+    }
+    if summary['describe'] is not None:
+        out['describe'] = json.loads(summary['describe'].head(30).to_json(orient='split'))
+    if summary['hist'] is not None:
+        out['hist'] = {
+            'column': str(summary['hist']['column']),
+            'counts': np.asarray(summary['hist']['counts']).tolist(),
+            'edges': np.asarray(summary['hist']['edges']).tolist(),
+        }
+    return out
+
+
+def build_step_summary(title, inputs, notes='', step='', elapsed_seconds=None, mode='sampled', sample_rows=10_000):
+    """Small JSON summary of one pipeline step: counts, shapes and timing of its files."""
+    files = []
+    for p in inputs:
+        pth = Path(p)
+        entry = {'name': pth.name, 'path': str(p), 'exists': pth.exists(),
+                 'size_bytes': pth.stat().st_size if pth.exists() else 0, 'kind': 'other'}
+        suffix = pth.suffix.lower()
+        if suffix == '.tsv' and pth.exists():
+            entry['kind'] = 'tsv'
+            try:
+                entry['tsv'] = tsv_summary_to_json(load_tsv_summary(pth, mode=mode, sample_rows=sample_rows))
+            except Exception as e:
+                entry['error'] = str(e)
+        elif suffix in ('.png', '.jpg', '.jpeg', '.svg'):
+            entry['kind'] = 'image'
+        files.append(entry)
+    return {
+        'step': step or title,
+        'title': title,
+        'notes': notes,
+        'elapsed_seconds': elapsed_seconds,
+        'generated_utc': datetime.now(timezone.utc).isoformat(),
+        'inputs': files,
+    }
+
+
+def summarize_tsv(path: Path, out_dir: Path, idx: int, mode='sampled', sample_rows=10_000):
+    import matplotlib.pyplot as plt
 
-def summarize_tsv(path: Path, out_dir: Path, idx: int):
     info = []
     figs = []
     try:
-        df = pd.read_csv(path, sep='\t', low_memory=False)
-        info.append(f"<p><b>Rows:</b> {len(df):,} &nbsp; <b>Columns:</b> {len(df.columns):,}</p>")
-        info.append("<h4>Column preview</h4>" + pd.DataFrame({'column': df.columns}).head(40).to_html(index=False))
-        info.append("<h4>Head (first 5 rows)</h4>" + df.head(5).to_html(index=False))
-        num = df.select_dtypes(include='number')
-        if not num.empty:
-            info.append("<h4>Numeric describe</h4>" + num.describe().T.head(30).to_html())
-            col = num.columns[0]
+        summary = load_tsv_summary(path, mode=mode, sample_rows=sample_rows)
+        info.append(f"<p><b>Rows:</b> {summary['n_rows']:,} ({html.escape(summary['row_source'])}) &nbsp; <b>Columns:</b> {len(summary['columns']):,}</p>")
+        info.append("<h4>Column preview</h4>" + pd.DataFrame({'column': summary['columns']}).head(40).to_html(index=False))
+        info.append(f"<h4>Head (first {HEAD_ROWS} rows)</h4>" + summary['head'].to_html(index=False))
+        if summary['describe'] is not None:
+            info.append(f"<h4>Numeric describe ({html.escape(summary['describe_source'])})</h4>" + summary['describe'].head(30).to_html())
+        if summary['hist'] is not None:
+            col, counts, edges = summary['hist']['column'], summary['hist']['counts'], summary['hist']['edges']
             fig_name = f"report_{idx}_{path.stem}_{col}_hist.png".replace('/', '_')
             fig_path = out_dir / fig_name
             plt.figure(figsize=(6, 3))
-            num[col].dropna().hist(bins=40)
+            plt.bar((edges[:-1] + edges[1:]) / 2, counts, width=np.diff(edges))
             plt.title(f"{path.name}: {col} distribution")
             plt.tight_layout()
             plt.savefig(fig_path, dpi=120)
@@ -34,16 +189,29 @@ def summarize_tsv(path: Path, out_dir: Path, idx: int):
 
 
 def main():
-    ap = argparse.ArgumentParser()
+    ap = argparse.ArgumentParser(fromfile_prefix_chars='@')
     ap.add_argument('--title', required=True)
     ap.add_argument('--output', required=True)
     ap.add_argument('--inputs', nargs='*', default=[])
     ap.add_argument('--notes', default='')
+    ap.add_argument('--mode', choices=['sampled', 'full'], default='sampled',
+                    help="'sampled' reads only headers, a reservoir sample and stats sidecars; 'full' parses every table")
+    ap.add_argument('--sample-rows', type=int, default=10_000)
+    ap.add_argument('--format', choices=['html', 'json'], default='html',
+                    help="'json' writes only a small step summary for aggregate_reports.py (no plotting)")
+    ap.add_argument('--step', default='', help='Pipeline step name recorded in the JSON summary')
+    ap.add_argument('--elapsed-seconds', type=float, default=None, help='Step wall time recorded in the JSON summary')
     args = ap.parse_args()
 
     out = Path(args.output)
     out.parent.mkdir(parents=True, exist_ok=True)
 
+    if args.format == 'json':
+        summary = build_step_summary(args.title, args.inputs, notes=args.notes, step=args.step,
+                                     elapsed_seconds=args.elapsed_seconds, mode=args.mode, sample_rows=args.sample_rows)
+        out.write_text(json.dumps(summary, default=str), encoding='utf-8')
+        return
+
     sections = []
     sections.append(f"<h1>{html.escape(args.title)}</h1>")
     if args.notes:
@@ -56,7 +224,7 @@ def main():
         sections.append(f"<hr><h3>{html.escape(pth.name)}</h3>")
         sections.append(f"<p><b>Exists:</b> {pth.exists()} &nbsp; <b>Size bytes:</b> {(pth.stat().st_size if pth.exists() else 0):,}</p>")
         if pth.suffix.lower() == '.tsv' and pth.exists():
-            txt, figs = summarize_tsv(pth, out.parent, i)
+            txt, figs = summarize_tsv(pth, out.parent, i, mode=args.mode, sample_rows=args.sample_rows)
             sections.append(txt)
             for f in figs:
                 sections.append(f'<img src="{html.escape(f)}" style="max-width:900px;">')
@@ -0,0 +1,78 @@
+"""
+Content-addressed checkpoints for the stages of a long-running script.
+
+A stage's key hashes its name, its parameters and a fingerprint of every input (arrays
+and frames by content, files by name, size and mtime). The result is stored with joblib
+as `<directory>/<stage>-<key>.joblib`, so a rerun with the same inputs and parameters
+loads it instead of recomputing, while any change produces a new key.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+
+
+def fingerprint(obj, h=None):
+    """Feed a stable description of `obj` into the hash `h` (sha256) and return it."""
+    h = h or hashlib.sha256()
+    if isinstance(obj, pd.DataFrame):
+        h.update(json.dumps([str(c) for c in obj.columns]).encode())
+        h.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, pd.Series):
+        h.update(str(obj.name).encode())
+        h.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+    elif isinstance(obj, np.ndarray):
+        h.update(f"{obj.dtype.str}{obj.shape}".encode())
+        h.update(np.ascontiguousarray(obj).tobytes())
+    elif isinstance(obj, Path):
+        st = obj.stat()
+        h.update(f"{obj.name}:{st.st_size}:{st.st_mtime_ns}".encode())
+    elif isinstance(obj, (list, tuple)):
+        for item in obj:
+            fingerprint(item, h)
+    else:
+        h.update(json.dumps(obj, sort_keys=True, default=str).encode())
+    return h
+
+
+class Checkpointer:
+    """Run stages through a cache directory; `directory=None` disables caching."""
+
+    def __init__(self, directory=None, prefix=""):
+        self.directory = Path(directory) if directory else None
+        self.prefix = prefix
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def key(self, stage, inputs=(), params=None):
+        h = hashlib.sha256(f"{self.prefix}{stage}".encode())
+        fingerprint(params or {}, h)
+        fingerprint(list(inputs), h)
+        return h.hexdigest()[:20]
+
+    def path(self, stage, inputs=(), params=None):
+        return self.directory / f"{self.prefix}{stage}-{self.key(stage, inputs, params)}.joblib"
+
+    def run(self, stage, fn, inputs=(), params=None):
+        """Return `fn()` for this stage, loading it from the cache when the key matches."""
+        if self.directory is None:
+            return fn()
+        path = self.path(stage, inputs, params)
+        if path.exists():
+            try:
+                result = joblib.load(path)
+                print(f"[checkpoint] {self.prefix}{stage}: loaded {path.name}")
+                return result
+            except Exception as e:
+                print(f"[checkpoint] {self.prefix}{stage}: could not load {path.name} ({e}); recomputing")
+        result = fn()
+        tmp = path.with_name(path.name + f".tmp{os.getpid()}")
+        joblib.dump(result, tmp)
+        os.replace(tmp, path)
+        print(f"[checkpoint] {self.prefix}{stage}: saved {path.name}")
+        return result
@@ -0,0 +1,102 @@
+"""
+One CPU budget per task, shared by every layer of parallelism.
+
+Every Nextflow task script starts by exporting the task's `cpus` as $BINFLOW_CPUS
+(inside the task, so it also reaches containers); outside the pipeline
+$SLURM_CPUS_PER_TASK, a container's cgroup CPU quota or the CPU affinity mask is
+used, whichever is set and smallest. A script splits the budget between its outer workers (search
+candidates, markers, files) and the threads each of them may use, so that nested
+parallelism (model search x forest x BLAS) never runs more threads than the task
+was allocated:
+
+    n_jobs = cpu_budget.resolve_jobs(args.n_jobs)
+    outer, inner = cpu_budget.split(n_candidates, n_jobs)
+    with cpu_budget.inner_threads(inner):
+        RandomizedSearchCV(..., n_jobs=outer).fit(X, y)
+"""
+
+import os
+from contextlib import contextmanager
+
+BUDGET_ENV_VARS = ("BINFLOW_CPUS", "SLURM_CPUS_PER_TASK")
+# Read by BLAS and OpenMP runtimes when they start, i.e. in worker processes spawned later
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "BLIS_NUM_THREADS",
+                   "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS")
+
+
+def _affinity_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _cgroup_cpus():
+    """CPU quota of this process's cgroup (v2 cpu.max, v1 cfs quota/period) rounded up, or None if unlimited."""
+    try:
+        quota, period = open("/sys/fs/cgroup/cpu.max").read().split()[:2]
+    except (OSError, ValueError):
+        try:
+            quota = open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us").read().strip()
+            period = open("/sys/fs/cgroup/cpu/cpu.cfs_period_us").read().strip()
+        except OSError:
+            return None
+    if quota == "max" or not quota.lstrip("-").isdigit() or int(quota) <= 0 or not period.isdigit() or int(period) <= 0:
+        return None
+    return max(1, -(-int(quota) // int(period)))
+
+
+def _system_cpus():
+    cgroup = _cgroup_cpus()
+    affinity = _affinity_cpus()
+    return min(cgroup, affinity) if cgroup else affinity
+
+
+def available_cpus():
+    """CPUs this task may use: $BINFLOW_CPUS, else $SLURM_CPUS_PER_TASK, else the cgroup quota / affinity mask."""
+    for var in BUDGET_ENV_VARS:
+        value = os.environ.get(var, "").strip()
+        if value.isdigit() and int(value) > 0:
+            return min(int(value), _system_cpus())
+    return _system_cpus()
+
+
+def resolve_jobs(n_jobs=None):
+    """An `n_jobs`-style request (None, 0 or negative: the whole budget) as a CPU count within the budget."""
+    budget = available_cpus()
+    if n_jobs is None or n_jobs <= 0:
+        return budget
+    return max(1, min(n_jobs, budget))
+
+
+def split(outer_tasks, n_jobs=None):
+    """(outer workers, threads per worker) for `outer_tasks` independent units of work."""
+    budget = resolve_jobs(n_jobs)
+    outer = max(1, min(int(outer_tasks), budget))
+    return outer, max(1, budget // outer)
+
+
+def limit_threads(n_threads):
+    """
+    Cap BLAS/OpenMP thread pools of this process (via threadpoolctl) and of the worker
+    processes it starts later (via the usual environment variables).
+    """
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(n_threads)
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return None
+    return threadpool_limits(limits=n_threads)
+
+
+@contextmanager
+def inner_threads(n_threads):
+    """
+    Run joblib work whose loky workers get `n_threads` BLAS/OpenMP threads each, instead
+    of the host's cores divided by the number of workers.
+    """
+    from joblib import parallel_config
+
+    with parallel_config(backend="loky", inner_max_num_threads=n_threads):
+        yield
@@ -0,0 +1,87 @@
+"""
+2D embeddings of large cell samples for QC plots.
+
+The features are first reduced with PCA, then a reference subset is embedded with
+t-SNE: openTSNE (multithreaded, FFT-accelerated gradients) when it is installed,
+otherwise scikit-learn's Barnes-Hut t-SNE. Every other cell is placed into that
+reference embedding by inverse-distance weighting of its nearest reference
+neighbours in PCA space, so only the reference subset pays the t-SNE cost and the
+plotted sample can be an order of magnitude larger. A saved reference can also be
+reused by a later run, which then places all of its cells without refitting.
+"""
+
+import importlib.util
+from pathlib import Path
+
+import joblib
+import numpy as np
+from sklearn.decomposition import PCA
+from sklearn.neighbors import NearestNeighbors
+
+DEFAULT_PCA_COMPONENTS = 50
+DEFAULT_NEIGHBORS = 10
+
+
+def has_opentsne():
+    return importlib.util.find_spec("openTSNE") is not None
+
+
+def fit_reference_embedding(X, random_state=0, n_components=DEFAULT_PCA_COMPONENTS, n_jobs=-1):
+    """
+    PCA-reduce `X` and embed it in 2D.
+
+    Returns a dict with the fitted PCA (None when `X` already has few features), the
+    reduced reference matrix and its embedding; this is what `place_points` needs.
+    """
+    X = np.asarray(X, dtype=np.float32)
+    pca = None
+    if X.shape[1] > n_components:
+        pca = PCA(n_components=n_components, svd_solver="randomized", random_state=random_state)
+        X = pca.fit_transform(X).astype(np.float32)
+    if has_opentsne():
+        from openTSNE import TSNE as OpenTSNE
+
+        emb = np.asarray(OpenTSNE(n_components=2, negative_gradient_method="fft", random_state=random_state,
+                                  n_jobs=n_jobs).fit(X))
+        backend = "openTSNE"
+    else:
+        from sklearn.manifold import TSNE
+
+        emb = TSNE(n_components=2, method="barnes_hut", init="pca", learning_rate="auto",
+                   random_state=random_state, n_jobs=n_jobs).fit_transform(X)
+        backend = "sklearn"
+    return {"pca": pca, "X_ref": X, "embedding": np.asarray(emb, dtype=np.float32), "backend": backend}
+
+
+def place_points(reference, X, n_neighbors=DEFAULT_NEIGHBORS, n_jobs=-1):
+    """Embed new rows by inverse-distance weighting their nearest reference cells' coordinates."""
+    X = np.asarray(X, dtype=np.float32)
+    if len(X) == 0:
+        return np.empty((0, 2), dtype=np.float32)
+    if reference["pca"] is not None:
+        X = reference["pca"].transform(X).astype(np.float32)
+    k = min(n_neighbors, len(reference["X_ref"]))
+    nn = NearestNeighbors(n_neighbors=k, n_jobs=n_jobs).fit(reference["X_ref"])
+    dist, idx = nn.kneighbors(X)
+    weights = 1.0 / np.maximum(dist, 1e-6)
+    weights /= weights.sum(axis=1, keepdims=True)
+    return np.einsum("nk,nkd->nd", weights, reference["embedding"][idx]).astype(np.float32)
+
+
+def load_reference(path, marker, features):
+    """
+    Saved `<marker>_embedding_reference.joblib` from `path` (a file, or a previous run's
+    artifact directory), or None when it is missing or was built on other features.
+    """
+    path = Path(path)
+    if path.is_dir():
+        candidates = [path / f"{marker}_embedding_reference.joblib", path / marker / f"{marker}_embedding_reference.joblib"]
+        path = next((c for c in candidates if c.exists()), candidates[0])
+    if not path.exists():
+        print(f"No embedding reference for {marker} at {path}; fitting a new one")
+        return None
+    reference = joblib.load(path)
+    if list(reference.get("features", [])) != list(features):
+        print(f"Embedding reference {path} was built on other features; fitting a new one")
+        return None
+    return reference
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Pre-flight memory and CPU estimates for the pipeline's processes.
+
+Only the header and the first few kilobytes of each input table are read. The row
+count comes from the file size over the average sampled row length, and the
+in-memory size of a parsed table from rows x columns x dtype width (8 bytes per
+numeric column, the sampled string length plus Python object overhead per text
+column). Each process is modelled as a fixed overhead plus a number of parsed
+copies of the table it holds at once (only one chunk for the chunked steps), and
+gets CPUs per block of rows.
+
+The JSON written here is read by lib/Resources.groovy, which turns the estimates
+into the `memory` and `cpus` directives of each task and doubles the memory on
+every retry after an out-of-memory exit.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+
+import pandas as pd
+
+import perf_trace
+from table_reader import estimate_row_bytes, read_header
+
+MB = 1024 * 1024
+NUMERIC_BYTES = 8
+# CPython str header; a parsed text cell costs this plus its length
+OBJECT_OVERHEAD_BYTES = 49
+SAMPLE_ROWS = 200
+MEMORY_STEP_MB = 512
+
+# scope: "table" (one task per input table) or "cohort" (one task over all tables)
+# copies: parsed copies of the (chunk of the) table held at once
+# chunk_rows: rows read per chunk by chunked steps (None: whole table in memory)
+# rows_per_cpu / cpus: one CPU per block of rows, clamped to the range
+PROCESS_MODELS = {
+    "REPORT_PANEL_DESIGN": {"scope": "cohort", "base_mb": 2048, "copies": 0.25, "chunk_rows": None,
+                            "rows_per_cpu": None, "cpus": (2, 8)},
+    "BOOST_NEGATIVE_LABELS": {"scope": "table", "base_mb": 1024, "copies": 3.0, "chunk_rows": 500_000,
+                              "rows_per_cpu": None, "cpus": (1, 1)},
+    "BOXCOX_TRANSFORM": {"scope": "table", "base_mb": 1536, "copies": 3.0, "chunk_rows": None,
+                         "rows_per_cpu": 2_000_000, "cpus": (1, 4)},
+    "PREPROCESS_QUANT_TABLE": {"scope": "table", "base_mb": 1536, "copies": 4.0, "chunk_rows": None,
+                               "rows_per_cpu": 2_000_000, "cpus": (1, 4)},
+    "GET_SINGLE_MARKER_TRAINING_DF": {"scope": "table", "base_mb": 1024, "copies": 3.0, "chunk_rows": 250_000,
+                                      "rows_per_cpu": None, "cpus": (1, 1)},
+    "MERGE_TRAINING_BY_MARKER": {"scope": "cohort", "base_mb": 1024, "copies": 0.5, "chunk_rows": None,
+                                 "rows_per_cpu": None, "cpus": (1, 1)},
+    "BINARY_MODEL_TRAINING": {"scope": "cohort", "base_mb": 4096, "copies": 1.0, "chunk_rows": None,
+                              "rows_per_cpu": 500_000, "cpus": (4, 16)},
+    "PREDICTIONS_FROM_BEST_MODEL": {"scope": "table", "base_mb": 2048, "copies": 2.5, "chunk_rows": None,
+                                    "rows_per_cpu": 1_000_000, "cpus": (1, 4)},
+    "MERGE_BY_PRED_IMAGE": {"scope": "table", "base_mb": 1024, "copies": 1.0, "chunk_rows": None,
+                            "rows_per_cpu": None, "cpus": (1, 1)},
+    "REPORT_PER_IMAGE": {"scope": "table", "base_mb": 2048, "copies": 1.0, "chunk_rows": None,
+                         "rows_per_cpu": None, "cpus": (1, 1)},
+    "RECOMBINE_PREDICTIONS_WITH_CONTEXT": {"scope": "cohort", "base_mb": 1024, "copies": 0.5, "chunk_rows": None,
+                                           "rows_per_cpu": None, "cpus": (1, 1)},
+    "MARKER_RECOVERY_ANALYSIS": {"scope": "cohort", "base_mb": 4096, "copies": 1.5, "chunk_rows": None,
+                                 "rows_per_cpu": 1_000_000, "cpus": (2, 16)},
+}
+
+
+def table_stem(path):
+    name = os.path.basename(str(path))
+    return name[:-4] if name.lower().endswith(".tsv") else os.path.splitext(name)[0]
+
+
+def profile_table(path, sample_rows=SAMPLE_ROWS):
+    """Size, estimated rows and per-column widths of one table, from its header and a few rows."""
+    header = read_header(path)
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        header_bytes = len(f.readline())
+    row_bytes = estimate_row_bytes(path, len(header))
+    rows = int(max(size - header_bytes, 0) / row_bytes) if row_bytes else 0
+    sample = pd.read_csv(path, sep="\t", nrows=sample_rows, low_memory=False)
+    numeric = sample.select_dtypes("number").columns
+    text = [c for c in sample.columns if c not in numeric]
+    text_bytes = sum(OBJECT_OVERHEAD_BYTES + sample[c].astype(str).str.len().mean() for c in text) if len(sample) else 0
+    row_mem = len(numeric) * NUMERIC_BYTES + text_bytes
+    return {
+        "path": str(path),
+        "bytes": size,
+        "rows": rows,
+        "columns": len(header),
+        "numeric_columns": len(numeric),
+        "text_columns": len(text),
+        "row_bytes": round(row_mem, 1),
+        "frame_mb": round(rows * row_mem / MB, 1),
+    }
+
+
+def estimate_process(model, rows, row_bytes, n_tables, max_memory_mb, max_cpus):
+    held_rows = min(rows, model["chunk_rows"]) if model["chunk_rows"] else rows
+    memory_mb = model["base_mb"] + model["copies"] * held_rows * row_bytes / MB
+    memory_mb = min(math.ceil(memory_mb / MEMORY_STEP_MB) * MEMORY_STEP_MB, max_memory_mb)
+    lo, hi = model["cpus"]
+    if model["rows_per_cpu"]:
+        cpus = math.ceil(rows / model["rows_per_cpu"])
+    elif model["scope"] == "cohort" and lo != hi:
+        # Pool-per-table steps
+        cpus = n_tables
+    else:
+        cpus = lo
+    return {"memory_mb": int(memory_mb), "cpus": int(max(1, min(max(cpus, lo), hi, max_cpus)))}
+
+
+def estimate(paths, max_memory_mb, max_cpus):
+    tables = {table_stem(p): profile_table(p) for p in paths}
+    cohort_rows = sum(t["rows"] for t in tables.values())
+    cohort_mb = sum(t["frame_mb"] for t in tables.values())
+    cohort_row_bytes = cohort_mb * MB / cohort_rows if cohort_rows else 0.0
+    for info in tables.values():
+        info["processes"] = {
+            name: estimate_process(model, info["rows"], info["row_bytes"], 1, max_memory_mb, max_cpus)
+            for name, model in PROCESS_MODELS.items() if model["scope"] == "table"
+        }
+    cohort = {
+        "tables": len(tables),
+        "bytes": sum(t["bytes"] for t in tables.values()),
+        "rows": cohort_rows,
+        "frame_mb": round(cohort_mb, 1),
+        # Cohort-wide steps are estimated over all rows; a per-table step whose table is
+        # not recognised falls back to the largest table's estimate
+        "processes": {
+            name: (estimate_process(model, cohort_rows, cohort_row_bytes, len(tables), max_memory_mb, max_cpus)
+                   if model["scope"] == "cohort"
+                   else max((t["processes"][name] for t in tables.values()),
+                            key=lambda e: e["memory_mb"], default=None))
+            for name, model in PROCESS_MODELS.items()
+        },
+    }
+    return {
+        "limits": {"memory_mb": max_memory_mb, "cpus": max_cpus},
+        "tables": tables,
+        "cohort": cohort,
+    }
+
+
+def estimates_table(estimates):
+    """One row per table (and one for the cohort) and process, for reading the estimates."""
+    records = []
+    for stem, info in list(estimates["tables"].items()) + [("(cohort)", estimates["cohort"])]:
+        for process, est in info["processes"].items():
+            if est is None:
+                continue
+            records.append({"table": stem, "rows": info["rows"], "frame_mb": info["frame_mb"], "process": process,
+                            "memory_mb": est["memory_mb"], "cpus": est["cpus"]})
+    return pd.DataFrame.from_records(records, columns=["table", "rows", "frame_mb", "process", "memory_mb", "cpus"])
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Estimate per-table memory and CPUs of each process from table headers and sizes.")
+    ap.add_argument("tables", nargs="+")
+    ap.add_argument("--output", default="resource_estimates.json")
+    ap.add_argument("--tsv", default=None, help="Also write the estimates as a table")
+    ap.add_argument("--max-memory-mb", type=int, default=61440, help="Upper bound of any memory estimate")
+    ap.add_argument("--max-cpus", type=int, default=16, help="Upper bound of any CPU estimate")
+    args = ap.parse_args()
+    perf_trace.start("estimate_resources")
+
+    missing = [t for t in args.tables if not os.path.isfile(t)]
+    if missing:
+        print(f"ERROR: tables not found: {', '.join(missing)}")
+        sys.exit(1)
+    with perf_trace.span("estimate", rows=len(args.tables)):
+        estimates = estimate(args.tables, args.max_memory_mb, args.max_cpus)
+    with open(args.output, "w") as fh:
+        json.dump(estimates, fh, indent=1)
+    table = estimates_table(estimates)
+    if args.tsv:
+        table.to_csv(args.tsv, sep="\t", index=False)
+    cohort = estimates["cohort"]
+    print(f"Wrote {args.output}: {cohort['tables']} tables, ~{cohort['rows']} rows, ~{cohort['frame_mb']} MB parsed")
+    print(table[table["table"] == "(cohort)"].to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
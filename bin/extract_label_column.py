@@ -4,6 +4,8 @@ import sys
 
 import pandas as pd
 
+import perf_trace
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(
@@ -17,9 +19,12 @@ def parse_args() -> argparse.Namespace:
 
 def main() -> int:
     args = parse_args()
+    perf_trace.start("extract_label_column")
 
     try:
-        df = pd.read_csv(args.input_table, sep="\t", usecols=[args.label_column], low_memory=True)
+        with perf_trace.span("read"):
+            df = pd.read_csv(args.input_table, sep="\t", usecols=[args.label_column], low_memory=True)
+            perf_trace.add_rows(len(df))
     except ValueError as exc:
         print(
             f"Error: column '{args.label_column}' was not found in {args.input_table}: {exc}",
@@ -30,7 +35,8 @@ def main() -> int:
         print(f"Error reading {args.input_table}: {exc}", file=sys.stderr)
         return 1
 
-    df.to_csv(args.output_table, sep="\t", index=False)
+    with perf_trace.span("write", rows=len(df)):
+        df.to_csv(args.output_table, sep="\t", index=False)
     return 0
 
 
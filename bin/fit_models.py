@@ -5,8 +5,6 @@ import numpy as np
 import os, sys
 import re
 import pickle
-from dask.distributed import Client
-from joblib import parallel_backend
 from sklearn.model_selection import train_test_split, RandomizedSearchCV, StratifiedShuffleSplit
 from sklearn.ensemble import RandomForestClassifier, ExtraTreesClassifier
 from sklearn.linear_model import LogisticRegression
@@ -16,8 +14,9 @@ from sklearn.compose import ColumnTransformer
 from sklearn.metrics import classification_report, accuracy_score, confusion_matrix, f1_score
 from sklearn.impute import SimpleImputer
 from pprint import pprint
-from dask.distributed import Client
-from joblib import parallel_backend
+
+import cpu_budget
+import perf_trace
 
 def preprocess_data(df, label_column='key_label'):
     # Strip whitespace from column names
@@ -49,11 +48,13 @@ def build_pipelines(numeric_features):
     )
     return preprocessor
 
-def build_models(preprocessor, n_iter=100, cv=5):
+def build_models(preprocessor, n_iter=100, cv=5, n_jobs=-1):
     models = {}
+    # n_iter candidates share the task's CPUs with the trees of each forest
+    search_jobs, model_jobs = cpu_budget.split(n_iter, n_jobs)
     rf_pipeline = Pipeline(steps=[
             ('preprocessor', preprocessor),
-            ('classifier', RandomForestClassifier(random_state=421))
+            ('classifier', RandomForestClassifier(random_state=421, n_jobs=model_jobs))
     ])
     rf_param_grid = {
         'classifier__criterion': ['gini','entropy','log_loss'],
@@ -70,11 +71,11 @@ def build_models(preprocessor, n_iter=100, cv=5):
         cv=cv,
         scoring='f1',
         random_state=422,
-        n_jobs=-1
+        n_jobs=search_jobs
     )
     et_pipeline = Pipeline(steps=[
             ('preprocessor', preprocessor),
-            ('classifier', ExtraTreesClassifier(random_state=421))
+            ('classifier', ExtraTreesClassifier(random_state=421, n_jobs=model_jobs))
     ])
     et_param_grid = {
         'classifier__criterion': ['gini','entropy','log_loss'],
@@ -91,7 +92,7 @@ def build_models(preprocessor, n_iter=100, cv=5):
         cv=cv,
         scoring='f1',
         random_state=422,
-        n_jobs=-1
+        n_jobs=search_jobs
     )
     lr_pipeline = Pipeline(steps=[
             ('preprocessor', preprocessor),
@@ -116,7 +117,7 @@ def build_models(preprocessor, n_iter=100, cv=5):
         cv=cv,
         scoring='f1',
         random_state=422,
-        n_jobs=-1,
+        n_jobs=search_jobs,
         error_score=np.nan,
         verbose=0
     )
@@ -136,7 +137,9 @@ def evaluate_models(models, X_train, X_test, y_train, y_test, nom):
     for name, model in models.items():
         fit_success = True
         try:
-            model.fit(X_train, y_train_bin)
+            _, inner = cpu_budget.split(model.n_jobs)
+            with perf_trace.span(f"fit_{name}", rows=len(X_train)), cpu_budget.inner_threads(inner):
+                model.fit(X_train, y_train_bin)
         except Exception as e:
             print(f'Error during model fitting for {name}: {e}')
             fit_success = False
@@ -181,8 +184,13 @@ if __name__ == "__main__":
         print("Usage: fit_models.py <training_df>")
         sys.exit(1)
     training_df = sys.argv[1]
-    df = pd.read_csv(training_df, sep="\t")
+    perf_trace.start("fit_models")
+    cpu_budget.limit_threads(cpu_budget.available_cpus())
+    with perf_trace.span("read"):
+        df = pd.read_csv(training_df, sep="\t")
+        perf_trace.add_rows(len(df))
     lblName = extract_marker(os.path.basename(training_df))
+    perf_trace.annotate(marker=lblName)
     print(f"Label = {lblName}")
     X, y = preprocess_data(df)
     if len(y.unique()) < 2:
@@ -206,11 +214,6 @@ if __name__ == "__main__":
     preprocessor = build_pipelines(numeric_cols)
     models = build_models(preprocessor, cv = sss_cv)
 
-    ### This code is only for the SLURM??
-    # Start Dask client and use Dask as parallel backend
-    #client = Client()
-    #print(f"Dask client started: {client}")
-    #with parallel_backend('dask'):
     results = evaluate_models(models, X_train, X_test, y_train, y_test, lblName)
 
     pprint(results)
@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+from matplotlib.colors import LogNorm
 import sys
-import os
 import re
-import glob
-import seaborn as sns
-from sklearn.metrics import roc_auc_score
+
+import perf_trace
+
+from spatial_raster import render_label_maps
+from table_reader import read_header, read_table
 
 # Function to modify column names
 def clean_pred_columns(col):
@@ -17,6 +20,34 @@ def clean_pred_columns(col):
             return '_'.join(parts[:-1])  # Remove the last part
     return col  # Return as-is if not 3 parts
 
+# Logistic curve fitted on binned means: cells are grouped into intensity bins and a
+# fractional logit is fitted by weighted IRLS on (mean intensity, mean probability, count),
+# so the cost does not depend on the number of cells beyond one binning pass
+def binned_logistic_fit(x, p, bins=50, n_iter=50):
+    edges = np.unique(np.nanpercentile(x, np.linspace(0, 100, bins + 1)))
+    if len(edges) < 3:
+        return None
+    idx = np.clip(np.searchsorted(edges, x, side='right') - 1, 0, len(edges) - 2)
+    counts = np.bincount(idx, minlength=len(edges) - 1).astype(float)
+    keep = counts > 0
+    x_mean = np.bincount(idx, weights=x, minlength=len(counts))[keep] / counts[keep]
+    p_mean = np.bincount(idx, weights=p, minlength=len(counts))[keep] / counts[keep]
+    w = counts[keep]
+    center, scale = x_mean.mean(), x_mean.std() or 1.0
+    X = np.column_stack([np.ones_like(x_mean), (x_mean - center) / scale])
+    beta = np.zeros(2)
+    for _ in range(n_iter):
+        mu = np.clip(1 / (1 + np.exp(-(X @ beta))), 1e-6, 1 - 1e-6)
+        wt = w * mu * (1 - mu)
+        z = X @ beta + (p_mean - mu) / (mu * (1 - mu))
+        step = np.linalg.solve(X.T @ (wt[:, None] * X) + 1e-8 * np.eye(2), X.T @ (wt * z))
+        if np.allclose(step, beta, atol=1e-8):
+            break
+        beta = step
+    x_fit = np.linspace(x_mean.min(), x_mean.max(), 200)
+    y_fit = 1 / (1 + np.exp(-(beta[0] + beta[1] * (x_fit - center) / scale)))
+    return x_fit, y_fit
+
 # Helper function to extract identifier
 def get_identifier(filename, markers):
     for marker in markers:
@@ -26,50 +57,44 @@ def get_identifier(filename, markers):
             return marker  # return first exact match
     return None
 
+if len(sys.argv) < 3:
+    print("Usage: generate_reports_per_image.py <merged_file> <image_id> [<pred_file> ...]")
+    sys.exit(1)
 merged_file = sys.argv[1]
 image_id = sys.argv[2]
-qFile_path = sys.argv[3]
-df = pd.read_csv(merged_file, sep='\t')
+# This image's _PRED.tsv files, passed explicitly by the pipeline
+pFiles = sys.argv[3:]
+perf_trace.start("generate_reports_per_image")
+with perf_trace.span("read"):
+    df = read_table(merged_file, include=r'^(Prediction|Centroid [XY] µm$)')
+    perf_trace.add_rows(len(df))
 df.columns = [clean_pred_columns(col) for col in df.columns] # drop the "_##" at the end of the prediction columns
-df['Inverted Centroid Y µm'] = df['Centroid Y µm'].max() - df['Centroid Y µm']
 img_id = re.sub(r'_boxcox_mod\.tsv$', '', image_id)
-binary_dir = os.path.dirname(os.path.realpath(merged_file))
-print(binary_dir)
-pFiles = glob.glob(os.path.join(binary_dir,'*_PRED.tsv'))
-print('Found {} Prediction files'.format(len(pFiles)))
+print('Got {} Prediction files'.format(len(pFiles)))
 
 plot_files = []
 curve_files = []
 roc_files = []
 
-### Step 1: Plot Scatterplot of Predictions ###
-# Find prediction columns
+### Step 1: Spatial maps of predictions ###
+# Centroids are binned into a pixel grid sized by cell density; each pixel is coloured
+# by the fraction of positive cells (blue = all "-", orange = all "+"), one map per marker.
 prediction_cols = [col for col in df.columns if col.startswith("Prediction")]
-x_col = "Centroid X µm"
-y_col = "Inverted Centroid Y µm"
-
-for pred_col in prediction_cols:
-    plt.figure()
-    label = pred_col.replace('Prediction_','')
-    df[pred_col] = df[pred_col].map({0: f"{label}-", 1: f"{label}+"})
-    # Use unique values in the prediction column for coloring
-    unique_vals = sorted(
-        df[pred_col].unique(),
-        key=lambda x: (str(x).rstrip("+-"), str(x).endswith("+")) # ensure that "-" comes before "+"
-        )
-    for val in unique_vals:
-        mask = df[pred_col] == val
-        plt.scatter(df.loc[mask, x_col], df.loc[mask, y_col], label=str(val), alpha=0.7)
-    plt.xlabel(x_col)
-    plt.ylabel(y_col)
-    plt.title('Spatial Plot of Binary Labels for ' + label)
-    plt.legend()
-    plot_name = f"{img_id}_{pred_col}_scatter.png"
-    plt.savefig(plot_name, bbox_inches='tight')
-    plt.close()
-    plot_files.append(plot_name)
+plot_names = {pred_col: f"{img_id}_{pred_col}_label_map.png" for pred_col in prediction_cols}
+pred_markers = {pred_col: pred_col.replace('Prediction_', '') for pred_col in prediction_cols}
+with perf_trace.span("spatial_maps", rows=len(df)):
+    render_label_maps(
+        df['Centroid X µm'].to_numpy(), df['Centroid Y µm'].to_numpy(),
+        {pred_col: pd.to_numeric(df[pred_col], errors='coerce').to_numpy() for pred_col in prediction_cols},
+        plot_names,
+        titles={pred_col: f"Spatial map of binary labels for {marker}" for pred_col, marker in pred_markers.items()},
+        markers=pred_markers,
+    )
+plot_files.extend(plot_names[pred_col] for pred_col in prediction_cols)
 
 ### Step 2: Plot Prediction Probabilities Curves ###
+# Intensities come from the _PRED.tsv itself (best_model_predictions.py keeps the
+# marker's Median column); the cells are drawn as a 2D density, not a scatter.
 for pFile in pFiles:
     # Extract label from qFile
     match = re.search(r'predictions_(.*)\.pkl', pFile)
@@ -77,51 +102,39 @@ for pFile in pFiles:
         label = match.group(1)
     else:
         raise ValueError(f"Unexpected filename format: {pFile}")
-    # Load the data
-    prob_df = pd.read_csv(pFile, sep='\t', low_memory=False)
-    # Replace Predictions column values: 0 → 'label-', 1 → 'label+'
-    prob_df['Predictions'] = prob_df['Predictions'].map({0: f"{label}-", 1: f"{label}+"})
-    image_name = prob_df['Image'].unique()
-    if len(image_name) != 1:
-        raise ValueError('Incorrect number of images captured in _PRED.tsv files: {}'.fortmat(len(image_name)))
-    image_file = os.path.join(qFile_path, image_name[0] + '_LABELED.tsv')
-    with open(image_file, 'r') as f:
-        header = f.readline().strip().split('\t') # get only the header (column names)
-    cols_to_keep = [col for col in header if (label in col and 'Median' in col)] # Find specific columns to load
-    cols_to_keep += ['Centroid X µm', 'Centroid Y µm']
-    image_df = pd.read_csv(image_file, usecols=cols_to_keep, sep='\t') # Read only those columns
-    merge_df = prob_df.merge(image_df, on = ['Centroid X µm', 'Centroid Y µm'])
-    hue_vals = [label + x for x in ['-', '+']]
-    # Plot
     x_col = label + ': Cell: Median'
     y_col = 'Probabilities'
-    if x_col not in merge_df.columns:
-
-        print(f"[WARN] Skipping plot: column '{x_col}' not found in DataFrame.")
-    else:
-        tmp = sns.lmplot(
-            x=x_col, y=y_col, data=merge_df, logistic=True,
-            line_kws={'color': 'black'}, ci=None
-        )
-        # Generate new plt.figure()
-        plt.figure()
-        # Get the line data
-        reg_line = tmp.ax.lines[0].get_data()
-        x_fit, y_fit = reg_line  # x and y of the regression line
-        plt.close()  # Close the temp plot
+    header = read_header(pFile)
+    if x_col not in header or y_col not in header:
+        print(f"[WARN] Skipping plot: column '{x_col}' or '{y_col}' not found in {pFile}.")
+        continue
+    with perf_trace.span("read_predictions"):
+        prob_df = read_table(pFile, usecols=[x_col, y_col])
+        perf_trace.add_rows(len(prob_df))
+    x = prob_df[x_col].to_numpy(dtype=np.float64)
+    y = prob_df[y_col].to_numpy(dtype=np.float64)
+    finite = np.isfinite(x) & np.isfinite(y)
+    x, y = x[finite], y[finite]
+    if len(x) == 0:
+        print(f"[WARN] Skipping plot: no finite values in {pFile}.")
+        continue
 
-        g = sns.lmplot(
-            x=x_col, y=y_col, hue='Predictions', hue_order=hue_vals, data=merge_df, logistic=False,
-        scatter_kws={'alpha': 0.6}, y_jitter=0.025, legend=False, fit_reg=False # main data plot with hue (no regression lines)
-    )
-    ax = g.ax
-    ax.plot(x_fit, y_fit, color="black", linewidth=2, label='Global Logistic Fit') # Add the extracted regression line to the current plot
+    fig, ax = plt.subplots(figsize=(6, 5))
+    density, x_edges, y_edges = np.histogram2d(x, y, bins=(120, 60), range=[[x.min(), x.max() if x.max() > x.min() else x.min() + 1], [0, 1]])
+    mesh = ax.pcolormesh(x_edges, y_edges, np.ma.masked_equal(density.T, 0), norm=LogNorm(), cmap='viridis')
+    fig.colorbar(mesh, ax=ax, label='Cells')
+    ax.axhline(0.5, color='grey', linestyle='--', linewidth=1, label=f'{label}- / {label}+ threshold')
+    fit = binned_logistic_fit(x, y)
+    if fit is not None:
+        ax.plot(fit[0], fit[1], color="black", linewidth=2, label='Global Logistic Fit')
+    ax.set_xlabel(x_col)
+    ax.set_ylabel(y_col)
+    ax.legend(loc='lower right') # add legend for the logistic curve
+    ax.set_title('Probability & Intensity Distribution ' + label)
 
     plot_name = f"{img_id}_{label}_probability-distribution.png"
-    ax.legend() # add legend for the logistic curve
-    plt.title('Probability & Intensity Distribution ' + label)
-    plt.savefig(plot_name, bbox_inches='tight')
-    plt.close()
+    fig.savefig(plot_name, bbox_inches='tight')
+    plt.close(fig)
     curve_files.append(plot_name)
 
 ### Match plots by Marker ###
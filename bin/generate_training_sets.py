@@ -7,6 +7,8 @@ import pandas as pd
 import sys
 import re
 
+import perf_trace
+
 def filter_and_reduce_labels(df, label_column, label_prefix):
     """
     Filter a column of lists to retain only elements that match a given prefix (case insensitive)
@@ -57,7 +59,7 @@ def process_files(input_files, label_column, label_delimiter, chunksize=250_000)
             print(f"Error reading {file}: {e}")
             continue
 
-        for chunk in reader:
+        for chunk in perf_trace.iter_chunks(reader, "split_labels"):
             if label_column not in chunk.columns:
                 print(f"ERROR: Label column '{label_column}' not found in columns: {chunk.columns.tolist()}")
                 continue
@@ -128,5 +130,6 @@ if __name__ == "__main__":
     label_delimiter = sys.argv[2]
     input_files = sys.argv[3:]
 
+    perf_trace.start("generate_training_sets")
     process_files(input_files, label_column, label_delimiter)
 
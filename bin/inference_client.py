@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Plain client for inference_server.py (standard library only, plus pyarrow for frames).
+
+    inference_client.py [--url http://127.0.0.1:8765 | --socket PATH] health
+    inference_client.py ... models
+    inference_client.py ... reload
+    inference_client.py ... predict <table.tsv> [--markers CD3,CD8] [--filter Image=slide_3.tif] [--output out.tsv]
+
+From Python:
+
+    client = InferenceClient(socket_path="/tmp/binflow.sock")
+    client.predict_table("/data/slide_3.tsv", markers=["CD3"], output="/tmp/slide_3_scores.tsv")
+    scores = client.predict_frame(cells_df)     # Arrow round trip, returns a DataFrame
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+from urllib.parse import urlencode, urlparse
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class InferenceError(RuntimeError):
+    pass
+
+
+class InferenceClient:
+    def __init__(self, url="http://127.0.0.1:8765", socket_path=None, timeout=600):
+        self.url = urlparse(url)
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def _connection(self):
+        if self.socket_path:
+            return UnixHTTPConnection(self.socket_path, self.timeout)
+        return http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=self.timeout)
+
+    def _request(self, method, path, body=None, content_type="application/json"):
+        conn = self._connection()
+        try:
+            headers = {"Content-Type": content_type} if body is not None else {}
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            data = response.read()
+            if response.status != 200:
+                try:
+                    message = json.loads(data)["error"]
+                except (ValueError, KeyError):
+                    message = data.decode(errors="replace")
+                raise InferenceError(f"{method} {path}: HTTP {response.status}: {message}")
+            return data
+        finally:
+            conn.close()
+
+    def health(self):
+        return json.loads(self._request("GET", "/health"))
+
+    def models(self):
+        return json.loads(self._request("GET", "/models"))
+
+    def reload(self):
+        return json.loads(self._request("POST", "/reload", b""))
+
+    def predict_table(self, table, markers=None, filters=None, output=None):
+        """Server-side read of `table`; the response has the predictions inline unless `output` is given."""
+        request = {"table": table, "markers": markers or [], "filter": filters or {}, "output": output}
+        return json.loads(self._request("POST", "/predict", json.dumps(request).encode()))
+
+    def predict_frame(self, df, markers=None):
+        """Predictions for the rows of a DataFrame, sent and returned as Arrow IPC streams."""
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        query = f"?{urlencode({'markers': ','.join(markers)})}" if markers else ""
+        data = self._request("POST", f"/predict{query}", sink.getvalue().to_pybytes(), ARROW_STREAM)
+        return pa.ipc.open_stream(data).read_all().to_pandas()
+
+
+def parse_filters(items):
+    filters = {}
+    for item in items:
+        column, _, value = item.partition("=")
+        filters.setdefault(column, []).append(value)
+    return filters
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Query a running inference_server.py.")
+    ap.add_argument("--url", default="http://127.0.0.1:8765")
+    ap.add_argument("--socket", help="Unix socket of the server (instead of --url)")
+    ap.add_argument("--timeout", type=float, default=600)
+    sub = ap.add_subparsers(dest="command", required=True)
+    sub.add_parser("health")
+    sub.add_parser("models")
+    sub.add_parser("reload")
+    p = sub.add_parser("predict", help="Score a table (read by the server)")
+    p.add_argument("table")
+    p.add_argument("--markers", default="", help="Comma-separated markers (default: all models)")
+    p.add_argument("--filter", action="append", default=[], metavar="COLUMN=VALUE",
+                   help="Only rows with this value, e.g. Image=slide_3.tif (repeatable)")
+    p.add_argument("--output", help="TSV written by the server; without it the predictions are printed")
+    args = ap.parse_args()
+
+    client = InferenceClient(args.url, args.socket, args.timeout)
+    try:
+        if args.command == "predict":
+            markers = [m for m in args.markers.split(",") if m]
+            # The server resolves paths itself, so send it an absolute one
+            result = client.predict_table(os.path.abspath(args.table), markers, parse_filters(args.filter),
+                                          os.path.abspath(args.output) if args.output else None)
+        else:
+            result = getattr(client, args.command)()
+    except (InferenceError, OSError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
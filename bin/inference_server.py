@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Local long-lived scoring service for ad-hoc re-scoring with the current marker models.
+
+    inference_server.py --models <output_dir>/models [--port 8765 | --socket /tmp/binflow.sock]
+
+Models (<classifier>_best_model_<marker>.pkl, the newest per marker) are unpickled
+once and kept in memory, so re-scoring an image costs a table read and a predict,
+not an interpreter start, sklearn import and unpickling per marker. Listens on
+127.0.0.1 only, or on a Unix socket.
+
+    GET  /health            {"status": "ok", "models": n}
+    GET  /models            marker -> model file and feature columns
+    POST /reload            reload the models directory
+    POST /predict           JSON {"table": path, "markers": [...], "filter": {column: value(s)},
+                            "output": path}: predictions of the table's rows (optionally only
+                            those matching the filter, e.g. {"Image": "slide_3.tif"}), written
+                            to "output" as TSV or returned in pandas' "split" JSON layout
+    POST /predict?markers=  Arrow IPC stream of cells in, Arrow IPC stream of predictions out
+
+Each marker's rows are scored in chunks of --batch-rows on a thread pool; concurrent
+small requests for the same marker are batched into one predict call (up to
+--batch-rows rows, waiting at most --batch-wait-ms). Markers whose feature columns
+are missing from the input are reported under "skipped" rather than scored.
+"""
+import argparse
+import glob
+import json
+import os
+import pickle
+import re
+import signal
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty, Queue
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+import cpu_budget
+from best_model_predictions import feature_columns
+from table_reader import read_header, read_table
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+MODEL_PATTERN = re.compile(r"_best_model_(.+)\.pkl$")
+
+
+def is_key_column(col):
+    # The columns save_predictions() keeps next to the predictions
+    return "centroid" in col.lower() or "image" in col.lower()
+
+
+class MarkerModel:
+    def __init__(self, marker, path):
+        self.marker = marker
+        self.path = path
+        with open(path, "rb") as f:
+            self.model = pickle.load(f)
+        self.features = feature_columns(self.model)
+        # Parallelism comes from the server's thread pool, not from inside each model
+        for name in self.model.get_params():
+            if name.endswith("n_jobs"):
+                self.model.set_params(**{name: 1})
+
+    def predict(self, X):
+        return self.model.predict(X), self.model.predict_proba(X)[:, 1]
+
+    def describe(self):
+        return {"model": os.path.basename(self.path), "features": self.features}
+
+
+def load_models(models_dir):
+    """marker -> MarkerModel, the newest model file of each marker."""
+    newest = {}
+    for path in glob.glob(os.path.join(models_dir, "*.pkl")):
+        m = MODEL_PATTERN.search(os.path.basename(path))
+        if not m:
+            continue
+        marker = m.group(1)
+        if marker not in newest or os.path.getmtime(path) > os.path.getmtime(newest[marker]):
+            newest[marker] = path
+    return {marker: MarkerModel(marker, path) for marker, path in sorted(newest.items())}
+
+
+class MarkerBatcher:
+    """
+    Scores one marker's requests on the shared pool, merging the small ones that
+    arrive within `wait_s` of each other into a single predict call.
+    """
+
+    def __init__(self, model, pool, batch_rows, wait_s):
+        self.model = model
+        self.pool = pool
+        self.batch_rows = batch_rows
+        self.wait_s = wait_s
+        self.queue = Queue()
+        self.lock = threading.Lock()
+        self.closed = False
+        threading.Thread(target=self._run, name=f"batcher-{model.marker}", daemon=True).start()
+
+    def submit(self, X):
+        """Future of (predictions, probabilities) for the rows of X."""
+        future = Future()
+        with self.lock:
+            if len(X) >= self.batch_rows or self.closed:
+                # Already a full batch (or replaced by a reload): straight to the pool
+                self.pool.submit(self._score, [(X, future)])
+            else:
+                self.queue.put((X, future))
+        return future
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.queue.put(None)
+
+    def _run(self):
+        while True:
+            first = self.queue.get()
+            if first is None:
+                return
+            batch = [first]
+            rows = len(first[0])
+            deadline = time.monotonic() + self.wait_s
+            while rows < self.batch_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except Empty:
+                    break
+                if item is None:
+                    self.pool.submit(self._score, batch)
+                    return
+                batch.append(item)
+                rows += len(item[0])
+            self.pool.submit(self._score, batch)
+
+    def _score(self, batch):
+        try:
+            X = pd.concat([x for x, _ in batch], ignore_index=True) if len(batch) > 1 else batch[0][0]
+            predictions, probabilities = self.model.predict(X)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        start = 0
+        for x, future in batch:
+            end = start + len(x)
+            future.set_result((predictions[start:end], probabilities[start:end]))
+            start = end
+
+
+class InferenceService:
+    def __init__(self, models_dir, workers, batch_rows, batch_wait_ms):
+        self.models_dir = models_dir
+        self.batch_rows = batch_rows
+        self.wait_s = batch_wait_ms / 1000.0
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="score")
+        self.lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        models = load_models(self.models_dir)
+        batchers = {m: MarkerBatcher(model, self.pool, self.batch_rows, self.wait_s) for m, model in models.items()}
+        with self.lock:
+            previous, self.batchers = getattr(self, "batchers", {}), batchers
+        for batcher in previous.values():
+            batcher.close()
+        print(f"Loaded {len(models)} models from {self.models_dir}: {', '.join(models) or '-'}", flush=True)
+        return len(models)
+
+    def describe(self):
+        with self.lock:
+            return {m: b.model.describe() for m, b in self.batchers.items()}
+
+    def select(self, markers):
+        with self.lock:
+            batchers = dict(self.batchers)
+        if not markers:
+            return batchers
+        unknown = [m for m in markers if m not in batchers]
+        if unknown:
+            raise KeyError(f"No model for marker(s) {', '.join(unknown)}; loaded: {', '.join(batchers) or '-'}")
+        return {m: batchers[m] for m in markers}
+
+    def needed_columns(self, header, markers):
+        features = {c for b in self.select(markers).values() for c in b.model.features}
+        return [c for c in header if is_key_column(c) or c in features]
+
+    def score(self, df, markers=None):
+        """Key columns of df plus Prediction_<marker> / Probability_<marker> columns, and the skipped markers."""
+        batchers = self.select(markers)
+        out = df[[c for c in df.columns if is_key_column(c)]].reset_index(drop=True)
+        pending, skipped = {}, {}
+        for marker, batcher in batchers.items():
+            missing = [c for c in batcher.model.features if c not in df.columns]
+            if missing:
+                skipped[marker] = missing
+                continue
+            X = df[batcher.model.features].reset_index(drop=True)
+            pending[marker] = [batcher.submit(X.iloc[i:i + self.batch_rows])
+                               for i in range(0, len(X), self.batch_rows)]
+        for marker, futures in pending.items():
+            results = [f.result() for f in futures]
+            out[f"Prediction_{marker}"] = np.concatenate([r[0] for r in results]) if results else []
+            out[f"Probability_{marker}"] = np.concatenate([r[1] for r in results]) if results else []
+        return out, skipped
+
+    def predict_table(self, request):
+        table = request["table"]
+        markers = request.get("markers")
+        filters = request.get("filter") or {}
+        header = read_header(table)
+        unknown = [c for c in filters if c not in header]
+        if unknown:
+            raise KeyError(f"unknown filter column {', '.join(unknown)}")
+        usecols = set(self.needed_columns(header, markers)) | set(filters)
+        df = read_table(table, usecols=[c for c in header if c in usecols], downcast=False)
+        for column, values in filters.items():
+            values = values if isinstance(values, list) else [values]
+            df = df[df[column].astype(str).isin([str(v) for v in values])]
+        out, skipped = self.score(df, markers)
+        response = {"table": table, "rows": len(out), "markers": [m for m in self.select(markers) if m not in skipped],
+                    "skipped": skipped}
+        if request.get("output"):
+            out.to_csv(request["output"], sep="\t", index=False)
+            response["output"] = request["output"]
+        else:
+            response["predictions"] = json.loads(out.to_json(orient="split", index=False))
+        return response
+
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def address_string(self):
+            # Unix socket peers have no (host, port)
+            return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+        def _send(self, status, body, content_type="application/json"):
+            if content_type == "application/json":
+                body = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self):
+            return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/health":
+                self._send(200, {"status": "ok", "models": len(service.describe())})
+            elif path == "/models":
+                self._send(200, service.describe())
+            else:
+                self._send(404, {"error": f"unknown endpoint {path}"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            started = time.perf_counter()
+            try:
+                if url.path == "/reload":
+                    self._body()
+                    self._send(200, {"models": service.reload()})
+                elif url.path != "/predict":
+                    self._body()
+                    self._send(404, {"error": f"unknown endpoint {url.path}"})
+                elif self.headers.get("Content-Type", "").startswith(ARROW_STREAM):
+                    markers = [m for m in ",".join(parse_qs(url.query).get("markers", [])).split(",") if m]
+                    self._send(200, self._predict_arrow(self._body(), markers), ARROW_STREAM)
+                else:
+                    response = service.predict_table(json.loads(self._body() or b"{}"))
+                    response["seconds"] = round(time.perf_counter() - started, 3)
+                    self._send(200, response)
+            except (KeyError, ValueError, FileNotFoundError) as e:
+                self._send(400, {"error": str(e).strip("'\"")})
+            except ImportError as e:
+                self._send(415, {"error": f"Arrow requests need pyarrow: {e}"})
+            except Exception as e:
+                self._send(500, {"error": f"{type(e).__name__}: {e}"})
+
+        def _predict_arrow(self, body, markers):
+            import pyarrow as pa
+
+            df = pa.ipc.open_stream(body).read_all().to_pandas()
+            out, skipped = service.score(df, markers or None)
+            table = pa.Table.from_pandas(out, preserve_index=False)
+            table = table.replace_schema_metadata({"skipped": json.dumps(skipped)})
+            sink = pa.BufferOutputStream()
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            return sink.getvalue().to_pybytes()
+
+    return Handler
+
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Serve the current marker models for ad-hoc scoring.")
+    ap.add_argument("--models", required=True, help="Directory of *_best_model_<marker>.pkl files (<output_dir>/models)")
+    ap.add_argument("--port", type=int, default=8765, help="Port on 127.0.0.1 (ignored with --socket)")
+    ap.add_argument("--socket", help="Listen on this Unix socket instead of TCP")
+    ap.add_argument("--workers", type=int, default=0, help="Scoring threads (0: the CPU budget)")
+    ap.add_argument("--batch-rows", type=int, default=50_000, help="Rows per predict call")
+    ap.add_argument("--batch-wait-ms", type=float, default=5.0,
+                    help="How long a small request waits for others to share its predict call")
+    args = ap.parse_args()
+
+    workers = cpu_budget.resolve_jobs(args.workers)
+    cpu_budget.limit_threads(1)
+    service = InferenceService(args.models, workers, args.batch_rows, args.batch_wait_ms)
+    handler = make_handler(service)
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        server = UnixHTTPServer(args.socket, handler)
+        where = args.socket
+    else:
+        server = ThreadingHTTPServer(("127.0.0.1", args.port), handler)
+        where = f"http://127.0.0.1:{server.server_address[1]}"
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    print(f"Serving on {where} with {workers} scoring threads", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.pool.shutdown(wait=False, cancel_futures=True)
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
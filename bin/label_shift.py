@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Label statistics of an incremental run against the run it extends.
+
+Combines the previous run's per-file label tables (label_counts.tsv from
+binary_counter.py, perlabel_table.tsv from binary_table.py) with those of the new
+tables, a new table replacing an earlier row of the same file. For every marker
+("<marker>+" / "<marker>-" labels) it compares the positive fraction of the
+labelled cells before and after adding the new tables; markers whose fraction
+moves by more than --threshold, or that had no labels before, are listed in
+retrain_markers.txt and get a new model, the others keep the previous one.
+"""
+import argparse
+import sys
+
+import pandas as pd
+
+import perf_trace
+
+SHIFT_COLUMNS = ["marker", "previous_positive", "previous_negative", "new_positive", "new_negative",
+                 "previous_fraction", "combined_fraction", "shift", "retrain"]
+
+
+def combine(previous_path, new_path):
+    previous = pd.read_csv(previous_path, sep="\t")
+    new = pd.read_csv(new_path, sep="\t")
+    combined = pd.concat([previous, new], ignore_index=True, sort=False)
+    combined = combined.drop_duplicates(subset="file", keep="last")
+    count_columns = [c for c in combined.columns if c != "file"]
+    combined[count_columns] = combined[count_columns].fillna(0).astype(int)
+    return combined
+
+
+def marker_counts(recounts):
+    totals = recounts.drop(columns="file").sum()
+    counts = {}
+    for label, n in totals.items():
+        label = str(label)
+        if label.endswith(("+", "-")):
+            sign = "positive" if label.endswith("+") else "negative"
+            counts.setdefault(label[:-1], {"positive": 0, "negative": 0})[sign] += int(n)
+    return counts
+
+
+def positive_fraction(c):
+    total = c["positive"] + c["negative"]
+    return c["positive"] / total if total else None
+
+
+def label_shift(previous_recounts, new_recounts, threshold):
+    previous = marker_counts(previous_recounts)
+    new = marker_counts(new_recounts)
+    rows = []
+    for marker in sorted(set(previous) | set(new)):
+        before = previous.get(marker, {"positive": 0, "negative": 0})
+        added = new.get(marker, {"positive": 0, "negative": 0})
+        after = {k: before[k] + added[k] for k in before}
+        f0, f1 = positive_fraction(before), positive_fraction(after)
+        shift = abs(f1 - f0) if f0 is not None and f1 is not None else None
+        if f0 is None:
+            retrain = f1 is not None  # a marker first labelled in the new tables
+        else:
+            retrain = shift > threshold
+        rows.append({
+            "marker": marker,
+            "previous_positive": before["positive"],
+            "previous_negative": before["negative"],
+            "new_positive": added["positive"],
+            "new_negative": added["negative"],
+            "previous_fraction": f0,
+            "combined_fraction": f1,
+            "shift": shift,
+            "retrain": retrain,
+        })
+    return pd.DataFrame(rows, columns=SHIFT_COLUMNS)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Combine label counts with a previous run's and flag markers to retrain.")
+    ap.add_argument("--previous-counts", required=True, help="label_counts.tsv of the previous run")
+    ap.add_argument("--previous-recounts", required=True, help="perlabel_table.tsv of the previous run")
+    ap.add_argument("--counts", required=True, help="label_counts.tsv of the new tables")
+    ap.add_argument("--recounts", required=True, help="perlabel_table.tsv of the new tables")
+    ap.add_argument("--threshold", type=float, default=0.05,
+                    help="Retrain a marker when its positive fraction moves by more than this")
+    ap.add_argument("--output-dir", default=".")
+    args = ap.parse_args()
+
+    perf_trace.start("label_shift")
+    with perf_trace.span("combine"):
+        counts = combine(args.previous_counts, args.counts)
+        recounts = combine(args.previous_recounts, args.recounts)
+        previous_recounts = pd.read_csv(args.previous_recounts, sep="\t")
+        new_files = set(pd.read_csv(args.recounts, sep="\t")["file"])
+        # A re-counted table replaces its earlier counts rather than adding to them
+        previous_recounts = previous_recounts[~previous_recounts["file"].isin(new_files)]
+        shift = label_shift(previous_recounts, recounts[recounts["file"].isin(new_files)], args.threshold)
+
+    counts.to_csv(f"{args.output_dir}/label_counts.tsv", sep="\t", index=False)
+    recounts.to_csv(f"{args.output_dir}/perlabel_table.tsv", sep="\t", index=False)
+    shift.to_csv(f"{args.output_dir}/label_shift.tsv", sep="\t", index=False)
+    retrain = shift.loc[shift["retrain"], "marker"].tolist()
+    with open(f"{args.output_dir}/retrain_markers.txt", "w") as fh:
+        fh.write("".join(f"{m}\n" for m in retrain))
+
+    print(f"{len(new_files)} new tables; {len(retrain)}/{len(shift)} markers to retrain (threshold {args.threshold})")
+    for row in shift.itertuples():
+        if row.retrain:
+            reason = "new marker" if row.previous_fraction is None or pd.isna(row.previous_fraction) else f"shift {row.shift:.3f}"
+            print(f"  retrain {row.marker}: {reason}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
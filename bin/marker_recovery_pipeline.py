@@ -6,19 +6,21 @@ from datetime import datetime
 from pathlib import Path
 
 import joblib
+from joblib import Parallel, delayed
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import seaborn as sns
 from scipy.signal import argrelextrema
 from scipy.stats import gaussian_kde, kurtosis, loguniform, randint, skew, uniform
-from sklearn.cluster import KMeans
+from sklearn.cluster import MiniBatchKMeans
 from sklearn.compose import ColumnTransformer
 from sklearn.decomposition import PCA
 from sklearn.ensemble import ExtraTreesClassifier, IsolationForest, RandomForestClassifier
+from sklearn.calibration import CalibratedClassifierCV
 from sklearn.impute import SimpleImputer
+from sklearn.kernel_approximation import Nystroem
 from sklearn.linear_model import LogisticRegression
-from sklearn.manifold import TSNE
 from sklearn.metrics import (
     accuracy_score,
     adjusted_rand_score,
@@ -32,29 +34,90 @@ from sklearn.metrics import (
     silhouette_score,
 )
 from sklearn.mixture import GaussianMixture
-from sklearn.model_selection import GroupShuffleSplit, RandomizedSearchCV, StratifiedKFold, StratifiedGroupKFold
+from sklearn.model_selection import GroupShuffleSplit, RandomizedSearchCV, StratifiedKFold, StratifiedGroupKFold, train_test_split
 from sklearn.neighbors import LocalOutlierFactor
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import PowerTransformer, RobustScaler, StandardScaler
-from sklearn.svm import SVC
+from pandas.api.types import is_numeric_dtype, union_categoricals
+from sklearn.svm import SVC, LinearSVC
+
+import cpu_budget
+import perf_trace
+from checkpoint import Checkpointer
+from embedding import fit_reference_embedding, load_reference, place_points
+from spatial_raster import aggregate_labels, grid_index, write_label_rasters
+from table_reader import DEFAULT_MEMORY_BUDGET_MB, read_table
 
 sns.set(style="whitegrid")
 
+FEATURE_DTYPE = np.float32
 
-def parse_classification_value(classification_string, marker='NAK'):
-    if pd.isna(classification_string):
-        return np.nan
+
+def parse_classification_tokens(classification_string):
     token_map = {}
+    if pd.isna(classification_string):
+        return token_map
     for token in str(classification_string).split('|'):
         token = token.strip()
         m = re.match(r'^(.+?)([+-])$', token)
         if m:
             token_map[m.group(1)] = m.group(2)
+    return token_map
+
+
+def parse_classification_value(classification_string, marker='NAK'):
+    token_map = parse_classification_tokens(classification_string)
     if marker not in token_map:
         return np.nan
     return 1 if token_map[marker] == '+' else 0
 
 
+def classification_labels(values, markers):
+    """1/0/NaN label vector per marker, parsing each distinct classification string once."""
+    codes, uniques = pd.factorize(values)
+    token_maps = [parse_classification_tokens(u) for u in uniques]
+    labels = {}
+    for marker in markers:
+        # Trailing NaN catches code -1 (missing classification)
+        lookup = np.array([np.nan if marker not in t else float(t[marker] == '+') for t in token_maps] + [np.nan])
+        labels[marker] = lookup[codes]
+    return labels
+
+
+def load_marker_tables(tables, markers, classification_col='Classification'):
+    """
+    Read every table once, keeping only the requested markers' columns, centroids and labels.
+
+    Measurements are read as float32; the classification and source file are categoricals
+    that share one set of categories across tables, so the concat does not fall back to object.
+    """
+    include = '^(' + '|'.join(re.escape(m) for m in markers) + ')'
+    keep = [classification_col, 'Centroid X µm', 'Centroid Y µm']
+    names = [Path(fp).name for fp in tables]
+    frames = []
+    for fp, name in zip(tables, names):
+        d = read_table(fp, include=include, keep=keep, categorical=(classification_col,))
+        d['source_file'] = pd.Categorical.from_codes(np.zeros(len(d), dtype=np.int8), categories=[name])
+        frames.append(d)
+    for col in (classification_col, 'source_file'):
+        if all(col in d.columns and isinstance(d[col].dtype, pd.CategoricalDtype) for d in frames):
+            categories = union_categoricals([d[col] for d in frames], ignore_order=True).categories
+            for d in frames:
+                d[col] = d[col].cat.set_categories(categories)
+    df = pd.concat(frames, axis=0, ignore_index=True, sort=False)
+    del frames
+    return df
+
+
+def marker_matrix(df, columns):
+    """Float32 feature matrix with missing values as 0; parses only columns that were read as text."""
+    X = df[columns]
+    text_cols = [c for c in columns if not is_numeric_dtype(X[c])]
+    if text_cols:
+        X = X.assign(**{c: pd.to_numeric(X[c], errors='coerce') for c in text_cols})
+    return X.astype(FEATURE_DTYPE).fillna(0.0)
+
+
 def find_marker_feature_columns(df, marker='NAK', exclude_component_patterns=None):
     marker_cols = [c for c in df.columns if str(c).startswith(marker)]
     if not exclude_component_patterns:
@@ -94,7 +157,7 @@ def apply_gmm_gating_to_matrix(X_df, random_state=0):
     for col in gated.columns:
         pre = gated[col].astype(float).fillna(0.0).values
         post, threshold, n_components, means, stds = gmm_gate_column(pre, random_state=random_state)
-        gated[col] = post
+        gated[col] = post.astype(X_df[col].dtype) if is_numeric_dtype(X_df[col]) else post
         rows.append({
             'feature': col,
             'threshold': threshold,
@@ -110,15 +173,123 @@ def apply_gmm_gating_to_matrix(X_df, random_state=0):
     return gated, pd.DataFrame(rows)
 
 
+def inference_chunk_rows(n_features, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    # Per row: the float64 copies made by imputer, scaler and estimator (about four of the features)
+    return max(1_000, int(memory_budget_mb * 1024 * 1024 / (32 * max(n_features, 1))))
+
+
+def stream_predictions(model, X, source_file, marker, out_path, chunk_rows):
+    """
+    Score `X` in row chunks, appending each chunk's labels to `out_path` as it is scored.
+
+    Returns the 0/1 predictions as int8, which is all the spatial maps and counts need.
+    """
+    pred = np.empty(len(X), dtype=np.int8)
+    names = np.array([f'{marker}-', f'{marker}+'])
+    source = np.asarray(source_file).astype(str)
+    with open(out_path, 'w', encoding='utf-8', newline='') as fh:
+        fh.write('source_file\tpredicted_label\n')
+        for start in range(0, len(X), chunk_rows):
+            chunk = X.iloc[start:start + chunk_rows]
+            prob = model.predict_proba(chunk)[:, 1] if hasattr(model, 'predict_proba') else model.predict(chunk)
+            pred[start:start + len(chunk)] = prob >= 0.5
+            pd.DataFrame({'source_file': source[start:start + len(chunk)], 'predicted_label': names[pred[start:start + len(chunk)]]}).to_csv(
+                fh, sep='\t', index=False, header=False)
+    return pred
+
+
+def outlier_chunk_rows(n_features, n_neighbors, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    # Per query row: its features plus n_neighbors distances and indices (float64 + int64)
+    per_row = 8 * n_features + 16 * n_neighbors
+    return max(1_000, int(memory_budget_mb * 1024 * 1024 / per_row))
+
+
+def detect_outliers(X_scaled, contamination, random_state=0, n_neighbors=35, fit_rows=100_000,
+                    algorithm='auto', n_jobs=-1, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+    """
+    IsolationForest + LOF outlier flags for every row.
+
+    Up to `fit_rows` rows both detectors run exactly as before (fit_predict on all rows).
+    Above that they are fitted on a uniform subsample of `fit_rows` rows and every row is
+    scored against it in chunks sized to the memory budget, with LOF in novelty mode on a
+    KD/ball-tree neighbour index queried with `n_jobs` workers.
+    """
+    n = len(X_scaled)
+    iso = IsolationForest(contamination=contamination, random_state=random_state, n_jobs=n_jobs)
+    if n <= fit_rows:
+        lof = LocalOutlierFactor(n_neighbors=n_neighbors, contamination=contamination, algorithm=algorithm, n_jobs=n_jobs)
+        return (iso.fit_predict(X_scaled) == -1) | (lof.fit_predict(X_scaled) == -1)
+
+    rng = np.random.default_rng(random_state)
+    fit_idx = np.sort(rng.choice(n, size=fit_rows, replace=False))
+    X_fit = X_scaled[fit_idx]
+    iso.fit(X_fit)
+    lof = LocalOutlierFactor(n_neighbors=n_neighbors, contamination=contamination, algorithm=algorithm,
+                             novelty=True, n_jobs=n_jobs).fit(X_fit)
+    is_outlier = np.zeros(n, dtype=bool)
+    step = outlier_chunk_rows(X_scaled.shape[1], n_neighbors, memory_budget_mb)
+    for start in range(0, n, step):
+        block = X_scaled[start:start + step]
+        is_outlier[start:start + step] = (iso.predict(block) == -1) | (lof.predict(block) == -1)
+    return is_outlier
+
+
+def stratified_sample_index(y, size, random_state=0):
+    """Row positions of a fixed-size sample stratified by label (all rows when there are fewer)."""
+    n = len(y)
+    if n <= size:
+        return np.arange(n)
+    try:
+        idx, _ = train_test_split(np.arange(n), train_size=size, stratify=y, random_state=random_state)
+    except ValueError:  # a class too small to stratify
+        idx = np.random.default_rng(random_state).choice(n, size=size, replace=False)
+    return np.sort(idx)
+
+
+def score_clustering(method, k, X, y, fit_idx, sil_idx, random_state=0):
+    """Fit one clustering, label every row, and score it (silhouette on the sample only)."""
+    if method == 'KMeans':
+        model = MiniBatchKMeans(n_clusters=k, random_state=random_state, n_init=3, batch_size=4096)
+        model.fit(X)
+    else:
+        model = GaussianMixture(n_components=k, random_state=random_state)
+        # Full-covariance GMMs can fail to factorise float32 covariances; fit in float64
+        model.fit(X[fit_idx].astype(np.float64))
+    cl = model.predict(X)
+    sil_labels = cl[sil_idx]
+    silhouette = silhouette_score(X[sil_idx], sil_labels) if len(np.unique(sil_labels)) > 1 else np.nan
+    return {'method': method, 'k': k, 'ARI': adjusted_rand_score(y, cl), 'NMI': normalized_mutual_info_score(y, cl), 'Silhouette': silhouette}
+
+
+def cluster_sweep(X, y, random_state=0, fit_rows=100_000, silhouette_rows=10_000, n_jobs=-1):
+    """
+    MiniBatchKMeans for k=2..6 and GMMs (fitted on a `fit_rows` subsample) for k=2..5,
+    all k values in parallel. ARI/NMI use every row; silhouette uses a fixed-size
+    sample stratified by label.
+    """
+    y = np.asarray(y)
+    fit_idx = np.sort(np.random.default_rng(random_state).choice(len(X), size=min(fit_rows, len(X)), replace=False))
+    sil_idx = stratified_sample_index(y, silhouette_rows, random_state=random_state)
+    configs = [('KMeans', k) for k in [2, 3, 4, 5, 6]] + [('GMM', k) for k in [2, 3, 4, 5]]
+    outer, inner = cpu_budget.split(len(configs), n_jobs)
+    with cpu_budget.inner_threads(inner):
+        records = Parallel(n_jobs=outer)(
+            delayed(score_clustering)(method, k, X, y, fit_idx, sil_idx, random_state) for method, k in configs
+        )
+    return pd.DataFrame(records)
+
+
 def build_preprocessor(numeric_features, scaler='standard'):
     scaler_obj = StandardScaler() if scaler == 'standard' else RobustScaler()
     numeric_transformer = Pipeline(steps=[('imputer', SimpleImputer(strategy='median')), ('scaler', scaler_obj)])
     return ColumnTransformer(transformers=[('num', numeric_transformer, numeric_features)], remainder='drop')
 
 
-def build_model_candidates(preprocessor, n_iter=30, cv=5, random_state=421):
+def build_model_candidates(preprocessor, n_iter=30, cv=5, random_state=421, n_train_rows=None, svc_max_rows=20_000, n_jobs=-1):
     models = {}
-    rf = Pipeline([('preprocessor', preprocessor), ('classifier', RandomForestClassifier(random_state=random_state, n_jobs=-1))])
+    # Searches run candidates in parallel; the forests inside them get what is left of the budget
+    search_jobs, model_jobs = cpu_budget.split(n_iter, n_jobs)
+    rf = Pipeline([('preprocessor', preprocessor), ('classifier', RandomForestClassifier(random_state=random_state, n_jobs=model_jobs))])
     rf_grid = {
         'classifier__n_estimators': randint(150, 500),
         'classifier__max_depth': [None] + list(range(3, 14)),
@@ -128,9 +299,9 @@ def build_model_candidates(preprocessor, n_iter=30, cv=5, random_state=421):
         'classifier__criterion': ['gini', 'entropy', 'log_loss'],
         'classifier__class_weight': [None, 'balanced', 'balanced_subsample'],
     }
-    models['RandomForest'] = RandomizedSearchCV(rf, rf_grid, n_iter=n_iter, scoring='average_precision', cv=cv, random_state=random_state, n_jobs=-1)
-    et = Pipeline([('preprocessor', preprocessor), ('classifier', ExtraTreesClassifier(random_state=random_state, n_jobs=-1))])
-    models['ExtraTrees'] = RandomizedSearchCV(et, rf_grid.copy(), n_iter=n_iter, scoring='average_precision', cv=cv, random_state=random_state, n_jobs=-1)
+    models['RandomForest'] = RandomizedSearchCV(rf, rf_grid, n_iter=n_iter, scoring='average_precision', cv=cv, random_state=random_state, n_jobs=search_jobs)
+    et = Pipeline([('preprocessor', preprocessor), ('classifier', ExtraTreesClassifier(random_state=random_state, n_jobs=model_jobs))])
+    models['ExtraTrees'] = RandomizedSearchCV(et, rf_grid.copy(), n_iter=n_iter, scoring='average_precision', cv=cv, random_state=random_state, n_jobs=search_jobs)
     lr = Pipeline([('preprocessor', preprocessor), ('classifier', LogisticRegression(max_iter=5000, random_state=random_state))])
     lr_grid = {
         'classifier__C': loguniform(1e-4, 1e3),
@@ -140,7 +311,27 @@ def build_model_candidates(preprocessor, n_iter=30, cv=5, random_state=421):
         'classifier__l1_ratio': uniform(0, 1),
         'classifier__class_weight': [None, 'balanced'],
     }
-    models['LogisticRegression'] = RandomizedSearchCV(lr, lr_grid, n_iter=n_iter, scoring='average_precision', cv=cv, random_state=random_state, n_jobs=-1, error_score=np.nan)
+    models['LogisticRegression'] = RandomizedSearchCV(lr, lr_grid, n_iter=n_iter, scoring='average_precision', cv=cv, random_state=random_state, n_jobs=search_jobs, error_score=np.nan)
+    if n_train_rows is not None and n_train_rows > svc_max_rows:
+        # Exact SVC scales quadratically or worse in rows (plus internal Platt CV); above the cap use a
+        # Nystroem kernel map + LinearSVC with sigmoid-calibrated probabilities instead
+        svm = Pipeline([
+            ('preprocessor', preprocessor),
+            ('kernel', Nystroem(random_state=random_state)),
+            ('classifier', CalibratedClassifierCV(LinearSVC(dual='auto', max_iter=1000, random_state=random_state), method='sigmoid', cv=3)),
+        ])
+        linear_grid = {
+            'kernel__n_components': [100, 300, 500],
+            'classifier__estimator__C': loguniform(1e-3, 1e3),
+            'classifier__estimator__class_weight': [None, 'balanced'],
+        }
+        # Large gammas make cubic poly features ill-conditioned and LinearSVC very slow to converge
+        svm_grid = [
+            {'kernel__kernel': ['rbf', 'sigmoid'], 'kernel__gamma': loguniform(1e-3, 1e1), **linear_grid},
+            {'kernel__kernel': ['poly'], 'kernel__gamma': loguniform(1e-3, 1e0), **linear_grid},
+        ]
+        models['NystroemSVC'] = RandomizedSearchCV(svm, svm_grid, n_iter=max(10, n_iter // 2), scoring='average_precision', cv=cv, random_state=random_state, n_jobs=search_jobs, error_score=np.nan)
+        return models
     svm = Pipeline([('preprocessor', preprocessor), ('classifier', SVC(probability=True, random_state=random_state))])
     svm_grid = {
         'classifier__C': loguniform(1e-3, 1e3),
@@ -148,18 +339,32 @@ def build_model_candidates(preprocessor, n_iter=30, cv=5, random_state=421):
         'classifier__kernel': ['rbf', 'poly', 'sigmoid'],
         'classifier__class_weight': [None, 'balanced'],
     }
-    models['SVC'] = RandomizedSearchCV(svm, svm_grid, n_iter=max(10, n_iter // 2), scoring='average_precision', cv=cv, random_state=random_state, n_jobs=-1, error_score=np.nan)
+    models['SVC'] = RandomizedSearchCV(svm, svm_grid, n_iter=max(10, n_iter // 2), scoring='average_precision', cv=cv, random_state=random_state, n_jobs=search_jobs, error_score=np.nan)
     return models
 
 
-def evaluate_supervised_models(models, X_train, y_train, X_eval, y_eval, sample_weight_train=None, groups_train=None):
-    records = []
-    fitted = {}
-    for name, search in models.items():
+def fit_search(search, X_train, y_train, sample_weight_train=None, groups_train=None, n_jobs=-1):
+    # BLAS/OpenMP threads per search worker: its share of the CPUs given to this marker
+    _, inner = cpu_budget.split(search.n_jobs, n_jobs)
+    with cpu_budget.inner_threads(inner):
         if sample_weight_train is not None:
             search.fit(X_train, y_train, classifier__sample_weight=np.asarray(sample_weight_train), groups=groups_train)
         else:
             search.fit(X_train, y_train, groups=groups_train)
+    return search
+
+
+def evaluate_supervised_models(models, X_train, y_train, X_eval, y_eval, sample_weight_train=None, groups_train=None, checkpointer=None, checkpoint_params=None, n_jobs=-1):
+    records = []
+    fitted = {}
+    checkpointer = checkpointer or Checkpointer()
+    for name, search in models.items():
+        # Each fitted search is its own checkpoint, so a failure in one family keeps the others
+        with perf_trace.span(f'search_{name}', rows=len(X_train)):
+            search = checkpointer.run(
+                f'search_{name}', lambda s=search: fit_search(s, X_train, y_train, sample_weight_train, groups_train, n_jobs),
+                inputs=[X_train, y_train, sample_weight_train, groups_train], params=checkpoint_params,
+            )
         y_pred = search.predict(X_eval)
         y_score = search.predict_proba(X_eval)[:, 1] if hasattr(search, 'predict_proba') else None
         records.append({
@@ -179,67 +384,59 @@ def evaluate_supervised_models(models, X_train, y_train, X_eval, y_eval, sample_
     return leaderboard, records, fitted
 
 
-def main():
-    p = argparse.ArgumentParser()
-    p.add_argument('tables', nargs='+')
-    p.add_argument('--marker', default='NAK')
-    p.add_argument('--classification-col', default='Classification')
-    p.add_argument('--output-dir', required=True)
-    p.add_argument('--seed', type=int, default=421)
-    p.add_argument('--test-size', type=float, default=0.3)
-    p.add_argument('--cv-splits', type=int, default=5)
-    p.add_argument('--n-iter-search', type=int, default=30)
-    p.add_argument('--outlier-contamination', type=float, default=0.02)
-    p.add_argument('--run-gmmgating', action='store_true')
-    p.add_argument('--run-powertransform', action='store_true')
-    p.add_argument('--exclude-component-patterns', default='')
-    args = p.parse_args()
-
-    out = Path(args.output_dir)
+def run_marker(df, labels, marker, args, out, n_jobs=-1):
+    """All per-marker stages: gating, outliers, clustering, t-SNE, model search and predictions."""
+    n_jobs = cpu_budget.resolve_jobs(n_jobs)
+    out = Path(out)
     out.mkdir(parents=True, exist_ok=True)
-
-    frames = []
-    for fp in args.tables:
-        d = pd.read_csv(fp, sep='\t', low_memory=False)
-        d['source_file'] = Path(fp).name
-        frames.append(d)
-    df = pd.concat(frames, axis=0, ignore_index=True, sort=False)
-
-    df[f'{args.marker}_label'] = df[args.classification_col].apply(lambda x: parse_classification_value(x, marker=args.marker))
-    work_df = df[~df[f'{args.marker}_label'].isna()].copy()
-    work_df[f'{args.marker}_label'] = work_df[f'{args.marker}_label'].astype(int)
+    labelled = np.isfinite(labels)
+    work_df = pd.DataFrame({'source_file': df['source_file'].to_numpy()[labelled], f'{marker}_label': labels[labelled].astype(int)},
+                           index=df.index[labelled])
 
     excl = [x.strip() for x in args.exclude_component_patterns.split(',') if x.strip()]
-    marker_cols = find_marker_feature_columns(df, marker=args.marker, exclude_component_patterns=excl)
-    X_all = df[marker_cols].apply(pd.to_numeric, errors='coerce').fillna(0.0)
+    marker_cols = find_marker_feature_columns(df, marker=marker, exclude_component_patterns=excl)
+    X_all = marker_matrix(df, marker_cols)
+
+    # Each stage is keyed by the content of its own inputs and the parameters it uses,
+    # so changing a late-stage parameter still reuses everything upstream of it
+    ckpt = Checkpointer(args.checkpoint_dir or None, prefix=f'{marker}_')
 
     if args.run_gmmgating:
-        X_all, gating = apply_gmm_gating_to_matrix(X_all, random_state=args.seed)
+        with perf_trace.span('gating', rows=len(X_all)):
+            X_all, gating = ckpt.run('gating', lambda: apply_gmm_gating_to_matrix(X_all, random_state=args.seed),
+                                     inputs=[X_all], params={'seed': args.seed})
     else:
         gating = pd.DataFrame({'feature': marker_cols, 'threshold': np.nan, 'percent_gated': 0.0})
-    gating.to_csv(out / f'{args.marker}_gmm_gating_summary.csv', index=False)
+    gating.to_csv(out / f'{marker}_gmm_gating_summary.csv', index=False)
 
     plt.figure(figsize=(8, 4))
     sns.histplot(gating['percent_gated'], bins=30, kde=True)
     plt.title('Distribution of percent gated across features')
     plt.tight_layout()
-    plt.savefig(out / f'{args.marker}_gating_percent_hist.png', dpi=120)
+    plt.savefig(out / f'{marker}_gating_percent_hist.png', dpi=120)
     plt.close()
 
     if args.run_powertransform:
-        pt = PowerTransformer(method='yeo-johnson', standardize=False)
-        X_all = pd.DataFrame(pt.fit_transform(X_all), columns=X_all.columns, index=X_all.index)
-        joblib.dump(pt, out / f'{args.marker}_power_transformer.joblib')
+        def power_transform(X_in):
+            pt = PowerTransformer(method='yeo-johnson', standardize=False)
+            return pd.DataFrame(pt.fit_transform(X_in).astype(FEATURE_DTYPE), columns=X_in.columns, index=X_in.index), pt
+        with perf_trace.span('powertransform', rows=len(X_all)):
+            X_all, pt = ckpt.run('powertransform', lambda: power_transform(X_all), inputs=[X_all])
+        joblib.dump(pt, out / f'{marker}_power_transformer.joblib')
 
-    X = X_all.loc[work_df.index].copy()
-    y = work_df[f'{args.marker}_label'].astype(int)
+    X = X_all.loc[work_df.index]
+    y = work_df[f'{marker}_label'].astype(int)
 
     imp = SimpleImputer(strategy='median')
     scaler = RobustScaler()
     X_scaled = scaler.fit_transform(imp.fit_transform(X))
-    iso = IsolationForest(contamination=args.outlier_contamination, random_state=args.seed, n_jobs=-1)
-    lof = LocalOutlierFactor(n_neighbors=35, contamination=args.outlier_contamination)
-    is_outlier = (iso.fit_predict(X_scaled) == -1) | (lof.fit_predict(X_scaled) == -1)
+    with perf_trace.span('outliers', rows=len(X_scaled)):
+        is_outlier = ckpt.run('outliers', lambda: detect_outliers(
+            X_scaled, args.outlier_contamination, random_state=args.seed, n_neighbors=args.outlier_n_neighbors,
+            fit_rows=args.outlier_fit_rows, algorithm=args.outlier_algorithm, n_jobs=n_jobs,
+            memory_budget_mb=args.memory_budget_mb,
+        ), inputs=[X_scaled], params={'contamination': args.outlier_contamination, 'seed': args.seed,
+                                      'n_neighbors': args.outlier_n_neighbors, 'fit_rows': args.outlier_fit_rows})
     outlier_flag = pd.Series(is_outlier, index=X.index, name='is_outlier').astype(int)
 
     pca2 = PCA(n_components=2, random_state=args.seed)
@@ -248,37 +445,43 @@ def main():
     plt.figure(figsize=(7, 5))
     sns.scatterplot(data=plot_df, x='PC1', y='PC2', hue='is_outlier', style='label', alpha=0.6, s=20)
     plt.tight_layout()
-    plt.savefig(out / f'{args.marker}_outlier_pca.png', dpi=120)
+    plt.savefig(out / f'{marker}_outlier_pca.png', dpi=120)
     plt.close()
 
     X_inlier = X.loc[~is_outlier]
     y_inlier = y.loc[~is_outlier]
     X_inlier_scaled = scaler.transform(imp.transform(X_inlier))
 
-    cluster_records = []
-    for k in [2, 3, 4, 5, 6]:
-        km = KMeans(n_clusters=k, random_state=args.seed, n_init='auto')
-        cl = km.fit_predict(X_inlier_scaled)
-        cluster_records.append({'method': 'KMeans', 'k': k, 'ARI': adjusted_rand_score(y_inlier, cl), 'NMI': normalized_mutual_info_score(y_inlier, cl), 'Silhouette': silhouette_score(X_inlier_scaled, cl)})
-    for k in [2, 3, 4, 5]:
-        gm = GaussianMixture(n_components=k, random_state=args.seed)
-        cl = gm.fit_predict(X_inlier_scaled)
-        cluster_records.append({'method': 'GMM', 'k': k, 'ARI': adjusted_rand_score(y_inlier, cl), 'NMI': normalized_mutual_info_score(y_inlier, cl), 'Silhouette': silhouette_score(X_inlier_scaled, cl)})
-    cluster_results = pd.DataFrame(cluster_records)
+    with perf_trace.span('clusters', rows=len(X_inlier_scaled)):
+        cluster_results = ckpt.run('clusters', lambda: cluster_sweep(
+            X_inlier_scaled, y_inlier.values, random_state=args.seed, fit_rows=args.cluster_fit_rows,
+            silhouette_rows=args.silhouette_rows, n_jobs=n_jobs,
+        ), inputs=[X_inlier_scaled, y_inlier], params={'seed': args.seed, 'fit_rows': args.cluster_fit_rows,
+                                                       'silhouette_rows': args.silhouette_rows})
     cluster_results['composite_score'] = 0.45 * cluster_results['ARI'] + 0.35 * cluster_results['NMI'] + 0.20 * cluster_results['Silhouette']
     cluster_results = cluster_results.sort_values(['composite_score', 'ARI', 'NMI'], ascending=False).reset_index(drop=True)
-    cluster_results.to_csv(out / f'{args.marker}_cluster_results.csv', index=False)
-
-    sample_idx = np.arange(len(X_inlier_scaled))
-    if len(sample_idx) > 5000:
-        rng = np.random.default_rng(args.seed)
-        sample_idx = rng.choice(sample_idx, size=5000, replace=False)
-    emb = TSNE(n_components=2, random_state=args.seed, init='pca', learning_rate='auto').fit_transform(X_inlier_scaled[sample_idx])
+    cluster_results.to_csv(out / f'{marker}_cluster_results.csv', index=False)
+
+    # t-SNE is fitted on the first embedding_fit_rows cells of a random sample; the rest of
+    # the sample (or all of it, given a previous run's reference) is placed by nearest neighbours
+    sample_idx = np.random.default_rng(args.seed).permutation(len(X_inlier_scaled))[:args.embedding_rows]
+    X_emb = X_inlier_scaled[sample_idx]
+    reference = load_reference(args.embedding_reference, marker, X.columns) if args.embedding_reference else None
+    n_fit = 0
+    if reference is None:
+        n_fit = min(args.embedding_fit_rows, len(X_emb))
+        with perf_trace.span('embedding_fit', rows=n_fit):
+            reference = ckpt.run('embedding_reference', lambda: fit_reference_embedding(X_emb[:n_fit], random_state=args.seed, n_jobs=n_jobs),
+                                 inputs=[X_emb[:n_fit]], params={'seed': args.seed})
+        reference['features'] = X.columns.tolist()
+    with perf_trace.span('embedding_place', rows=len(X_emb) - n_fit):
+        emb = np.vstack([reference['embedding'][:n_fit], place_points(reference, X_emb[n_fit:], n_jobs=n_jobs)])
+    joblib.dump(reference, out / f'{marker}_embedding_reference.joblib')
     emb_df = pd.DataFrame({'t1': emb[:, 0], 't2': emb[:, 1], 'label': y_inlier.iloc[sample_idx].values})
     plt.figure(figsize=(6, 5))
-    sns.scatterplot(data=emb_df, x='t1', y='t2', hue='label', s=14)
+    sns.scatterplot(data=emb_df, x='t1', y='t2', hue='label', s=14 if len(emb_df) <= 5000 else 3, alpha=0.6, linewidth=0)
     plt.tight_layout()
-    plt.savefig(out / f'{args.marker}_tsne_labels.png', dpi=120)
+    plt.savefig(out / f'{marker}_tsne_labels.png', dpi=120)
     plt.close()
 
     groups = work_df.loc[X.index, 'source_file'].astype(str)
@@ -301,9 +504,12 @@ def main():
     cv = StratifiedGroupKFold(n_splits=min(args.cv_splits, n_groups), shuffle=True, random_state=args.seed) if n_groups >= 3 else StratifiedKFold(n_splits=3, shuffle=True, random_state=args.seed)
 
     preprocessor = build_preprocessor(X_train.columns.tolist(), scaler='standard')
-    models = build_model_candidates(preprocessor, n_iter=args.n_iter_search, cv=cv, random_state=args.seed)
-    leaderboard, detailed_records, fitted_models = evaluate_supervised_models(models, X_train, y_train, X_val, y_val, sample_weight_train=w_train, groups_train=groups_train)
-    leaderboard.to_csv(out / f'{args.marker}_supervised_leaderboard.csv', index=False)
+    models = build_model_candidates(preprocessor, n_iter=args.n_iter_search, cv=cv, random_state=args.seed,
+                                    n_train_rows=len(X_train), svc_max_rows=args.svc_max_rows, n_jobs=n_jobs)
+    leaderboard, detailed_records, fitted_models = evaluate_supervised_models(models, X_train, y_train, X_val, y_val, sample_weight_train=w_train, groups_train=groups_train, checkpointer=ckpt,
+        checkpoint_params={'seed': args.seed, 'n_iter': args.n_iter_search, 'cv_splits': args.cv_splits, 'svc_max_rows': args.svc_max_rows},
+        n_jobs=n_jobs)
+    leaderboard.to_csv(out / f'{marker}_supervised_leaderboard.csv', index=False)
 
     plot_df = leaderboard.melt(id_vars='model', value_vars=['accuracy', 'balanced_accuracy', 'f1', 'roc_auc', 'pr_auc'], var_name='metric', value_name='value')
     plt.figure(figsize=(9, 4))
@@ -311,56 +517,134 @@ def main():
     plt.ylim(0, 1)
     plt.xticks(rotation=20)
     plt.tight_layout()
-    plt.savefig(out / f'{args.marker}_model_leaderboard.png', dpi=120)
+    plt.savefig(out / f'{marker}_model_leaderboard.png', dpi=120)
     plt.close()
 
     best_name = leaderboard.iloc[0]['model']
     best_search = fitted_models[best_name]
-    all_prob = best_search.predict_proba(X_all)[:, 1] if hasattr(best_search, 'predict_proba') else best_search.predict(X_all)
-    all_pred = (all_prob >= 0.5).astype(int)
-    all_lbl = pd.Series(all_pred).map({1: f'{args.marker}+', 0: f'{args.marker}-'})
-    all_pred_df = pd.DataFrame({'source_file': df['source_file'], 'predicted_label': all_lbl})
-    all_pred_df.to_csv(out / f'{args.marker}_all_rows_predictions.tsv', sep='\t', index=False)
+    with perf_trace.span('predict_all_rows', rows=len(X_all)):
+        all_pred = stream_predictions(best_search, X_all, df['source_file'], marker, out / f'{marker}_all_rows_predictions.tsv',
+                                      inference_chunk_rows(X_all.shape[1], args.memory_budget_mb))
 
-    pred_counts = pd.crosstab(all_pred_df['source_file'], all_pred_df['predicted_label'])
+    pred_counts = pd.crosstab(df['source_file'], all_pred, colnames=['predicted_label']).rename(columns={0: f'{marker}-', 1: f'{marker}+'})
     ax = pred_counts.plot(kind='bar', stacked=True, figsize=(10, 5), colormap='tab20')
-    ax.set_title(f'Supervised predicted {args.marker} label abundance by input file')
+    ax.set_title(f'Supervised predicted {marker} label abundance by input file')
     plt.xticks(rotation=25, ha='right')
     plt.tight_layout()
-    plt.savefig(out / f'{args.marker}_all_rows_abundance.png', dpi=120)
+    plt.savefig(out / f'{marker}_all_rows_abundance.png', dpi=120)
     plt.close()
 
     per_file = out / 'per_file_reports'
     per_file.mkdir(parents=True, exist_ok=True)
-    report_df = df.copy()
-    report_df['predicted_label'] = all_lbl.values
-    if {'Centroid X µm', 'Centroid Y µm'}.issubset(report_df.columns):
-        for src_file, grp in report_df.groupby('source_file'):
-            fig, ax = plt.subplots(figsize=(6, 5))
-            grp = grp.dropna(subset=['Centroid X µm', 'Centroid Y µm']).copy()
-            if grp.empty:
-                continue
-            grp['Inverted Centroid Y µm'] = grp['Centroid Y µm'].max() - grp['Centroid Y µm']
-            sns.scatterplot(data=grp, x='Centroid X µm', y='Inverted Centroid Y µm', hue='predicted_label', s=6, alpha=0.7, ax=ax)
-            plt.tight_layout()
-            fig.savefig(per_file / f'{Path(src_file).stem}_spatial_predictions.png', dpi=120)
-            plt.close(fig)
+    if {'Centroid X µm', 'Centroid Y µm'}.issubset(df.columns):
+        # Rasterised maps (fraction of predicted positives per pixel), one per input file
+        cx, cy = df['Centroid X µm'].to_numpy(), df['Centroid Y µm'].to_numpy()
+        raster_jobs = []
+        for src_file, rows in df.groupby('source_file').indices.items():
+            flat, shape, extent = grid_index(cx[rows], cy[rows])
+            counts, positives = aggregate_labels(flat, shape, all_pred[rows])
+            raster_jobs.append({'counts': counts, 'positives': positives, 'extent': extent, 'label': marker,
+                                'out_path': per_file / f'{Path(src_file).stem}_spatial_predictions.png',
+                                'title': f'{Path(src_file).stem}: predicted {marker}'})
+        with perf_trace.span('spatial_maps', rows=len(df)):
+            write_label_rasters(raster_jobs, workers=n_jobs)
 
     summary = {
-        'marker': args.marker,
+        'marker': marker,
         'input_files': [str(Path(t).name) for t in args.tables],
         'n_rows_total': int(len(df)),
         'n_rows_parseable_marker': int(len(work_df)),
         'n_rows_inlier_for_modeling': int((~is_outlier).sum()),
         'rows_per_file': df['source_file'].value_counts().to_dict(),
+        'embedding_backend': reference['backend'],
+        'n_rows_embedded': int(len(emb)),
+        'n_rows_embedding_fitted': int(n_fit),
         'selected_model': best_name,
         'timestamp_utc': datetime.utcnow().isoformat() + 'Z',
     }
-    (out / f'{args.marker}_modeling_summary.json').write_text(json.dumps(summary, indent=2))
-    joblib.dump(best_search.best_estimator_, out / f'{args.marker}_best_model_{best_name}.joblib')
-    with open(out / f'{args.marker}_feature_columns.txt', 'w', encoding='utf-8') as f:
+    (out / f'{marker}_modeling_summary.json').write_text(json.dumps(summary, indent=2))
+    joblib.dump(best_search.best_estimator_, out / f'{marker}_best_model_{best_name}.joblib')
+    with open(out / f'{marker}_feature_columns.txt', 'w', encoding='utf-8') as f:
         f.write('\n'.join(X.columns.tolist()))
 
 
+
+def traced_run_marker(df, labels, marker, args, out, n_jobs=-1):
+    # Under loky the marker runs in a worker process, which then writes a trace of its own
+    with perf_trace.task('marker_recovery_pipeline', marker, marker=marker):
+        run_marker(df, labels, marker, args, out, n_jobs)
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('tables', nargs='+')
+    p.add_argument('--marker', default='NAK')
+    p.add_argument('--markers', default='',
+                   help='Comma-separated markers analysed from one load of the tables; artifacts go to <output-dir>/<marker>/')
+    p.add_argument('--marker-workers', type=int, default=None, help='Markers analysed in parallel (default: one per CPU)')
+    p.add_argument('--classification-col', default='Classification')
+    p.add_argument('--output-dir', required=True)
+    p.add_argument('--seed', type=int, default=421)
+    p.add_argument('--test-size', type=float, default=0.3)
+    p.add_argument('--cv-splits', type=int, default=5)
+    p.add_argument('--n-iter-search', type=int, default=30)
+    p.add_argument('--outlier-contamination', type=float, default=0.02)
+    p.add_argument('--outlier-n-neighbors', type=int, default=35)
+    p.add_argument('--outlier-fit-rows', type=int, default=100_000,
+                   help='Above this many labelled cells, fit outlier detectors on a subsample and score all cells in chunks')
+    p.add_argument('--outlier-algorithm', choices=['auto', 'kd_tree', 'ball_tree', 'brute'], default='auto')
+    p.add_argument('--cluster-fit-rows', type=int, default=100_000, help='Rows used to fit each GMM in the clustering sweep')
+    p.add_argument('--silhouette-rows', type=int, default=10_000, help='Label-stratified sample size for silhouette scores')
+    p.add_argument('--embedding-rows', type=int, default=50_000, help='Inlier cells shown in the t-SNE plot')
+    p.add_argument('--embedding-fit-rows', type=int, default=5_000,
+                   help='Cells the t-SNE is fitted on (after PCA); the other plotted cells are placed by nearest neighbours')
+    p.add_argument('--embedding-reference', default=None,
+                   help='Previous artifact directory (or *_embedding_reference.joblib) to place cells into instead of refitting')
+    p.add_argument('--svc-max-rows', type=int, default=20_000,
+                   help='Above this many training rows the exact SVC candidate is replaced by Nystroem + calibrated LinearSVC')
+    p.add_argument('--n-jobs', type=int, default=-1,
+                   help='CPUs for the whole run (default: the task allocation, see cpu_budget.py), shared by all nested parallelism')
+    p.add_argument('--memory-budget-mb', type=int, default=DEFAULT_MEMORY_BUDGET_MB)
+    p.add_argument('--checkpoint-dir', default=None,
+                   help="Stage checkpoints reused by reruns with the same inputs and parameters (default: <output-dir>/checkpoints, '' disables)")
+    p.add_argument('--run-gmmgating', action='store_true')
+    p.add_argument('--run-powertransform', action='store_true')
+    p.add_argument('--exclude-component-patterns', default='')
+    args = p.parse_args()
+    perf_trace.start('marker_recovery_pipeline')
+    n_jobs = cpu_budget.resolve_jobs(args.n_jobs)
+    cpu_budget.limit_threads(n_jobs)
+
+    out = Path(args.output_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    if args.checkpoint_dir is None:
+        args.checkpoint_dir = str(out / 'checkpoints')
+
+    markers = [m.strip() for m in args.markers.split(',') if m.strip()] or [args.marker]
+    with perf_trace.span('load_tables'):
+        df = load_marker_tables(args.tables, markers, args.classification_col)
+        perf_trace.add_rows(len(df))
+    labels = classification_labels(df[args.classification_col], markers)
+
+    if not args.markers:
+        perf_trace.annotate(marker=args.marker)
+        traced_run_marker(df, labels[args.marker], args.marker, args, out, n_jobs)
+        return
+
+    for m in list(markers):
+        if len(np.unique(labels[m][np.isfinite(labels[m])])) < 2:
+            print(f"Skipping {m}: classification column does not carry both {m}+ and {m}- labels")
+            markers.remove(m)
+
+    # One process per marker, each writing to <output-dir>/<marker>/; the CPU budget is split between them
+    workers, inner_jobs = cpu_budget.split(min(len(markers), args.marker_workers or len(markers)), n_jobs)
+    base_cols = [c for c in ('source_file', 'Centroid X µm', 'Centroid Y µm') if c in df.columns]
+    with cpu_budget.inner_threads(inner_jobs):
+        Parallel(n_jobs=workers)(
+            delayed(traced_run_marker)(df[base_cols + find_marker_feature_columns(df, marker=m)], labels[m], m, args, out / m, inner_jobs)
+            for m in markers
+        )
+
+
 if __name__ == '__main__':
     main()
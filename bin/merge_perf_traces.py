@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Merge the `*_perf.json` traces written by the bin/ scripts (see `perf_trace.py`)
+into one run-wide hot-spot table.
+
+Spans are grouped by script and span name across every task of the run. Each row
+reports how often the span ran, its wall and CPU time, rows processed and rows per
+second, the highest RSS seen while it was open, and its share of the run's total
+task time. A `(script)` row per script covers whole task runtimes; the table is
+sorted by total wall time, so the top rows are where the run spends its time.
+"""
+import argparse
+import json
+import os
+from pathlib import Path
+
+import pandas as pd
+
+SCRIPT_ROW = "(script)"
+
+
+def load_traces(paths):
+    traces = []
+    for p in paths:
+        try:
+            trace = json.loads(Path(p).read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            print(f"Skipping unreadable trace {p}: {e}")
+            continue
+        trace["_source"] = os.path.basename(str(p))
+        traces.append(trace)
+    return traces
+
+
+def span_records(traces):
+    """One flat record per script run and per span."""
+    records = []
+    for trace in traces:
+        script = trace.get("script", "unknown")
+        records.append({
+            "script": script,
+            "span": SCRIPT_ROW,
+            "wall_s": trace.get("wall_s", 0.0),
+            "cpu_s": trace.get("cpu_s", 0.0),
+            "rows": sum(trace.get("counters", {}).values()) or None,
+            "rss_peak_mb": trace.get("max_rss_mb"),
+            "worker": bool(trace.get("parent")),
+        })
+        for span in trace.get("spans", []):
+            records.append({
+                "script": script,
+                "span": span["name"],
+                "wall_s": span.get("wall_s", 0.0),
+                "cpu_s": span.get("cpu_s", 0.0),
+                "rows": span.get("rows"),
+                "rss_peak_mb": span.get("rss_peak_mb"),
+                "worker": bool(trace.get("parent")),
+            })
+    return pd.DataFrame.from_records(records, columns=["script", "span", "wall_s", "cpu_s", "rows", "rss_peak_mb", "worker"])
+
+
+def hotspot_table(records):
+    if records.empty:
+        return pd.DataFrame(columns=["script", "span", "calls", "wall_s_total", "wall_s_mean", "wall_s_max", "cpu_s_total",
+                                     "cpu_util", "rows", "rows_per_s", "rss_peak_mb", "share_of_run"])
+    records = records.assign(rows=pd.to_numeric(records["rows"], errors="coerce"),
+                             rss_peak_mb=pd.to_numeric(records["rss_peak_mb"], errors="coerce"))
+    table = records.groupby(["script", "span"], sort=False).agg(
+        calls=("wall_s", "size"),
+        wall_s_total=("wall_s", "sum"),
+        wall_s_mean=("wall_s", "mean"),
+        wall_s_max=("wall_s", "max"),
+        cpu_s_total=("cpu_s", "sum"),
+        rows=("rows", lambda r: r.sum(min_count=1)),
+        rss_peak_mb=("rss_peak_mb", "max"),
+    ).reset_index()
+    # Rows per second only over the calls that counted rows
+    counted = records[records["rows"].notna()].groupby(["script", "span"])["wall_s"].sum().rename("counted_wall_s")
+    table = table.merge(counted.reset_index(), on=["script", "span"], how="left")
+    table["rows_per_s"] = table["rows"] / table["counted_wall_s"].where(table["counted_wall_s"] > 0)
+    # Above 1 means the span ran multithreaded; well below 1 means it waited on I/O
+    table["cpu_util"] = table["cpu_s_total"] / table["wall_s_total"].where(table["wall_s_total"] > 0)
+    # Pool workers' traces overlap their parent task's, so only top-level tasks make up the run
+    run_wall = records.loc[(records["span"] == SCRIPT_ROW) & ~records["worker"].astype(bool), "wall_s"].sum()
+    table["share_of_run"] = table["wall_s_total"] / run_wall if run_wall > 0 else float("nan")
+    table = table[["script", "span", "calls", "wall_s_total", "wall_s_mean", "wall_s_max", "cpu_s_total", "cpu_util",
+                   "rows", "rows_per_s", "rss_peak_mb", "share_of_run"]]
+    return table.sort_values("wall_s_total", ascending=False).reset_index(drop=True).round(4)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Merge per-task *_perf.json traces into a run-wide hot-spot table.")
+    ap.add_argument("traces", nargs="+")
+    ap.add_argument("--output", default="perf_hotspots.tsv")
+    ap.add_argument("--combined", default=None, help="Also write every trace into one JSON list")
+    ap.add_argument("--top", type=int, default=15, help="Hot spots printed to stdout")
+    args = ap.parse_args()
+
+    traces = load_traces(args.traces)
+    table = hotspot_table(span_records(traces))
+    table.to_csv(args.output, sep="\t", index=False)
+    if args.combined:
+        Path(args.combined).write_text(json.dumps(traces, indent=1), encoding="utf-8")
+    print(f"Wrote {args.output} ({len(traces)} traces, {len(table)} spans)")
+    if not table.empty:
+        spans = table[table["span"] != SCRIPT_ROW].head(args.top)
+        print(spans[["script", "span", "calls", "wall_s_total", "rows_per_s", "rss_peak_mb", "share_of_run"]].to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
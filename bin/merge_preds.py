@@ -6,13 +6,18 @@ import sys
 from functools import reduce
 import pandas as pd
 
+import perf_trace
+
 image_id = sys.argv[1]
 pred_files = sys.argv[2:]
+perf_trace.start("merge_preds")
 
 key_cols = ["Image", "Centroid X µm", "Centroid Y µm"]
 dfs = []
 for i, f in enumerate(pred_files):
-    df = pd.read_csv(f, sep='\t')
+    with perf_trace.span("read"):
+        df = pd.read_csv(f, sep='\t')
+        perf_trace.add_rows(len(df))
     # Extract marker name from filename
     marker_match = re.search(r'predictions_([A-Za-z0-9\-]+)\.pkl', os.path.basename(f))
     marker = marker_match.group(1) if marker_match else f"Unknown{i}"
@@ -38,11 +43,13 @@ for i, df in enumerate(dfs):
     dfs[i] = df
 
 # Try inner merge first
-merged = reduce(lambda left, right: pd.merge(left, right, on=key_cols, how='inner'), dfs)
+with perf_trace.span("merge"):
+    merged = reduce(lambda left, right: pd.merge(left, right, on=key_cols, how='inner'), dfs)
 print(f"Merged shape: {merged.shape}")
 
 # If you must use outer, check for mismatched keys
 # merged = reduce(lambda left, right: pd.merge(left, right, on=key_cols, how='outer'), dfs)
 
 # Save merged output
-merged.to_csv(f'{image_id}_MERGED.tsv', sep='\t', index=False)
\ No newline at end of file
+with perf_trace.span("write", rows=len(merged)):
+    merged.to_csv(f'{image_id}_MERGED.tsv', sep='\t', index=False)
\ No newline at end of file
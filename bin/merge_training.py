@@ -4,7 +4,7 @@ import sys
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print("Usage: merge_training.py <output_name>")
+        print("Usage: merge_training.py <output_name> [<earlier merged training set> ...]")
         sys.exit(1)
     outname = sys.argv[1].replace(' ', '_')
 
@@ -12,18 +12,27 @@ if __name__ == "__main__":
     import pandas as pd
     import os
 
-    # Find all .tsv files in the current directory
-    tsv_files = glob.glob("*.tsv")
+    import perf_trace
+
+    perf_trace.start("merge_training")
+
+    # Find all .tsv files in the current directory, plus any earlier training set given
+    # (an incremental run retraining on the previous run's set and the new one)
+    tsv_files = glob.glob("*.tsv") + sys.argv[2:]
     if not tsv_files:
         print("No .tsv files found in work directory!", file=sys.stderr)
         exit(1)
 
     # Read and merge all tables
-    dfs = [pd.read_csv(f, sep='\t') for f in tsv_files]
-    merged = pd.concat(dfs, axis=0, join='outer', ignore_index=True, sort=False)
-    merged.fillna('NA', inplace=True)
+    with perf_trace.span("read"):
+        dfs = [pd.read_csv(f, sep='\t') for f in tsv_files]
+        perf_trace.add_rows(sum(len(d) for d in dfs))
+    with perf_trace.span("merge"):
+        merged = pd.concat(dfs, axis=0, join='outer', ignore_index=True, sort=False)
+        merged.fillna('NA', inplace=True)
 
     # Write output
-    merged.to_csv(outname, sep='\t', index=False)
+    with perf_trace.span("write", rows=len(merged)):
+        merged.to_csv(outname, sep='\t', index=False)
     print(f"Merged {len(tsv_files)} files into {outname}")
 
@@ -0,0 +1,523 @@
+#!/usr/bin/env python3
+"""
+Performance history of BinFlow runs in a local SQLite database.
+
+`ingest` stores one run: its Nextflow execution trace (one row per task), the
+`*_perf.json` traces of the bin/ scripts (or the combined `perf_traces.json` that
+PERF_HOTSPOTS publishes), and the run metadata the pipeline writes at completion
+(run name, cohort, input size and params). Every measurement is keyed by run, kind
+(`task`, `script` or `span`), script or process, marker and stage. Ingesting the
+same run again replaces its rows.
+
+  perf_history.py ingest --db perf.sqlite --run-meta <output_dir>/pipeline_info/run_<name>.json \\
+      --nextflow-trace <output_dir>/pipeline_info/execution_trace_*.txt --perf-traces <output_dir>/perf/perf_traces.json
+  perf_history.py trends --db perf.sqlite --script MARKER_RECOVERY_ANALYSIS
+  perf_history.py regressions --db perf.sqlite --threshold 0.25
+  perf_history.py predict --db perf.sqlite --tables /data/new_cohort/*.tsv
+
+Stages are compared on cost per unit of input (rows when both runs counted them,
+otherwise input bytes), so a bigger cohort alone is not a regression. Each flagged
+stage lists the params that changed since the runs it was compared with.
+"""
+import argparse
+import hashlib
+import json
+import re
+import sqlite3
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    started_utc TEXT,
+    ingested_utc TEXT,
+    cohort TEXT,
+    success INTEGER,
+    duration_s REAL,
+    n_inputs INTEGER,
+    input_bytes INTEGER,
+    params_hash TEXT,
+    params_json TEXT
+);
+CREATE TABLE IF NOT EXISTS measurements (
+    run_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    source TEXT,
+    script TEXT NOT NULL,
+    marker TEXT,
+    stage TEXT NOT NULL,
+    wall_s REAL,
+    cpu_s REAL,
+    rss_mb REAL,
+    rows INTEGER,
+    input_bytes INTEGER,
+    status TEXT,
+    workdir TEXT
+);
+CREATE INDEX IF NOT EXISTS measurements_run ON measurements (run_id, kind);
+CREATE INDEX IF NOT EXISTS measurements_stage ON measurements (kind, script, stage);
+"""
+
+TASK_STAGE = "(task)"
+SCRIPT_STAGE = "(script)"
+# Params that name locations rather than change the work done
+IGNORED_PARAMS = {"input_dir", "output_dir", "letterhead", "help", "perf_history_db", "marker_recovery_checkpoint_dir"}
+STAGE_KEY = ["kind", "script", "marker", "stage"]
+# Predictions for cohorts more than this many times the largest run seen are not made
+MAX_EXTRAPOLATION = 10.0
+
+
+def connect(path):
+    con = sqlite3.connect(path)
+    con.executescript(SCHEMA)
+    return con
+
+
+def params_hash(params):
+    kept = {k: v for k, v in (params or {}).items() if k not in IGNORED_PARAMS and "-" not in k}
+    return hashlib.sha256(json.dumps(kept, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+def parse_size(text):
+    """'12G', '500M', '2.5 GB' or a plain byte count -> bytes."""
+    m = re.fullmatch(r"\s*([\d.]+)\s*([kmgt]?)i?b?\s*", str(text).lower())
+    if not m:
+        raise ValueError(f"Unrecognised size: {text}")
+    return int(float(m.group(1)) * 1024 ** " kmgt".index(m.group(2) or " "))
+
+
+def parse_duration_s(text):
+    """Nextflow durations: raw milliseconds, or '1h 2m 3s' / '350ms' when the trace is not raw."""
+    text = str(text).strip()
+    if text in ("", "-"):
+        return None
+    if re.fullmatch(r"[\d.]+", text):
+        return float(text) / 1000.0
+    units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400}
+    parts = re.findall(r"([\d.]+)\s*(ms|s|m|h|d)", text)
+    return sum(float(v) * units[u] for v, u in parts) if parts else None
+
+
+def parse_memory_mb(text):
+    """Nextflow memory: raw bytes, or '1.2 GB' when the trace is not raw."""
+    text = str(text).strip()
+    if text in ("", "-"):
+        return None
+    try:
+        return parse_size(text.replace(" ", "")) / (1024 * 1024)
+    except ValueError:
+        return None
+
+
+def nextflow_task_rows(trace_path):
+    """Measurement rows from a Nextflow trace file (tab-separated, one task per line)."""
+    trace = pd.read_csv(trace_path, sep="\t", dtype=str).fillna("-")
+    rows = []
+    for task in trace.to_dict("records"):
+        process = task.get("process") or re.sub(r"\s*\(.*\)$", "", task.get("name", ""))
+        wall = parse_duration_s(task.get("realtime", "-"))
+        cpu_pct = str(task.get("%cpu", "-")).rstrip("%")
+        read_mb = parse_memory_mb(task.get("rchar", "-"))
+        rows.append({
+            "kind": "task",
+            "source": task.get("hash"),
+            # Sub-workflow processes are reported as <workflow>:<PROCESS>
+            "script": process.split(":")[-1],
+            "marker": None,
+            "stage": TASK_STAGE,
+            "wall_s": wall,
+            "cpu_s": wall * float(cpu_pct) / 100.0 if wall is not None and cpu_pct not in ("", "-") else None,
+            "rss_mb": parse_memory_mb(task.get("peak_rss", "-")),
+            "rows": None,
+            "input_bytes": int(read_mb * 1024 * 1024) if read_mb is not None else None,
+            "status": task.get("status"),
+            "workdir": task.get("workdir"),
+        })
+    return rows
+
+
+def load_perf_traces(paths):
+    traces = []
+    for p in paths:
+        data = json.loads(Path(p).read_text(encoding="utf-8"))
+        traces.extend(data if isinstance(data, list) else [data])
+    return traces
+
+
+def perf_trace_rows(traces):
+    """Measurement rows for each script run and each of its spans."""
+    rows = []
+    for trace in traces:
+        marker = (trace.get("meta") or {}).get("marker")
+        base = {"source": trace.get("trace_id"), "script": trace.get("script", "unknown"), "marker": marker,
+                "input_bytes": trace.get("input_bytes"), "status": "COMPLETED", "workdir": trace.get("workdir")}
+        rows.append(dict(base, kind="script", stage=SCRIPT_STAGE, wall_s=trace.get("wall_s"), cpu_s=trace.get("cpu_s"),
+                         rss_mb=trace.get("max_rss_mb"), rows=(trace.get("counters") or {}).get("rows")))
+        for span in trace.get("spans", []):
+            rows.append(dict(base, kind="span", stage=span["name"], wall_s=span.get("wall_s"), cpu_s=span.get("cpu_s"),
+                             rss_mb=span.get("rss_peak_mb"), rows=span.get("rows")))
+    return rows
+
+
+def ingest(con, run_id, meta, task_rows, perf_rows, cohort=None, input_bytes=None, n_inputs=None):
+    params = meta.get("params")
+    if input_bytes is None:
+        input_bytes = meta.get("input_bytes")
+    if input_bytes is None and perf_rows:
+        # Without run metadata the largest script input (a step that reads every table) stands in for the cohort
+        input_bytes = max((r["input_bytes"] or 0 for r in perf_rows if r["kind"] == "script"), default=None) or None
+    known = con.execute("SELECT started_utc FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+    run = {
+        "run_id": run_id,
+        "started_utc": meta.get("started_utc") or (known[0] if known else datetime.now(timezone.utc).isoformat()),
+        "ingested_utc": datetime.now(timezone.utc).isoformat(),
+        "cohort": cohort or meta.get("cohort"),
+        "success": None if meta.get("success") is None else int(bool(meta["success"])),
+        "duration_s": meta.get("duration_s"),
+        "n_inputs": n_inputs if n_inputs is not None else meta.get("n_inputs"),
+        "input_bytes": input_bytes,
+        "params_hash": params_hash(params) if params is not None else None,
+        "params_json": json.dumps(params, sort_keys=True, default=str) if params is not None else None,
+    }
+    with con:
+        columns = list(run)
+        updates = ", ".join(f"{c} = COALESCE(excluded.{c}, runs.{c})" for c in columns if c != "run_id")
+        con.execute(f"INSERT INTO runs ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+                    f"ON CONFLICT(run_id) DO UPDATE SET {updates}", [run[c] for c in columns])
+        # Re-ingesting a run replaces the kinds of measurement supplied this time
+        if task_rows:
+            con.execute("DELETE FROM measurements WHERE run_id = ? AND kind = 'task'", (run_id,))
+        if perf_rows:
+            con.execute("DELETE FROM measurements WHERE run_id = ? AND kind IN ('script', 'span')", (run_id,))
+        fields = ["kind", "source", "script", "marker", "stage", "wall_s", "cpu_s", "rss_mb", "rows", "input_bytes", "status", "workdir"]
+        con.executemany(f"INSERT INTO measurements (run_id, {', '.join(fields)}) VALUES (?, {', '.join('?' * len(fields))})",
+                        [[run_id] + [r.get(f) for f in fields] for r in task_rows + perf_rows])
+
+
+def stage_runs(con, kind=None, script=None, marker=None, stage=None):
+    """One row per run and stage: calls, summed time, rows and input bytes, and the highest RSS."""
+    where, args = ["(m.status IS NULL OR m.status = 'COMPLETED')"], []
+    for col, value in (("kind", kind), ("script", script), ("marker", marker), ("stage", stage)):
+        if value is not None:
+            where.append(f"m.{col} = ?")
+            args.append(value)
+    query = f"""
+        SELECT m.run_id, r.started_utc, r.cohort, r.params_hash, r.input_bytes AS run_input_bytes,
+               m.kind, m.script, COALESCE(m.marker, '') AS marker, m.stage,
+               COUNT(*) AS calls, SUM(m.wall_s) AS wall_s, SUM(m.cpu_s) AS cpu_s, MAX(m.rss_mb) AS rss_mb,
+               SUM(m.rows) AS rows, SUM(m.input_bytes) AS input_bytes
+        FROM measurements m JOIN runs r ON r.run_id = m.run_id
+        WHERE {' AND '.join(where)}
+        GROUP BY m.run_id, m.kind, m.script, COALESCE(m.marker, ''), m.stage
+        ORDER BY r.started_utc, m.run_id
+    """
+    return pd.read_sql_query(query, con, params=args)
+
+
+def default_kind(con):
+    """Nextflow tasks when any were ingested, otherwise script runs."""
+    has_tasks = con.execute("SELECT 1 FROM measurements WHERE kind = 'task' LIMIT 1").fetchone()
+    return "task" if has_tasks else "script"
+
+
+def run_params(con):
+    return {run_id: json.loads(p) if p else None for run_id, p in con.execute("SELECT run_id, params_json FROM runs")}
+
+
+def param_changes(old, new):
+    """'key: old -> new' for every param that differs, ignoring location-only params."""
+    if old is None or new is None:
+        return []
+    keys = sorted((set(old) | set(new)) - IGNORED_PARAMS)
+    return [f"{k}: {old.get(k)} -> {new.get(k)}" for k in keys if "-" not in k and old.get(k) != new.get(k)]
+
+
+def stage_size(row, unit):
+    """Rows, or MB of input (the stage's own, else the run's), or None when unknown."""
+    if unit == "rows":
+        return row["rows"] if pd.notna(row["rows"]) and row["rows"] > 0 else None
+    for col in ("input_bytes", "run_input_bytes"):
+        if pd.notna(row[col]) and row[col] > 0:
+            return row[col] / 1e6
+    return None
+
+
+def cost_unit(row):
+    """The finest size a stage can be normalised by: rows when counted, otherwise MB of input."""
+    for unit in ("rows", "MB"):
+        if stage_size(row, unit):
+            return unit
+    return None
+
+
+def unit_cost(row, unit):
+    """Seconds per `unit` (raw seconds when `unit` is None); None when this row lacks that size."""
+    if unit is None:
+        return row["wall_s"]
+    size = stage_size(row, unit)
+    return row["wall_s"] / size if size else None
+
+
+def trends(con, kind=None, script=None, marker=None, stage=None, last=10):
+    history = stage_runs(con, kind or default_kind(con), script, marker, stage)
+    if history.empty:
+        return history
+    params = run_params(con)
+    out = []
+    for _, group in history.groupby(STAGE_KEY, sort=False):
+        group = group.tail(last)
+        previous = None
+        for _, row in group.iterrows():
+            unit = cost_unit(row)
+            cost = unit_cost(row, unit)
+            changes = param_changes(params.get(previous), params.get(row["run_id"])) if previous else []
+            out.append({
+                "script": row["script"], "marker": row["marker"], "stage": row["stage"], "run_id": row["run_id"],
+                "cohort": row["cohort"], "calls": row["calls"], "wall_s": round(row["wall_s"] or 0.0, 2),
+                "input_mb": round((row["input_bytes"] or row["run_input_bytes"] or 0) / 1e6, 1),
+                "rows": row["rows"], "cost": round(cost, 6) if unit else None, "cost_unit": f"s/{unit}" if unit else "",
+                "rss_mb": round(row["rss_mb"], 1) if pd.notna(row["rss_mb"]) else None,
+                "params_changed": "; ".join(changes),
+            })
+            previous = row["run_id"]
+    return pd.DataFrame(out)
+
+
+def find_regressions(con, run_id=None, kind=None, threshold=0.25, min_seconds=5.0, window=5, same_params=False):
+    """Stages of `run_id` (default: the latest run) whose unit cost rose by more than `threshold`."""
+    history = stage_runs(con, kind or default_kind(con))
+    if history.empty:
+        return []
+    run_order = list(dict.fromkeys(history["run_id"]))
+    run_id = run_id or run_order[-1]
+    if run_id not in run_order:
+        raise SystemExit(f"No measurements for run {run_id}")
+    earlier = set(run_order[:run_order.index(run_id)])
+    params = run_params(con)
+    findings = []
+    for key, group in history.groupby(STAGE_KEY, sort=False):
+        current = group[group["run_id"] == run_id]
+        baseline = group[group["run_id"].isin(earlier)]
+        if current.empty or baseline.empty:
+            continue
+        current = current.iloc[0]
+        if same_params:
+            baseline = baseline[baseline["params_hash"] == current["params_hash"]]
+        baseline = baseline.tail(window)
+        if baseline.empty:
+            continue
+        unit = cost_unit(current)
+        cost = unit_cost(current, unit)
+        base_costs = [c for c in (unit_cost(b, unit) for _, b in baseline.iterrows()) if c is not None]
+        if not base_costs or not cost:
+            continue
+        base_cost = float(np.median(base_costs))
+        if base_cost <= 0:
+            continue
+        expected = base_cost * (stage_size(current, unit) if unit else 1.0)
+        if cost > base_cost * (1 + threshold) and current["wall_s"] - expected > min_seconds:
+            last_base = baseline.iloc[-1]
+            size_then = stage_size(last_base, unit) if unit else None
+            findings.append({
+                "stage": " / ".join(str(k) for k in key[1:] if k),
+                "kind": key[0],
+                "wall_s": round(current["wall_s"], 2),
+                "expected_s": round(expected, 2),
+                "cost_ratio": round(cost / base_cost, 2),
+                "unit": f"s/{unit}" if unit else "s",
+                "baseline_runs": len(baseline),
+                "size_ratio": round(stage_size(current, unit) / size_then, 2) if size_then else None,
+                "params_changed": param_changes(params.get(last_base["run_id"]), params.get(run_id)),
+            })
+    return findings
+
+
+def fit_scaling(x, y, max_exponent=2.0, single_size=True):
+    """
+    y = c + a * x**b with a fixed overhead c >= 0, a >= 0 and 0 <= b <= max_exponent,
+    least squares over a grid of exponents. With one cohort size only a proportional
+    fit (c = 0, b = 1) is possible; `single_size=False` returns None instead.
+    """
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    ok = (x > 0) & (y > 0)
+    x, y = x[ok], y[ok]
+    if len(x) == 0:
+        return None
+    if len(np.unique(x)) < 2:
+        return (0.0, float(np.median(y / x)), 1.0) if single_size else None
+    # Sizes scaled to the largest one so x**b stays well conditioned
+    scale = x.max()
+    best = None
+    for b in np.linspace(0.0, max_exponent, int(max_exponent * 20) + 1):
+        xb = (x / scale) ** b
+        a, c = np.linalg.lstsq(np.column_stack([xb, np.ones_like(xb)]), y, rcond=None)[0]
+        if c < 0:
+            a, c = max(float(xb @ y / (xb @ xb)), 0.0), 0.0
+        elif a < 0:
+            a, c = 0.0, float(y.mean())
+        sse = float(np.sum((c + a * xb - y) ** 2))
+        if best is None or sse < best[0]:
+            best = (sse, float(c), float(a) / scale ** b, float(b))
+    return best[1:]
+
+
+def scaled(fit, x):
+    c, a, b = fit
+    return c + a * x ** b
+
+
+def predict(con, input_bytes, kind=None, script=None, marker=None, params_hash_filter=None):
+    """
+    Predicted wall time and peak RSS per stage for a cohort of `input_bytes`, from runs
+    with a known cohort size. RSS needs at least two sizes (it is mostly fixed overhead,
+    which one size cannot separate), and stages whose largest run is more than
+    MAX_EXTRAPOLATION times smaller than the cohort get a note instead of a prediction.
+    """
+    history = stage_runs(con, kind or default_kind(con), script, marker)
+    history = history[history["run_input_bytes"].notna() & (history["run_input_bytes"] > 0)]
+    if params_hash_filter:
+        history = history[history["params_hash"] == params_hash_filter]
+    out = []
+    for key, group in history.groupby(STAGE_KEY, sort=False):
+        wall_fit = fit_scaling(group["run_input_bytes"], group["wall_s"])
+        if wall_fit is None:
+            continue
+        rss_fit = fit_scaling(group["run_input_bytes"], group["rss_mb"].fillna(0), max_exponent=1.0, single_size=False)
+        ratio = input_bytes / group["run_input_bytes"].max()
+        beyond = ratio > MAX_EXTRAPOLATION
+        notes = []
+        if beyond:
+            notes.append(f"{ratio:.0f}x the largest run seen: not predicted")
+        elif group["run_input_bytes"].nunique() < 2:
+            notes.append("one size seen: time assumed proportional, no RSS")
+        out.append({
+            "script": key[1], "marker": key[2], "stage": key[3], "runs": len(group),
+            "sizes_seen_mb": f"{group['run_input_bytes'].min() / 1e6:.0f}-{group['run_input_bytes'].max() / 1e6:.0f}",
+            "fixed_s": round(wall_fit[0], 1),
+            "exponent": round(wall_fit[2], 2),
+            "predicted_wall_s": None if beyond else round(scaled(wall_fit, input_bytes), 1),
+            "predicted_rss_mb": None if beyond or rss_fit is None else round(scaled(rss_fit, input_bytes), 0),
+            "note": "; ".join(notes),
+        })
+    return pd.DataFrame(out)
+
+
+def latest_run(con):
+    row = con.execute("SELECT run_id FROM runs ORDER BY started_utc DESC LIMIT 1").fetchone()
+    return row[0] if row else None
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Store and query the performance history of BinFlow runs.")
+    ap.add_argument("--db", default="perf_history.sqlite")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("ingest", help="Add (or replace) one run")
+    p.add_argument("--run-meta", help="run_<name>.json written by the pipeline at completion")
+    p.add_argument("--run-id", help="Defaults to the run name in --run-meta")
+    p.add_argument("--nextflow-trace", nargs="+", default=[], help="Nextflow execution trace file(s) of the run")
+    p.add_argument("--perf-traces", nargs="+", default=[], help="*_perf.json traces or a combined perf_traces.json")
+    p.add_argument("--params", help="Params JSON, when there is no --run-meta")
+    p.add_argument("--cohort")
+    p.add_argument("--inputs", nargs="*", default=None, help="Input tables, to record the cohort size")
+
+    p = sub.add_parser("trends", help="Per-stage history across runs")
+    p.add_argument("--kind", choices=["task", "script", "span"])
+    p.add_argument("--script")
+    p.add_argument("--marker")
+    p.add_argument("--stage")
+    p.add_argument("--last", type=int, default=10, help="Runs shown per stage")
+    p.add_argument("--output", help="Also write the table as TSV")
+
+    p = sub.add_parser("regressions", help="Stages of a run that got slower per unit of input")
+    p.add_argument("--run", help="Run to check (default: the latest)")
+    p.add_argument("--kind", choices=["task", "script", "span"])
+    p.add_argument("--threshold", type=float, default=0.25, help="Allowed relative increase in cost per unit of input")
+    p.add_argument("--min-seconds", type=float, default=5.0, help="Ignore slowdowns smaller than this")
+    p.add_argument("--window", type=int, default=5, help="Earlier runs forming the baseline")
+    p.add_argument("--same-params", action="store_true", help="Only compare with runs that used the same params")
+
+    p = sub.add_parser("predict", help="Runtime per stage for a new cohort, from its size")
+    size = p.add_mutually_exclusive_group(required=True)
+    size.add_argument("--tables", nargs="+", help="The new cohort's input tables")
+    size.add_argument("--bytes", help="Cohort size, e.g. 40G")
+    p.add_argument("--kind", choices=["task", "script", "span"])
+    p.add_argument("--script")
+    p.add_argument("--marker")
+    p.add_argument("--like-run", help="Only use runs with the same params as this run")
+    args = ap.parse_args()
+
+    con = connect(args.db)
+    pd.set_option("display.width", 200)
+    pd.set_option("display.max_colwidth", 80)
+
+    if args.command == "ingest":
+        meta = json.loads(Path(args.run_meta).read_text()) if args.run_meta else {}
+        if args.params:
+            meta["params"] = json.loads(Path(args.params).read_text())
+        run_id = args.run_id or meta.get("run_name")
+        if not run_id:
+            ap.error("ingest needs --run-id or a --run-meta file with a run_name")
+        task_rows = [r for t in args.nextflow_trace for r in nextflow_task_rows(t)]
+        perf_rows = perf_trace_rows(load_perf_traces(args.perf_traces))
+        inputs = [Path(t) for t in args.inputs] if args.inputs else None
+        ingest(con, run_id, meta, task_rows, perf_rows, cohort=args.cohort,
+               input_bytes=sum(t.stat().st_size for t in inputs) if inputs else None,
+               n_inputs=len(inputs) if inputs else None)
+        print(f"Ingested run {run_id}: {len(task_rows)} Nextflow tasks, {len(perf_rows)} script/span measurements into {args.db}")
+
+    elif args.command == "trends":
+        table = trends(con, args.kind, args.script, args.marker, args.stage, args.last)
+        if table.empty:
+            print("No matching measurements")
+            return 0
+        for (script, marker, stage), group in table.groupby(["script", "marker", "stage"], sort=False):
+            print(f"\n== {script}{' [' + marker + ']' if marker else ''} {stage}")
+            print(group.drop(columns=["script", "marker", "stage"]).to_string(index=False))
+        if args.output:
+            table.to_csv(args.output, sep="\t", index=False)
+
+    elif args.command == "regressions":
+        run_id = args.run or latest_run(con)
+        findings = find_regressions(con, run_id, args.kind, args.threshold, args.min_seconds, args.window, args.same_params)
+        if not findings:
+            print(f"No regressions in run {run_id}")
+            return 0
+        print(f"{len(findings)} regression(s) in run {run_id}:")
+        for f in findings:
+            size = f" (input x{f['size_ratio']})" if f["size_ratio"] else ""
+            print(f"  {f['stage']}: {f['wall_s']}s vs ~{f['expected_s']}s expected, {f['unit']} x{f['cost_ratio']}{size} "
+                  f"over {f['baseline_runs']} earlier run(s)")
+            for change in f["params_changed"]:
+                print(f"      param {change}")
+        return 1
+
+    elif args.command == "predict":
+        input_bytes = sum(Path(t).stat().st_size for t in args.tables) if args.tables else parse_size(args.bytes)
+        like = None
+        if args.like_run:
+            row = con.execute("SELECT params_hash FROM runs WHERE run_id = ?", (args.like_run,)).fetchone()
+            like = row[0] if row else None
+        table = predict(con, input_bytes, args.kind, args.script, args.marker, like)
+        if table.empty:
+            print("No runs with a known cohort size to predict from")
+            return 1
+        print(f"Cohort of {input_bytes / 1024 ** 3:.2f} GiB:")
+        print(table.sort_values("predicted_wall_s", ascending=False, na_position="last").to_string(index=False))
+        top = table[table["stage"].isin([TASK_STAGE, SCRIPT_STAGE])]
+        unpredicted = top["predicted_wall_s"].isna().sum()
+        if unpredicted:
+            print(f"{unpredicted} of {len(top)} stages were only run on cohorts over {MAX_EXTRAPOLATION:.0f}x smaller; "
+                  f"benchmark a larger cohort before relying on a total")
+        else:
+            print(f"Total task time: {top['predicted_wall_s'].sum() / 3600:.2f} h")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
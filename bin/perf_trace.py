@@ -0,0 +1,287 @@
+"""
+Lightweight performance tracing for the bin/ scripts.
+
+A script calls `start("<script name>")` once and wraps its phases in `span(...)`:
+
+    perf = perf_trace.start("analyze_panel_design")
+    with perf_trace.span("summarize", rows=n_rows):
+        ...
+
+Each span records wall and CPU time, resident memory at entry and exit, the peak
+RSS seen while it was open (sampled by a background thread) and, when rows are
+counted, rows per second. Spans nest; their names are joined with '/'. At exit the
+trace is written to `<script>_<id>_perf.json` in the working directory (or in
+$BINFLOW_PERF_DIR), where `merge_perf_traces.py` can turn many of them into a
+run-wide hot-spot table. Work handed to pool worker processes is wrapped in
+`task(script, name)`, which gives each worker a trace of its own.
+
+Environment:
+  BINFLOW_PERF=0           disable tracing (spans become no-ops, nothing is written)
+  BINFLOW_PROFILE=cprofile also dump a cProfile file (`<script>_<id>.prof`, readable
+                           with pstats, snakeviz or flameprof)
+  BINFLOW_PROFILE=py-spy   record with py-spy (when on PATH) into a speedscope file
+  BINFLOW_PERF_INTERVAL    RSS sampling interval in seconds (default 0.2)
+"""
+
+import atexit
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+_TRACE = None
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB (0 where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return 0.0
+
+
+def peak_rss_mb():
+    import resource
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return max(own, children)
+
+
+class PerfTrace:
+    """Spans, RSS samples and optional profiler output for one script run."""
+
+    def __init__(self, script, output_dir=None, interval=0.2, profile=None, parent=None):
+        self.script = script
+        self.parent = parent
+        self.trace_id = uuid.uuid4().hex[:8]
+        self.output_dir = output_dir or os.environ.get("BINFLOW_PERF_DIR") or "."
+        self.interval = interval
+        self.started = datetime.now(timezone.utc)
+        self.t0 = time.perf_counter()
+        self.cpu0 = time.process_time()
+        self.spans = []
+        self.counters = {}
+        self.meta = {}
+        self._stack = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        self._profiler = None
+        self._pyspy = None
+        self.profile_path = None
+        if profile == "cprofile":
+            import cProfile
+
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+            self.profile_path = self._path(".prof")
+        elif profile == "py-spy" and shutil.which("py-spy"):
+            self.profile_path = self._path("_pyspy.json")
+            self._pyspy = subprocess.Popen(
+                ["py-spy", "record", "--pid", str(os.getpid()), "--format", "speedscope", "--output", self.profile_path],
+                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+
+    def _path(self, suffix):
+        return os.path.join(self.output_dir, f"{self.script}_{self.trace_id}{suffix}")
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            rss = current_rss_mb()
+            with self._lock:
+                for open_span in self._stack:
+                    open_span["rss_peak_mb"] = max(open_span["rss_peak_mb"], rss)
+
+    @contextmanager
+    def span(self, name, rows=None):
+        """Time a block; `rows` (if known up front) feeds the rows/sec figure, see also `add_rows`."""
+        rss = current_rss_mb()
+        record = {
+            "name": "/".join([s["name"] for s in self._stack] + [name]),
+            "start_s": round(time.perf_counter() - self.t0, 4),
+            "rss_start_mb": round(rss, 1),
+            "rss_peak_mb": rss,
+            "rows": rows,
+        }
+        t, cpu = time.perf_counter(), time.process_time()
+        with self._lock:
+            self._stack.append(record)
+        try:
+            yield record
+        finally:
+            with self._lock:
+                self._stack.remove(record)
+            wall = time.perf_counter() - t
+            rss = current_rss_mb()
+            record.update({
+                "wall_s": round(wall, 4),
+                "cpu_s": round(time.process_time() - cpu, 4),
+                "rss_end_mb": round(rss, 1),
+                "rss_peak_mb": round(max(record["rss_peak_mb"], rss), 1),
+                "rows_per_s": round(record["rows"] / wall, 1) if record["rows"] and wall > 0 else None,
+            })
+            self.spans.append(record)
+
+    def add_rows(self, n, counter="rows"):
+        """Count rows processed by the innermost open span (and a script-wide counter)."""
+        self.counters[counter] = self.counters.get(counter, 0) + int(n)
+        with self._lock:
+            if self._stack:
+                self._stack[-1]["rows"] = (self._stack[-1]["rows"] or 0) + int(n)
+
+    def annotate(self, **fields):
+        """Attach keys such as `marker=` that perf_history.py groups runs by."""
+        self.meta.update(fields)
+
+    def to_dict(self):
+        wall = time.perf_counter() - self.t0
+        return {
+            "script": self.script,
+            "parent": self.parent,
+            "trace_id": self.trace_id,
+            "argv": sys.argv[1:],
+            # Size of the files named on the command line, the x axis of runtime predictions
+            "input_bytes": sum(os.path.getsize(a) for a in sys.argv[1:] if os.path.isfile(a)),
+            "meta": self.meta,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "workdir": os.environ.get("NXF_TASK_WORKDIR", os.getcwd()),
+            "started_utc": self.started.isoformat(),
+            "wall_s": round(wall, 4),
+            "cpu_s": round(time.process_time() - self.cpu0, 4),
+            "max_rss_mb": round(peak_rss_mb(), 1),
+            "counters": self.counters,
+            "spans": sorted(self.spans, key=lambda s: s["start_s"]),
+            "profile": os.path.basename(self.profile_path) if self.profile_path else None,
+        }
+
+    def finish(self):
+        """Stop sampling and profilers and write the trace; safe to call more than once."""
+        if self._stop.is_set():
+            return None
+        self._stop.set()
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.profile_path)
+        if self._pyspy is not None:
+            # py-spy writes its output when interrupted
+            self._pyspy.send_signal(signal.SIGINT)
+            try:
+                self._pyspy.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self._pyspy.kill()
+        path = self._path("_perf.json")
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            with open(path, "w") as fh:
+                json.dump(self.to_dict(), fh, indent=1)
+        except OSError as e:
+            print(f"[perf] could not write {path}: {e}")
+            return None
+        return path
+
+
+class _NullTrace:
+    """Stand-in used when tracing is disabled or not started."""
+
+    @contextmanager
+    def span(self, name, rows=None):
+        yield {}
+
+    def add_rows(self, n, counter="rows"):
+        pass
+
+    def annotate(self, **fields):
+        pass
+
+    def finish(self):
+        return None
+
+
+def enabled():
+    return os.environ.get("BINFLOW_PERF", "1").strip().lower() not in ("0", "false", "no", "off")
+
+
+def _new_trace(script, parent=None):
+    profile = os.environ.get("BINFLOW_PROFILE", "").strip().lower() or None
+    interval = float(os.environ.get("BINFLOW_PERF_INTERVAL", "0.2"))
+    return PerfTrace(script, interval=interval, profile=profile, parent=parent)
+
+
+def start(script):
+    """Start the process-wide trace for `script` and write it at interpreter exit."""
+    global _TRACE
+    if _TRACE is not None:
+        return _TRACE
+    if not enabled():
+        _TRACE = _NullTrace()
+        return _TRACE
+    _TRACE = _new_trace(script)
+    atexit.register(_TRACE.finish)
+    return _TRACE
+
+
+@contextmanager
+def task(script, name, **meta):
+    """
+    Trace a unit of work that may run in a pool worker: a `name` span of this process's
+    trace, or, in a worker process that has none, a trace of its own (`<script>_<name>`,
+    annotated with `meta`) that is written when the work is done.
+    """
+    global _TRACE
+    if _TRACE is not None or not enabled():
+        with span(name):
+            yield
+        return
+    _TRACE = _new_trace(f"{script}_{name}", parent=script)
+    _TRACE.annotate(**meta)
+    try:
+        with span(name):
+            yield
+    finally:
+        trace, _TRACE = _TRACE, None
+        trace.finish()
+
+
+def finish():
+    """Write and drop the process-wide trace, so a later `start` begins a new one (see `binflow batch`)."""
+    global _TRACE
+    trace, _TRACE = _TRACE, None
+    return trace.finish() if trace is not None else None
+
+
+def get():
+    return _TRACE if _TRACE is not None else _NullTrace()
+
+
+def span(name, rows=None):
+    return get().span(name, rows=rows)
+
+
+def add_rows(n, counter="rows"):
+    get().add_rows(n, counter)
+
+
+def annotate(**fields):
+    get().annotate(**fields)
+
+
+def iter_chunks(chunks, name, counter="rows"):
+    """Yield from `chunks` (e.g. a chunked pandas reader) inside one span, counting each chunk's rows."""
+    with span(name):
+        for chunk in chunks:
+            add_rows(len(chunk), counter)
+            yield chunk
@@ -11,6 +11,9 @@ from scipy.stats import gaussian_kde
 from sklearn.mixture import GaussianMixture
 from sklearn.preprocessing import PowerTransformer
 
+import perf_trace
+from stats_catalog import catalog_from_frame, write_catalog
+
 sns.set(style="whitegrid")
 
 META_COL_PATTERNS = (
@@ -71,13 +74,18 @@ def main():
     parser.add_argument('--run-gmmgating', action='store_true')
     parser.add_argument('--run-powertransform', action='store_true')
     args = parser.parse_args()
+    perf_trace.start('preprocess_quant_table')
 
-    df = pd.read_csv(args.input_table, sep='\t', low_memory=False)
+    with perf_trace.span('read'):
+        df = pd.read_csv(args.input_table, sep='\t', low_memory=False)
+        perf_trace.add_rows(len(df))
     out_df = df.copy()
 
-    feature_cols = [c for c in df.columns if is_feature_col(c)]
+    # Text metadata (e.g. QuPath's "Object ID" and "Parent") is never a feature
+    feature_cols = [c for c in df.columns if is_feature_col(c) and pd.api.types.is_numeric_dtype(df[c])]
     if not feature_cols:
         out_df.to_csv(args.output_table, sep='\t', index=False)
+        write_catalog(catalog_from_frame(out_df), args.output_table)
         pd.DataFrame(columns=['feature', 'threshold', 'percent_gated']).to_csv(args.summary_csv, index=False)
         Path(args.summary_plot).touch()
         return
@@ -86,32 +94,37 @@ def main():
     gating_rows = []
 
     if args.run_gmmgating:
-        for col in numeric_block.columns:
-            pre = numeric_block[col].astype(float).values
-            post, threshold, n_components, means, stds = gmm_gate_column(pre, random_state=args.seed)
-            numeric_block[col] = post
-            gating_rows.append({
-                'feature': col,
-                'threshold': threshold,
-                'n_components': n_components,
-                'gmm_means': means,
-                'gmm_stds': stds,
-                'pre_mean': float(np.mean(pre)),
-                'post_mean': float(np.mean(post)),
-                'delta_mean': float(np.mean(post - pre)),
-                'cells_gated': int(np.sum(pre < threshold)),
-                'percent_gated': float(np.mean(pre < threshold) * 100.0),
-            })
+        with perf_trace.span('gmm_gating', rows=len(numeric_block)):
+            for col in numeric_block.columns:
+                pre = numeric_block[col].astype(float).values
+                post, threshold, n_components, means, stds = gmm_gate_column(pre, random_state=args.seed)
+                numeric_block[col] = post
+                gating_rows.append({
+                    'feature': col,
+                    'threshold': threshold,
+                    'n_components': n_components,
+                    'gmm_means': means,
+                    'gmm_stds': stds,
+                    'pre_mean': float(np.mean(pre)),
+                    'post_mean': float(np.mean(post)),
+                    'delta_mean': float(np.mean(post - pre)),
+                    'cells_gated': int(np.sum(pre < threshold)),
+                    'percent_gated': float(np.mean(pre < threshold) * 100.0),
+                })
     else:
         for col in numeric_block.columns:
             gating_rows.append({'feature': col, 'threshold': np.nan, 'n_components': 0, 'gmm_means': [], 'gmm_stds': [], 'pre_mean': float(numeric_block[col].mean()), 'post_mean': float(numeric_block[col].mean()), 'delta_mean': 0.0, 'cells_gated': 0, 'percent_gated': 0.0})
 
     if args.run_powertransform:
-        pt = PowerTransformer(method='yeo-johnson', standardize=False)
-        numeric_block = pd.DataFrame(pt.fit_transform(numeric_block), columns=numeric_block.columns, index=numeric_block.index)
+        with perf_trace.span('powertransform', rows=len(numeric_block)):
+            pt = PowerTransformer(method='yeo-johnson', standardize=False)
+            numeric_block = pd.DataFrame(pt.fit_transform(numeric_block), columns=numeric_block.columns, index=numeric_block.index)
 
     out_df.loc[:, feature_cols] = numeric_block
-    out_df.to_csv(args.output_table, sep='\t', index=False)
+    with perf_trace.span('write', rows=len(out_df)):
+        out_df.to_csv(args.output_table, sep='\t', index=False)
+        # Sidecar for the report step and downstream readers, so nobody rescans the table
+        write_catalog(catalog_from_frame(out_df), args.output_table)
 
     summary = pd.DataFrame(gating_rows)
     summary.to_csv(args.summary_csv, index=False)
@@ -3,6 +3,8 @@ import argparse
 from pathlib import Path
 import pandas as pd
 
+import perf_trace
+
 
 def normalize_cols(df):
     mapping = {c: str(c).strip() for c in df.columns}
@@ -26,16 +28,20 @@ def find_key_cols(df):
 
 
 def main():
-    ap = argparse.ArgumentParser()
+    # `@list.txt` stands for the arguments listed in the file, one per line (long context lists of batched tasks)
+    ap = argparse.ArgumentParser(fromfile_prefix_chars="@")
     ap.add_argument("merged_file")
     ap.add_argument("--context-columns", required=True)
     ap.add_argument("--output", required=True)
     ap.add_argument("context_tables", nargs="+")
     args = ap.parse_args()
+    perf_trace.start("recombine_predictions_with_context")
 
     kept_cols = [c.strip() for c in args.context_columns.split(",") if c.strip()]
 
-    merged = pd.read_csv(args.merged_file, sep='\t', low_memory=False)
+    with perf_trace.span("read"):
+        merged = pd.read_csv(args.merged_file, sep='\t', low_memory=False)
+        perf_trace.add_rows(len(merged))
     merged = normalize_cols(merged)
     merged, key_cols = find_key_cols(merged)
     if not key_cols:
@@ -48,7 +54,9 @@ def main():
         if not p.exists():
             continue
         try:
-            df = pd.read_csv(p, sep='\t', low_memory=False)
+            with perf_trace.span("read_context"):
+                df = pd.read_csv(p, sep='\t', low_memory=False)
+                perf_trace.add_rows(len(df))
         except Exception:
             continue
         df = normalize_cols(df)
@@ -60,13 +68,15 @@ def main():
         context_frames.append(df[use_cols])
 
     if context_frames:
-        context = pd.concat(context_frames, ignore_index=True, sort=False)
-        context = context.drop_duplicates(subset=key_cols)
-        merged = merged.merge(context, on=key_cols, how='left')
+        with perf_trace.span("merge", rows=len(merged)):
+            context = pd.concat(context_frames, ignore_index=True, sort=False)
+            context = context.drop_duplicates(subset=key_cols)
+            merged = merged.merge(context, on=key_cols, how='left')
 
     ordered = key_cols + [c for c in kept_cols if c in merged.columns and c not in key_cols] + [c for c in merged.columns if c not in key_cols and c not in kept_cols]
     merged = merged[ordered]
-    merged.to_csv(args.output, sep='\t', index=False)
+    with perf_trace.span("write", rows=len(merged)):
+        merged.to_csv(args.output, sep='\t', index=False)
 
 
 if __name__ == '__main__':
@@ -6,6 +6,10 @@ import numpy as np
 import random
 import json
 
+import perf_trace
+from stats_catalog import catalog_percentile, load_catalog, subset_catalog, write_catalog
+from table_reader import CATEGORICAL_COLUMNS, iter_table, read_header
+
 def find_unpaired_columns(df):
     headers = df.columns.tolist()
     plus_columns = {col[:-1] for col in headers if col.endswith("+")}
@@ -17,15 +21,27 @@ def find_unpaired_columns(df):
 def compute_percentiles(quant_file, median_cols, prec_threshold, chunksize=500_000):
     """
     Compute the percentile threshold for each median column using chunked reading.
+    Uses the table's stats catalog sidecar instead of rescanning when one is present.
     Returns a dict: {col: threshold}
     """
+    catalog = load_catalog(quant_file)
+    if catalog is not None and all(col in catalog["stats"] for col in median_cols):
+        print(f"Using stats catalog for {quant_file}")
+        return {col: catalog_percentile(catalog, col, prec_threshold) for col in median_cols}
     values = {col: [] for col in median_cols}
-    for chunk in pd.read_csv(quant_file, sep="\t", usecols=median_cols, chunksize=chunksize, low_memory=True):
+    for chunk in perf_trace.iter_chunks(iter_table(quant_file, usecols=median_cols, chunksize=chunksize), "percentiles"):
         for col in median_cols:
-            values[col].extend(chunk[col].dropna().tolist())
-    thresholds = {col: np.percentile(values[col], prec_threshold) if values[col] else None for col in median_cols}
+            values[col].append(chunk[col].dropna().to_numpy())
+    thresholds = {}
+    for col in median_cols:
+        col_values = np.concatenate(values[col]) if values[col] else np.empty(0)
+        thresholds[col] = np.percentile(col_values, prec_threshold) if col_values.size else None
     return thresholds
 
+def categorical_context_columns(singleLabelColumn):
+    # The label column is rewritten cell by cell, so it must stay a plain object column
+    return tuple(c for c in CATEGORICAL_COLUMNS if c != singleLabelColumn)
+
 def process_and_write_chunks(
     quant_file, counts_df, output_filename, thresholds, negative_cols, add_only_missing,
     min_selection, delimiter, singleLabelColumn, context_cols, median_cols, label_delimiter, chunksize=500_000
@@ -35,7 +51,9 @@ def process_and_write_chunks(
     """
     header_written = False
     # For each chunk, process and write
-    for chunk in pd.read_csv(quant_file, sep="\t", usecols=[singleLabelColumn]+context_cols+median_cols, chunksize=chunksize, low_memory=True):
+    chunks = iter_table(quant_file, usecols=[singleLabelColumn]+context_cols+median_cols, chunksize=chunksize,
+                        categorical=categorical_context_columns(singleLabelColumn))
+    for chunk in perf_trace.iter_chunks(chunks, "relabel"):
         # For each negative col, process chunk
         for col in negative_cols:
             # Skip if add_only_missing is True and first-row count is greater than 1
@@ -81,7 +99,11 @@ def remove_unmatched_labels_chunked(
     """
     unmatched_counts = {label: 0 for label in colGroups["unpaired"]}
     header_written = False
-    for chunk in pd.read_csv(quant_file, sep="\t", usecols=[singleLabelColumn]+context_cols+median_cols, chunksize=chunksize, low_memory=True):
+    # Write to a temporary file: the input and output may be the same table
+    tmp_output = output_file + ".tmp"
+    chunks = iter_table(quant_file, usecols=[singleLabelColumn]+context_cols+median_cols, chunksize=chunksize,
+                        categorical=categorical_context_columns(singleLabelColumn))
+    for chunk in perf_trace.iter_chunks(chunks, "remove_unmatched"):
         for label in colGroups["unpaired"]:
             marker_match = any(label in col for col in median_cols)
             if not marker_match:
@@ -94,10 +116,17 @@ def remove_unmatched_labels_chunked(
                     parts = [v for v in parts if v != label]
                     return label_delimiter.join(parts) if parts else ""
                 chunk[singleLabelColumn] = chunk[singleLabelColumn].apply(remove_label)
-        chunk.to_csv(output_file, sep="\t", index=False, mode='a', header=not header_written)
+        chunk.to_csv(tmp_output, sep="\t", index=False, mode='a', header=not header_written)
         header_written = True
+    os.replace(tmp_output, output_file)
     return unmatched_counts
 
+def write_output_catalog(quant_file, output_file, columns):
+    """Carry the input's stats catalog over to the output; only the label column is modified."""
+    catalog = load_catalog(quant_file)
+    if catalog is not None:
+        write_catalog(subset_catalog(catalog, [c for c in columns if c != singleLabelColumn]), output_file)
+
 if __name__ == "__main__":
     if len(sys.argv) < 8:
         print("Usage: relabel_synthetic_negatives.py <quant_table> <counts_tsv> <n_cells_to_label> <below_percentile> <add_only_missing> <singleLabelColumn> <keptContextColumns>")
@@ -111,14 +140,14 @@ if __name__ == "__main__":
     keptContextColumns = [col.strip() for col in sys.argv[7].split(",")]
 
     label_delimiter = "|"  # Still hardcoded
+    perf_trace.start("relabel_synthetic_negatives")
 
     countsTable = pd.read_csv(counts_tsv, sep="\t")
     # Only read singleLabelColumn, keptContextColumns, and relevant 'Median' columns
-    with open(fhName) as f:
-        header = f.readline().strip().split('\t')
-        median_cols = [col for col in header if 'Median' in col]
-        context_cols = [col for col in header if col in keptContextColumns]
-        cols_to_read = [singleLabelColumn] + context_cols + median_cols
+    header = read_header(fhName)
+    median_cols = [col for col in header if 'Median' in col]
+    context_cols = [col for col in header if col in keptContextColumns]
+    cols_to_read = [singleLabelColumn] + context_cols + median_cols
 
     # Compute percentiles for each median column (first pass)
     thresholds = compute_percentiles(fhName, median_cols, below_percentile)
@@ -129,9 +158,10 @@ if __name__ == "__main__":
         # Still save the cleaned df and log (just copy input to output in chunks)
         output_file = fhName.replace(".tsv", "_mod.tsv")
         header_written = False
-        for chunk in pd.read_csv(fhName, sep="\t", usecols=cols_to_read, chunksize=500_000, low_memory=True):
+        for chunk in perf_trace.iter_chunks(iter_table(fhName, usecols=cols_to_read, chunksize=500_000), "copy"):
             chunk.to_csv(output_file, sep="\t", index=False, mode='a', header=not header_written)
             header_written = True
+        write_output_catalog(fhName, output_file, cols_to_read)
         sys.exit(0)
     else:
         negative_cols = [col for col in thisFocus.columns if col.endswith("-")]
@@ -149,6 +179,7 @@ if __name__ == "__main__":
     unmatched_counts = remove_unmatched_labels_chunked(
         output_file, output_file, colGroups, median_cols, singleLabelColumn, label_delimiter, context_cols, chunksize=500_000
     )
+    write_output_catalog(fhName, output_file, cols_to_read)
     log_name = fhName.replace(".tsv", "_unmatched_labels.json")
     with open(log_name, "w") as logf:
         json.dump(unmatched_counts, logf, indent=2)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Route trained models to the tables they can predict on, from table headers only.
+
+    route_predictions.py index --output table_features.json <tables...>
+    route_predictions.py route --index table_features.json <models...>
+
+`index` reads the header line of each table and writes {table name: [columns]}.
+`route` loads each model's feature columns and writes <model>_routing.tsv, one row
+per (model, table) pair: status "predict" when the table has every feature column,
+"skipped" (with the missing columns) otherwise. The pipeline only starts
+PREDICTIONS_FROM_BEST_MODEL tasks for the "predict" rows and keeps all rows in
+pipeline_info/prediction_routing.tsv.
+"""
+import argparse
+import json
+import os
+import sys
+
+import pandas as pd
+
+import perf_trace
+from best_model_predictions import extract_marker, feature_columns, load_model
+from table_reader import read_header
+
+ROUTING_COLUMNS = ["model", "marker", "table", "status", "n_features", "missing_columns"]
+
+
+def build_index(tables):
+    return {os.path.basename(t): read_header(t) for t in tables}
+
+
+def route(model_path, index):
+    model_name = os.path.basename(model_path)
+    features = feature_columns(load_model(model_path))
+    marker = os.path.splitext(extract_marker(model_name))[0]
+    rows = []
+    for table, columns in sorted(index.items()):
+        available = set(columns)
+        missing = [c for c in features if c not in available]
+        rows.append({
+            "model": model_name,
+            "marker": marker,
+            "table": table,
+            "status": "skipped" if missing else "predict",
+            "n_features": len(features),
+            "missing_columns": ", ".join(missing),
+        })
+    return pd.DataFrame(rows, columns=ROUTING_COLUMNS)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Pair trained models with the tables that carry their feature columns.")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("index", help="Table -> columns index from the header lines")
+    p.add_argument("tables", nargs="+")
+    p.add_argument("--output", default="table_features.json")
+
+    p = sub.add_parser("route", help="Per-model routing manifest")
+    p.add_argument("models", nargs="+")
+    p.add_argument("--index", required=True, help="JSON written by `index`")
+    args = ap.parse_args()
+
+    perf_trace.start("route_predictions")
+    perf_trace.annotate(command=args.command)
+    if args.command == "index":
+        with perf_trace.span("read_headers"):
+            index = build_index(args.tables)
+        with open(args.output, "w") as fh:
+            json.dump(index, fh, indent=1)
+        print(f"Indexed the columns of {len(index)} tables -> {args.output}")
+        return 0
+
+    with open(args.index) as fh:
+        index = json.load(fh)
+    for model_path in args.models:
+        with perf_trace.span("route"):
+            routing = route(model_path, index)
+        output = f"{os.path.splitext(os.path.basename(model_path))[0]}_routing.tsv"
+        routing.to_csv(output, sep="\t", index=False)
+        skipped = routing[routing["status"] == "skipped"]
+        print(f"{os.path.basename(model_path)}: {len(routing) - len(skipped)}/{len(routing)} tables routed")
+        for _, row in skipped.iterrows():
+            print(f"  skipped {row['table']}: missing {row['missing_columns']}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
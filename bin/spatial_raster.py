@@ -0,0 +1,139 @@
+"""
+Raster rendering for spatial cell maps.
+
+Instead of drawing one marker per cell, centroids are binned into a pixel grid and
+aggregated with np.bincount: the number of labelled cells per pixel and how many of
+them are positive. The pixel size follows the cell density (about `cells_per_pixel`
+cells per pixel over the slide's bounding box, within min/max grid sizes). Each pixel
+is coloured by the fraction of positive cells (or the majority label) and the grid is
+drawn with imshow in a titled figure with a -/+ colour key, so rendering time
+depends on the grid size rather than on the number of cells.
+"""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from cpu_budget import available_cpus
+
+DEFAULT_CELLS_PER_PIXEL = 2.0
+DEFAULT_MIN_PIXELS = 64
+DEFAULT_MAX_PIXELS = 1024
+# Matplotlib's default cycle colours, matching the old scatter plots ("-" first, "+" second)
+NEGATIVE_RGB = np.array([0x1F, 0x77, 0xB4]) / 255.0
+POSITIVE_RGB = np.array([0xFF, 0x7F, 0x0E]) / 255.0
+BACKGROUND_RGB = np.array([1.0, 1.0, 1.0])
+
+
+def grid_index(x, y, cells_per_pixel=DEFAULT_CELLS_PER_PIXEL, min_pixels=DEFAULT_MIN_PIXELS,
+               max_pixels=DEFAULT_MAX_PIXELS):
+    """
+    Flat pixel index of every cell (-1 where a centroid is missing), the grid shape and
+    its extent (x0, x1, y0, y1) in centroid units.
+
+    Pixels are square and hold about `cells_per_pixel` cells at the mean density of the
+    bounding box; the longer side is kept between `min_pixels` and `max_pixels` pixels.
+    Row 0 is the smallest y, so the raster has the same orientation as the slide.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    valid = np.isfinite(x) & np.isfinite(y)
+    if not valid.any():
+        return np.full(len(x), -1, dtype=np.int64), (1, 1), (0.0, 1.0, 0.0, 1.0)
+    x0, x1 = x[valid].min(), x[valid].max()
+    y0, y1 = y[valid].min(), y[valid].max()
+    long_side = max(x1 - x0, y1 - y0, 1e-9)
+    area = max(x1 - x0, 1e-9) * max(y1 - y0, 1e-9)
+    pixel = np.sqrt(area * cells_per_pixel / valid.sum())
+    pixel = float(np.clip(pixel, long_side / max_pixels, long_side / min_pixels))
+    width = int(np.floor((x1 - x0) / pixel)) + 1
+    height = int(np.floor((y1 - y0) / pixel)) + 1
+    col = np.clip(np.floor((np.where(valid, x, x0) - x0) / pixel).astype(np.int64), 0, width - 1)
+    row = np.clip(np.floor((np.where(valid, y, y0) - y0) / pixel).astype(np.int64), 0, height - 1)
+    flat = np.where(valid, row * width + col, -1)
+    return flat, (height, width), (float(x0), float(x0 + width * pixel), float(y0), float(y0 + height * pixel))
+
+
+def aggregate_labels(flat, shape, labels):
+    """Per-pixel counts of labelled cells and of positive cells; `labels` is 1/0 with NaN for unlabelled."""
+    labels = np.asarray(labels, dtype=np.float64)
+    keep = (flat >= 0) & np.isfinite(labels)
+    size = shape[0] * shape[1]
+    counts = np.bincount(flat[keep], minlength=size).reshape(shape)
+    positives = np.bincount(flat[keep], weights=labels[keep], minlength=size).reshape(shape)
+    return counts, positives
+
+
+def label_rgb(counts, positives, mode="fraction"):
+    """
+    Colour each pixel between the negative and positive colour.
+
+    `fraction` blends by the share of positive cells; `majority` uses the majority
+    label (ties are drawn halfway). Empty pixels are left as background.
+    """
+    occupied = counts > 0
+    frac = np.divide(positives, counts, out=np.zeros(counts.shape), where=occupied)
+    if mode == "majority":
+        frac = np.where(frac > 0.5, 1.0, np.where(frac < 0.5, 0.0, 0.5))
+    rgb = NEGATIVE_RGB + frac[..., None] * (POSITIVE_RGB - NEGATIVE_RGB)
+    return np.where(occupied[..., None], rgb, BACKGROUND_RGB)
+
+
+def write_label_raster(counts, positives, out_path, mode="fraction", title=None, extent=None, label=None,
+                       axis_labels=("Centroid X µm", "Centroid Y µm")):
+    """Draw the raster in a figure with a title, slide axes and a -/+ colour key (`label` names the marker)."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from matplotlib.colors import LinearSegmentedColormap
+
+    height, width = counts.shape
+    fig, ax = plt.subplots(figsize=(7.5, max(3.0, 6.0 * height / max(width, 1))))
+    ax.imshow(label_rgb(counts, positives, mode=mode), origin="lower", extent=extent, aspect="equal")
+    cmap = LinearSegmentedColormap.from_list("label", [NEGATIVE_RGB, POSITIVE_RGB])
+    colorbar = fig.colorbar(plt.cm.ScalarMappable(cmap=cmap), ax=ax, ticks=[0, 0.5, 1], shrink=0.8)
+    negative, positive = (f"{label}-", f"{label}+") if label else ("-", "+")
+    colorbar.ax.set_yticklabels([f"all {negative}", "mixed", f"all {positive}"])
+    colorbar.set_label(f"Share of {positive} cells per pixel" if mode == "fraction" else "Majority label per pixel")
+    ax.grid(False)
+    ax.set_xlabel(axis_labels[0])
+    ax.set_ylabel(axis_labels[1])
+    if title:
+        ax.set_title(title)
+    fig.tight_layout()
+    fig.savefig(out_path, dpi=120)
+    plt.close(fig)
+    return out_path
+
+
+def _write_job(job):
+    return write_label_raster(**job)
+
+
+def write_label_rasters(jobs, workers=None):
+    """Write jobs (write_label_raster keyword dicts), spreading figure rendering over a worker pool."""
+    workers = max(1, min(len(jobs), workers or available_cpus()))
+    if workers == 1:
+        return [_write_job(job) for job in jobs]
+    # fork keeps worker start-up cheap and avoids re-importing the calling script
+    ctx = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+        return list(pool.map(_write_job, jobs))
+
+
+def render_label_maps(x, y, label_columns, out_paths, mode="fraction", titles=None, markers=None,
+                      cells_per_pixel=DEFAULT_CELLS_PER_PIXEL, workers=None):
+    """
+    Render one raster per label column for cells sharing the same centroids.
+
+    `label_columns`, `out_paths` and the optional `titles` / `markers` (for the colour
+    key) are dicts keyed by the same names.
+    """
+    flat, shape, extent = grid_index(x, y, cells_per_pixel=cells_per_pixel)
+    jobs = []
+    for name, labels in label_columns.items():
+        counts, positives = aggregate_labels(flat, shape, labels)
+        jobs.append({"counts": counts, "positives": positives, "out_path": out_paths[name], "mode": mode,
+                     "title": (titles or {}).get(name), "extent": extent, "label": (markers or {}).get(name)})
+    return write_label_rasters(jobs, workers=workers)
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+Per-column statistics catalog for quantification tables.
+
+One streaming pass over a table records, for every numeric column: count, NaN count,
+min, max, mean, variance, a quantile sketch and a fixed-edge histogram. The catalog is
+written as a JSON sidecar next to the table (`<table>.stats.json`) so downstream steps
+can read it instead of rescanning the data.
+
+The quantile sketch is a uniform row reservoir (exact while the table fits in it); the
+histogram keeps a fixed number of aligned bins and doubles the bin width when new data
+falls outside the current range, so counts stay exact and edges stay fixed.
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from table_reader import DEFAULT_MEMORY_BUDGET_MB, iter_table
+
+SIDECAR_SUFFIX = ".stats.json"
+HISTOGRAM_BINS = 64
+# Internal resolution of the streaming histogram; it is trimmed and rebinned to
+# HISTOGRAM_BINS when the catalog is written.
+HISTOGRAM_RESOLUTION = 1024
+RESERVOIR_ROWS = 10_000
+QUANTILE_PROBS = np.round(np.linspace(0.0, 1.0, 201), 4)
+
+
+def sidecar_path(table_path):
+    return Path(str(table_path) + SIDECAR_SUFFIX)
+
+
+class DoublingHistogram:
+    """Fixed-bin histogram whose aligned range doubles whenever data falls outside it."""
+
+    def __init__(self, n_bins=HISTOGRAM_RESOLUTION):
+        self.n_bins = n_bins
+        self.lo = None
+        self.width = None
+        self.counts = np.zeros(n_bins, dtype=np.int64)
+
+    @property
+    def hi(self):
+        return self.lo + self.n_bins * self.width
+
+    def _double(self, extend_up):
+        half = self.counts.reshape(self.n_bins // 2, 2).sum(axis=1)
+        zeros = np.zeros(self.n_bins // 2, dtype=np.int64)
+        if extend_up:
+            self.counts = np.concatenate([half, zeros])
+        else:
+            self.counts = np.concatenate([zeros, half])
+            self.lo -= self.n_bins * self.width
+        self.width *= 2.0
+
+    def update(self, values):
+        if values.size == 0:
+            return
+        vmin, vmax = float(values.min()), float(values.max())
+        if self.lo is None:
+            span = vmax - vmin if vmax > vmin else max(abs(vmin), 1.0)
+            self.lo = vmin
+            self.width = span * (1.0 + 1e-9) / self.n_bins
+        while vmin < self.lo:
+            self._double(extend_up=False)
+        while vmax >= self.hi:
+            self._double(extend_up=True)
+        idx = np.floor((values - self.lo) / self.width).astype(np.int64)
+        np.clip(idx, 0, self.n_bins - 1, out=idx)
+        self.counts += np.bincount(idx, minlength=self.n_bins)
+
+    def finalize(self, max_bins=HISTOGRAM_BINS):
+        """Trim empty outer bins and merge neighbours down to at most `max_bins` bins."""
+        if self.lo is None:
+            return [], []
+        used = np.flatnonzero(self.counts)
+        first, last = int(used[0]), int(used[-1]) + 1
+        factor = max(1, int(np.ceil((last - first) / max_bins)))
+        n_out = int(np.ceil((last - first) / factor))
+        counts = np.zeros(n_out * factor, dtype=np.int64)
+        counts[:last - first] = self.counts[first:last]
+        counts = counts.reshape(n_out, factor).sum(axis=1)
+        edges = self.lo + self.width * (first + factor * np.arange(n_out + 1))
+        return edges.tolist(), counts.tolist()
+
+
+class CatalogBuilder:
+    """Accumulates column statistics chunk by chunk, vectorised across columns."""
+
+    def __init__(self, n_bins=HISTOGRAM_BINS, reservoir_rows=RESERVOIR_ROWS, seed=0):
+        self.n_bins = n_bins
+        self.reservoir_rows = reservoir_rows
+        self.rng = np.random.default_rng(seed)
+        self.n_rows = 0
+        self.columns = None
+        self.numeric_columns = None
+        self.count = self.nan_count = self.mean = self.m2 = self.min = self.max = None
+        self.hists = None
+        self.reservoir = None
+        self.reservoir_keys = None
+
+    def _init(self, chunk):
+        self.columns = [str(c) for c in chunk.columns]
+        self.numeric_columns = [str(c) for c in chunk.select_dtypes(include="number").columns]
+        n = len(self.numeric_columns)
+        self.count = np.zeros(n, dtype=np.int64)
+        self.nan_count = np.zeros(n, dtype=np.int64)
+        self.mean = np.zeros(n)
+        self.m2 = np.zeros(n)
+        self.min = np.full(n, np.inf)
+        self.max = np.full(n, -np.inf)
+        self.hists = [DoublingHistogram() for _ in range(n)]
+        self.reservoir = np.empty((0, n))
+        self.reservoir_keys = np.empty(0)
+
+    def update(self, chunk):
+        if self.columns is None:
+            self._init(chunk)
+        self.n_rows += len(chunk)
+        if not self.numeric_columns or len(chunk) == 0:
+            return
+        block = chunk[self.numeric_columns].to_numpy(dtype=np.float64, na_value=np.nan)
+        finite = np.isfinite(block)
+        n_b = finite.sum(axis=0)
+        self.nan_count += len(block) - n_b
+        with np.errstate(invalid="ignore", divide="ignore"):
+            masked = np.where(finite, block, 0.0)
+            mean_b = np.where(n_b > 0, masked.sum(axis=0) / np.maximum(n_b, 1), 0.0)
+            m2_b = np.where(finite, (block - mean_b) ** 2, 0.0).sum(axis=0)
+            n_a = self.count
+            n = n_a + n_b
+            delta = mean_b - self.mean
+            self.mean = np.where(n > 0, self.mean + delta * n_b / np.maximum(n, 1), 0.0)
+            self.m2 = self.m2 + m2_b + delta ** 2 * n_a * n_b / np.maximum(n, 1)
+        self.count = n
+        self.min = np.minimum(self.min, np.where(finite, block, np.inf).min(axis=0))
+        self.max = np.maximum(self.max, np.where(finite, block, -np.inf).max(axis=0))
+        for j, hist in enumerate(self.hists):
+            hist.update(block[finite[:, j], j])
+        # Reservoir via random keys: keeping the smallest keys is a uniform row sample
+        keys = np.concatenate([self.reservoir_keys, self.rng.random(len(block))])
+        rows = np.concatenate([self.reservoir, block], axis=0)
+        if len(keys) > self.reservoir_rows:
+            keep = np.argpartition(keys, self.reservoir_rows)[:self.reservoir_rows]
+            keys, rows = keys[keep], rows[keep]
+        self.reservoir_keys, self.reservoir = keys, rows
+
+    def to_dict(self, table_path=None):
+        stats = {}
+        for j, col in enumerate(self.numeric_columns or []):
+            count = int(self.count[j])
+            sample = self.reservoir[:, j]
+            sample = sample[np.isfinite(sample)]
+            hist_edges, hist_counts = self.hists[j].finalize(self.n_bins)
+            stats[col] = {
+                "count": count,
+                "nan_count": int(self.nan_count[j]),
+                "min": float(self.min[j]) if count else None,
+                "max": float(self.max[j]) if count else None,
+                "mean": float(self.mean[j]) if count else None,
+                "variance": float(self.m2[j] / count) if count else None,
+                "quantiles": np.quantile(sample, QUANTILE_PROBS).tolist() if sample.size else [],
+                "hist_edges": hist_edges,
+                "hist_counts": hist_counts,
+            }
+        catalog = {
+            "n_rows": int(self.n_rows),
+            "n_columns": len(self.columns or []),
+            "columns": self.columns or [],
+            "quantile_probs": QUANTILE_PROBS.tolist(),
+            "reservoir_rows": int(len(self.reservoir_keys)) if self.reservoir_keys is not None else 0,
+            "stats": stats,
+        }
+        if table_path is not None:
+            catalog["table"] = os.path.basename(str(table_path))
+            catalog["source_size_bytes"] = os.path.getsize(table_path)
+        return catalog
+
+
+def build_catalog(table_path, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, seed=0):
+    """Build a catalog for a table on disk in one streaming pass."""
+    builder = CatalogBuilder(seed=seed)
+    for chunk in iter_table(table_path, memory_budget_mb=memory_budget_mb):
+        builder.update(chunk)
+    return builder.to_dict(table_path)
+
+
+def catalog_from_frame(df, seed=0, slice_rows=200_000):
+    """Build a catalog for a frame that is already in memory (e.g. a table about to be written)."""
+    builder = CatalogBuilder(seed=seed)
+    for start in range(0, max(len(df), 1), slice_rows):
+        builder.update(df.iloc[start:start + slice_rows])
+    return builder.to_dict()
+
+
+def write_catalog(catalog, table_path, catalog_path=None):
+    path = Path(catalog_path) if catalog_path else sidecar_path(table_path)
+    if "table" not in catalog:
+        catalog["table"] = os.path.basename(str(table_path))
+    if os.path.exists(table_path):
+        catalog["source_size_bytes"] = os.path.getsize(table_path)
+    path.write_text(json.dumps(catalog))
+    return path
+
+
+def load_catalog(table_path, catalog_path=None):
+    """Return the sidecar catalog for a table, or None when it is missing or stale."""
+    path = Path(catalog_path) if catalog_path else sidecar_path(table_path)
+    if not path.exists():
+        return None
+    try:
+        catalog = json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+    size = catalog.get("source_size_bytes")
+    if size is not None and os.path.exists(table_path) and os.path.getsize(table_path) != size:
+        return None
+    return catalog
+
+
+def subset_catalog(catalog, columns):
+    """Catalog restricted to `columns`, for outputs that copy those columns unchanged."""
+    columns = [c for c in catalog["columns"] if c in set(columns)]
+    subset = {k: v for k, v in catalog.items() if k not in ("table", "source_size_bytes")}
+    subset["columns"] = columns
+    subset["n_columns"] = len(columns)
+    subset["stats"] = {c: catalog["stats"][c] for c in columns if c in catalog["stats"]}
+    return subset
+
+
+def catalog_percentile(catalog, column, percentile):
+    """Approximate percentile (0-100) of a column from the quantile sketch."""
+    col_stats = catalog["stats"].get(column)
+    if not col_stats or not col_stats["quantiles"]:
+        return None
+    return float(np.interp(percentile / 100.0, catalog["quantile_probs"], col_stats["quantiles"]))
+
+
+def catalog_describe(catalog, columns=None):
+    """Frame shaped like DataFrame.describe().T built from the catalog."""
+    rows = {}
+    for col in columns if columns is not None else catalog["stats"]:
+        col_stats = catalog["stats"].get(col)
+        if col_stats is None or not col_stats["count"]:
+            continue
+        rows[col] = {
+            "count": col_stats["count"],
+            "mean": col_stats["mean"],
+            "std": float(np.sqrt(col_stats["variance"] * col_stats["count"] / max(col_stats["count"] - 1, 1))),
+            "min": col_stats["min"],
+            "25%": catalog_percentile(catalog, col, 25),
+            "50%": catalog_percentile(catalog, col, 50),
+            "75%": catalog_percentile(catalog, col, 75),
+            "max": col_stats["max"],
+        }
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Write a per-column statistics sidecar for each table.")
+    ap.add_argument("tables", nargs="+")
+    ap.add_argument("--memory-budget-mb", type=int, default=DEFAULT_MEMORY_BUDGET_MB)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    import perf_trace
+
+    perf_trace.start("stats_catalog")
+    for table in args.tables:
+        with perf_trace.span("build_catalog") as build_span:
+            catalog = build_catalog(table, memory_budget_mb=args.memory_budget_mb, seed=args.seed)
+            build_span["rows"] = catalog["n_rows"]
+        out = write_catalog(catalog, table)
+        print(f"Wrote {len(catalog['stats'])} column statistics for {table} to {out}")
+
+
+if __name__ == "__main__":
+    main()
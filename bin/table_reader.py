@@ -0,0 +1,151 @@
+"""
+Shared reader for QuPath quantification tables.
+
+Scripts in bin/ import this module instead of calling pd.read_csv directly so that
+column projection, dtype downcasting and chunk sizing behave the same everywhere:
+  - columns are projected from the header with include/exclude regexes,
+  - full reads use the multithreaded pyarrow engine when it is installed,
+  - measurement columns ("<marker>: <compartment>: <stat>") are parsed as float32 and
+    Image/Classification as categoricals,
+  - chunked reads pick a chunk size that fits a memory budget.
+"""
+
+import importlib.util
+import os
+import re
+
+import pandas as pd
+
+CATEGORICAL_COLUMNS = ("Image", "Classification")
+# QuPath measurement columns always carry a ': ' separator, e.g. "CD3: Cell: Median".
+# Centroids are deliberately left as float64 because they are used as merge keys.
+MEASUREMENT_REGEX = re.compile(r":\s")
+DEFAULT_MEMORY_BUDGET_MB = int(os.environ.get("BINFLOW_MEMORY_BUDGET_MB", "1024"))
+MIN_CHUNK_ROWS = 1_000
+MAX_CHUNK_ROWS = 2_000_000
+
+
+def has_pyarrow():
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def read_header(file_path, sep="\t"):
+    """Return the column names of a delimited file without parsing any rows."""
+    with open(file_path, encoding="utf-8") as f:
+        return f.readline().rstrip("\r\n").split(sep)
+
+
+def select_columns(header, include=None, exclude=None, keep=()):
+    """
+    Project header columns, preserving file order.
+
+    A column is kept when it matches `include` (all columns if None) and does not match
+    `exclude`. Columns listed in `keep` are always kept when present in the header.
+    """
+    include_re = re.compile(include) if isinstance(include, str) else include
+    exclude_re = re.compile(exclude) if isinstance(exclude, str) else exclude
+    keep = set(keep)
+    selected = []
+    for col in header:
+        if col in keep:
+            selected.append(col)
+            continue
+        if include_re is not None and not include_re.search(col):
+            continue
+        if exclude_re is not None and exclude_re.search(col):
+            continue
+        selected.append(col)
+    return selected
+
+
+def build_dtypes(columns, downcast=True, categorical=CATEGORICAL_COLUMNS):
+    dtypes = {}
+    for col in columns:
+        if col in categorical:
+            dtypes[col] = "category"
+        elif downcast and MEASUREMENT_REGEX.search(col):
+            dtypes[col] = "float32"
+    return dtypes
+
+
+def _resolve_columns(file_path, usecols, include, exclude, keep, sep):
+    if usecols is not None:
+        return list(usecols)
+    if include is None and exclude is None:
+        return None
+    return select_columns(read_header(file_path, sep=sep), include=include, exclude=exclude, keep=keep)
+
+
+def _downcast_inferred(df, downcast):
+    # Fallback when a measurement column held text and could not be parsed as float32
+    if not downcast:
+        return df
+    for col in df.columns:
+        if MEASUREMENT_REGEX.search(col) and df[col].dtype == "float64":
+            df[col] = df[col].astype("float32")
+    return df
+
+
+def read_table(file_path, usecols=None, include=None, exclude=None, keep=(), downcast=True,
+               categorical=CATEGORICAL_COLUMNS, engine="auto", nrows=None, sep="\t"):
+    """
+    Read a whole table with column projection and downcast dtypes.
+
+    `engine="auto"` uses pyarrow when available (multithreaded parsing) and falls back
+    to the pandas C engine otherwise; `nrows` always uses the C engine.
+    """
+    columns = _resolve_columns(file_path, usecols, include, exclude, keep, sep)
+    header = columns if columns is not None else read_header(file_path, sep=sep)
+    dtypes = build_dtypes(header, downcast=downcast, categorical=categorical)
+    if engine == "auto":
+        engine = "pyarrow" if has_pyarrow() and nrows is None else "c"
+    kwargs = {"sep": sep, "usecols": columns, "dtype": dtypes, "engine": engine}
+    if engine == "c":
+        kwargs["low_memory"] = False
+        kwargs["nrows"] = nrows
+    try:
+        return pd.read_csv(file_path, **kwargs)
+    except (ValueError, TypeError):
+        kwargs["dtype"] = {c: t for c, t in dtypes.items() if t == "category"}
+        return _downcast_inferred(pd.read_csv(file_path, **kwargs), downcast)
+
+
+def estimate_row_bytes(file_path, n_columns, sample_bytes=1 << 16):
+    """Estimate the raw text size of one row from the first `sample_bytes` of the file."""
+    with open(file_path, "rb") as f:
+        f.readline()
+        sample = f.read(sample_bytes)
+    n_lines = sample.count(b"\n")
+    if n_lines == 0:
+        return max(len(sample), n_columns * 8)
+    return len(sample) / n_lines
+
+
+def chunk_rows_for_budget(file_path, n_columns, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, bytes_per_value=8):
+    """
+    Pick a chunk size so that one parsed chunk plus its text buffer fits the budget.
+
+    Each row costs roughly `n_columns * bytes_per_value` once parsed plus the raw text
+    the parser holds while tokenising it.
+    """
+    raw_row = estimate_row_bytes(file_path, n_columns)
+    parsed_row = n_columns * bytes_per_value
+    rows = int(memory_budget_mb * 1024 * 1024 / max(parsed_row + raw_row, 1))
+    return max(MIN_CHUNK_ROWS, min(MAX_CHUNK_ROWS, rows))
+
+
+def iter_table(file_path, usecols=None, include=None, exclude=None, keep=(), downcast=True,
+               categorical=CATEGORICAL_COLUMNS, chunksize=None, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, sep="\t"):
+    """
+    Yield projected, downcast chunks of a table.
+
+    When `chunksize` is None the chunk size is derived from `memory_budget_mb`.
+    """
+    columns = _resolve_columns(file_path, usecols, include, exclude, keep, sep)
+    header = columns if columns is not None else read_header(file_path, sep=sep)
+    dtypes = build_dtypes(header, downcast=downcast, categorical=categorical)
+    if chunksize is None:
+        chunksize = chunk_rows_for_budget(file_path, len(header), memory_budget_mb)
+    with pd.read_csv(file_path, sep=sep, usecols=columns, dtype=dtypes, chunksize=chunksize, low_memory=True) as reader:
+        for chunk in reader:
+            yield chunk
@@ -0,0 +1,64 @@
+import nextflow.util.MemoryUnit
+
+/**
+ * Batched per-image tasks: images grouped into batches of `params.batch_size` (or about
+ * `params.batch_bytes` of input), each batch run as one task through `binflow batch`.
+ */
+class Batching {
+
+    /**
+     * `items` sorted by `key` (so batches, and their cache hashes, are the same on every run)
+     * and cut into consecutive batches of at most `size` items and about `maxBytes` bytes.
+     */
+    static List<List> partition(Collection items, Object size, Object maxBytes, Closure key, Closure bytes) {
+        int maxItems = size ? (size as int) : Integer.MAX_VALUE
+        long limit = maxBytes ? MemoryUnit.of(maxBytes.toString()).toBytes() : Long.MAX_VALUE
+        def batches = []
+        def current = []
+        long currentBytes = 0
+        for (item in items.sort(false) { key(it) }) {
+            long n = (long) bytes(item)
+            if (current && (current.size() >= maxItems || currentBytes + n > limit)) {
+                batches << current
+                current = []
+                currentBytes = 0
+            }
+            current << item
+            currentBytes += n
+        }
+        if (current) {
+            batches << current
+        }
+        return batches
+    }
+
+    // Batches wait for all of their inputs, so a batch size of 1 keeps one streaming task per image
+    static boolean enabled(Object size, Object maxBytes) {
+        return (size && (size as int) > 1) || maxBytes
+    }
+
+    // A path input holding one file is a Path rather than a list
+    static List items(Object paths) {
+        return paths instanceof Collection ? (paths as List) : [paths]
+    }
+
+    static int workers(Object maxWorkers, Object batch) {
+        return Math.max(1, Math.min((maxWorkers ?: 1) as int, items(batch).size()))
+    }
+
+    static String quote(Object arg) {
+        def s = arg.toString()
+        return s ==~ /[A-Za-z0-9_\-.,:\/=+@%$]+/ ? s : "'" + s.replace("'", "'\"'\"'") + "'"
+    }
+
+    /** One `binflow batch` job: the commands (argument lists) chained with `&&`. */
+    static String job(List... commands) {
+        return commands.collect { c -> c.collect { quote(it) }.join(' ') }.join(' && ')
+    }
+
+    /** Shell command writing `lines` to `file`, one per line, with no shell expansion. */
+    static String writeLines(List lines, String file) {
+        def quoted = lines.collect { "'" + it.toString().replace("'", "'\"'\"'") + "'" }
+        return "printf '%s\\n' ${quoted.join(' ')} > ${file}"
+    }
+}
@@ -0,0 +1,73 @@
+import groovy.json.JsonSlurper
+import java.nio.file.Files
+import java.nio.file.Path
+
+/**
+ * Artifacts of a previous run (params.incremental_from) that an incremental run builds on:
+ * the tables it processed, its label counts, models and training sets, and its params.
+ */
+class Incremental {
+
+    // Params that decide how a table is relabelled, normalized and gated before prediction;
+    // new tables must go through the same steps as those the models were trained on
+    static final List<String> TRANSFORM_PARAMS = [
+        'singleLabelColumn', 'huerustic_negative_n_cells', 'huerustic_negative_percentile',
+        'huerustic_negative_add_only_missing', 'use_boxcox_transformation', 'qupath_object_type',
+        'nucleus_marker', 'transformation_group_by_column', 'hasFOV', 'run_gmmgating',
+        'run_powertransform', 'preprocessing_seed',
+    ]
+
+    static Path labelCounts(Path dir) { dir.resolve('label_counts/label_counts.tsv') }
+
+    static Path labelRecounts(Path dir) { dir.resolve('label_counts/perlabel_table.tsv') }
+
+    /** Base names of the input tables the previous run (and any incremental run on top of it) counted. */
+    static Set<String> knownTables(Path dir) {
+        def counts = labelCounts(dir)
+        if (!Files.exists(counts)) {
+            throw new IllegalArgumentException("No label counts in ${dir} (expected ${counts}); is it a BinFlow output directory?")
+        }
+        def lines = counts.readLines()
+        def fileCol = lines[0].split('\t').toList().indexOf('file')
+        return lines.drop(1).findAll { it.trim() }.collect { it.split('\t')[fileCol] - '_label_only.tsv' } as Set
+    }
+
+    /** The newest model per marker (<classifier>_best_model_<marker>.pkl) in <dir>/models. */
+    static List<Path> latestModels(Path dir) {
+        def models = dir.resolve('models')
+        if (!Files.isDirectory(models)) {
+            return []
+        }
+        def files = Files.list(models).withCloseable { s -> s.toList() }.findAll { it.fileName.toString().endsWith('.pkl') }
+        return files.groupBy { marker(it.fileName.toString()) }
+            .collect { _, candidates -> candidates.max { Files.getLastModifiedTime(it).toMillis() } }
+            .sort { it.fileName.toString() }
+    }
+
+    static String marker(String modelName) {
+        def m = modelName =~ /_best_model_(.+)\.pkl$/
+        return m ? m[0][1] : modelName
+    }
+
+    /** Params of the most recent successful run written to <dir>/pipeline_info, or null. */
+    static Map previousParams(Path dir) {
+        def info = dir.resolve('pipeline_info')
+        if (!Files.isDirectory(info)) {
+            return null
+        }
+        def runs = Files.list(info).withCloseable { s -> s.toList() }
+            .findAll { it.fileName.toString() ==~ /run_.*\.json/ }
+            .collect { new JsonSlurper().parse(it.toFile()) as Map }
+            .findAll { it.success }
+        return runs ? (Map) runs.max { it.started_utc.toString() }.params : null
+    }
+
+    /** "name: previous -> current" for every transform param that differs from the previous run. */
+    static List<String> paramChanges(Map previous, Map current) {
+        if (previous == null) {
+            return []
+        }
+        return TRANSFORM_PARAMS.findAll { k -> previous.containsKey(k) && previous[k]?.toString() != current[k]?.toString() }
+            .collect { k -> "${k}: ${previous[k]} -> ${current[k]}".toString() }
+    }
+}
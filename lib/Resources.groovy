@@ -0,0 +1,59 @@
+import nextflow.util.MemoryUnit
+
+/**
+ * Memory and CPU directives from the pre-flight estimates of bin/estimate_resources.py.
+ *
+ * A task's estimate is the one of the input table its files were derived from
+ * (<stem>_mod.tsv, <stem>_preprocessed.tsv, <stem>..._PRED.tsv, ...); tasks over
+ * several tables, or over files that match no table, get the cohort estimate.
+ * Without an estimate the process's own fallback is used.
+ */
+class Resources {
+
+    static Map estimate(Map estimates, String process, Object inputs) {
+        if (!estimates) {
+            return null
+        }
+        def name = process.tokenize(':')[-1]
+        def tables = (Map) (estimates.tables ?: [:])
+        def files = inputs instanceof Collection ? inputs : [inputs]
+        def stems = files.collect { f -> stemOf(tables.keySet(), f.toString().tokenize('/')[-1]) }.unique()
+        def entry = stems.size() == 1 && stems[0] ? tables[stems[0]] : estimates.cohort
+        return (Map) entry?.processes?.get(name)
+    }
+
+    // Longest table stem the file name starts with, not followed by a letter or digit
+    static String stemOf(Collection<String> stems, String fileName) {
+        def matches = stems.findAll { s ->
+            fileName == s || (fileName.startsWith(s) && !Character.isLetterOrDigit(fileName.charAt(s.length())))
+        }
+        return matches ? matches.max { it.length() } : null
+    }
+
+    /**
+     * Estimated memory, times `parallel` jobs running side by side (batched tasks) and doubled
+     * on every retry, within the estimates' and the local machine's limits.
+     */
+    static MemoryUnit memory(task, Map estimates, Object inputs, String fallback, int parallel = 1) {
+        def est = estimate(estimates, task.process, inputs)
+        long bytes = est ? ((long) est.memory_mb) * 1024L * 1024L : MemoryUnit.of(fallback).toBytes()
+        bytes = (long) (bytes * parallel * Math.pow(2, (task.attempt ?: 1) - 1))
+        if (estimates?.limits?.memory_mb) {
+            bytes = Math.min(bytes, ((long) estimates.limits.memory_mb) * 1024L * 1024L)
+        }
+        if (task.executor == 'local') {
+            def os = (com.sun.management.OperatingSystemMXBean) java.lang.management.ManagementFactory.operatingSystemMXBean
+            bytes = Math.min(bytes, os.totalPhysicalMemorySize)
+        }
+        return new MemoryUnit(bytes)
+    }
+
+    static int cpus(task, Map estimates, Object inputs, int fallback) {
+        def est = estimate(estimates, task.process, inputs)
+        int n = est ? (int) est.cpus : fallback
+        if (task.executor == 'local') {
+            n = Math.min(n, Runtime.runtime.availableProcessors())
+        }
+        return Math.max(n, 1)
+    }
+}
@@ -23,6 +23,17 @@ Channel.fromPath("${params.input_dir}/*.tsv", type: 'file')
 			.set { inputTables }
 			
 
+// Per-image files grouped into the batches of one task each: params.batch_size files,
+// or fewer when params.batch_bytes of input is reached first. Without batching every
+// file is its own batch and tasks start as soon as their file is ready.
+def batches(files) {
+    if (!Batching.enabled(params.batch_size, params.batch_bytes)) {
+        return files.map { [it] }
+    }
+    files.toSortedList { a, b -> a.name <=> b.name }
+        .flatMap { all -> Batching.partition(all, params.batch_size, params.batch_bytes, { it.name }, { it.size() }) }
+}
+
 // -------------------------------------- //
 // Function which prints help message text
 def helpMessage() {
@@ -39,65 +50,146 @@ Required Arguments:
 """.stripIndent()
 }
 
-// Accept any panel design, assume all input files have common markers
+// Pre-flight memory/CPU estimates per input table and for the cohort, from headers and
+// file sizes only; lib/Resources.groovy turns them into the processes' directives
+process ESTIMATE_RESOURCES {
+    publishDir(
+        path: "${params.output_dir}/pipeline_info",
+        mode: "copy"
+    )
+
+    input:
+    val(table_paths)
+
+    output:
+    path("resource_estimates.json"), emit: estimates
+    path("resource_estimates.tsv"), emit: table
+    path("*_perf.json"), emit: perf, optional: true
+
+    script:
+    def maxMemoryMb = nextflow.util.MemoryUnit.of(params.max_memory.toString()).toMega()
+    """
+    export BINFLOW_CPUS=${task.cpus}
+    estimate_resources.py \
+      --output resource_estimates.json \
+      --tsv resource_estimates.tsv \
+      --max-memory-mb ${maxMemoryMb} \
+      --max-cpus ${params.max_cpus} \
+      ${table_paths.collect { "'${it}'" }.join(' ')}
+    """
+}
+
+// Accept any panel design, assume all input files have common markers.
+// Runs once over the whole cohort: one worker per table, histograms taken from the stats catalogs.
 process REPORT_PANEL_DESIGN {
+    cpus { Resources.cpus(task, resources, tables_collected, 8) }
+    memory { Resources.memory(task, resources, tables_collected, '16 GB') }
+
     publishDir(
-        path: "${params.output_dir}/reports/",
-        pattern: "*.html"
+        path: "${params.output_dir}/reports/panel_design",
+        pattern: "*.{png,txt}",
+        mode: "copy"
     )
     input:
     path(tables_collected)
+    path(stats_catalogs)
+    val(resources)
 
     output:
-    path("*_panel_design_report.html"), emit: html_report
+    path("Marker_Analysis_Report_*"), emit: figures
+    path("panel_design_summary.json"), emit: summary
+    path("*_perf.json"), emit: perf, optional: true
 
     script:
     """
+    export BINFLOW_CPUS=${task.cpus}
     analyze_panel_design.py ${params.letterhead} ${tables_collected}
-    build_html_report.py --title "Panel design report" --output panel_design_report.html --inputs ${tables_collected}
-    mv panel_design_report.html ${tables_collected.baseName}_panel_design_report.html
+    build_html_report.py --format json --step REPORT_PANEL_DESIGN --title "Panel design report" --elapsed-seconds \$SECONDS --output panel_design_summary.json --inputs Marker_Analysis_Report_*
     """
 }
 
 
+// Batched: one task per batch of tables (see Batching.groovy)
 process EXTRACT_LABEL_COLUMN {
+    cpus { Batching.workers(params.batch_workers, quant_tables) }
+
+    input:
+    path(quant_tables)
+
+    output:
+    path("*_label_only.tsv"), emit: label_tables
+    path("*_perf.json"), emit: perf, optional: true
+
+    script:
+    def jobs = Batching.items(quant_tables).collect { t ->
+        Batching.job(["extract_label_column.py", t, "${t.baseName}_label_only.tsv", params.singleLabelColumn])
+    }
+    """
+    export BINFLOW_CPUS=${task.cpus}
+    ${Batching.writeLines(jobs, 'jobs.txt')}
+    binflow batch --workers ${task.cpus} jobs.txt
+    """
+}
+
+// One streaming pass per input table: per-column stats sidecar (<table>.stats.json)
+// consumed downstream instead of rescanning the data
+process BUILD_STATS_CATALOG {
     input:
     path(quant_table)
 
     output:
-    tuple val(quant_table.baseName), path("*_label_only.tsv"), emit: label_tables
+    path("${quant_table}.stats.json"), emit: catalog
+    path("*_perf.json"), emit: perf, optional: true
 
     script:
     """
-    extract_label_column.py ${quant_table} ${quant_table.baseName}_label_only.tsv ${params.singleLabelColumn}
+    export BINFLOW_CPUS=${task.cpus}
+    stats_catalog.py ${quant_table}
     """
 }
 
 process ALL_LABEL_COUNTS{
+    // Incremental runs publish these counts combined with the previous run's (LABEL_SHIFT)
+    publishDir(
+        path: "${params.output_dir}/label_counts",
+        pattern: "label_counts.tsv",
+        mode: "copy",
+        enabled: !params.incremental_from
+    )
+
     input:
     path(tables_collected)
     
     output: 
     path("label_counts.tsv"), emit: count
-    path("label_counts_report.html"), emit: html_report
+    path("label_counts_summary.json"), emit: summary
+    path("*_perf.json"), emit: perf, optional: true
     
     script:
     """
+    export BINFLOW_CPUS=${task.cpus}
     binary_counter.py label_counts.tsv ${params.singleLabelColumn} ${tables_collected}
-    build_html_report.py --title "All label counts" --output label_counts_report.html --inputs label_counts.tsv
+    build_html_report.py --format json --step ALL_LABEL_COUNTS --title "All label counts" --elapsed-seconds \$SECONDS --output label_counts_summary.json --inputs label_counts.tsv
     """
 }
 
 process BOOST_NEGATIVE_LABELS{
+    cpus { Resources.cpus(task, resources, quant_table, 6) }
+    memory { Resources.memory(task, resources, quant_table, '32 GB') }
+
     input:
-    tuple path(quant_table), path(counts_tsv)
+    tuple path(quant_table), path(stats_catalog), path(counts_tsv)
+    val(resources)
     
     output: 
     path("*_mod.tsv"), emit: quant_files
-    path("*_boost_report.html"), emit: html_report
+    tuple path("*_mod.tsv"), path("*_mod.tsv.stats.json"), emit: quant_with_stats
+    path("*_boost_summary.json"), emit: summary
+    path("*_perf.json"), emit: perf, optional: true
     
     script:
     """
+    export BINFLOW_CPUS=${task.cpus}
     relabel_synthetic_negatives.py \
       ${quant_table} \
       ${counts_tsv} \
@@ -106,47 +198,88 @@ process BOOST_NEGATIVE_LABELS{
       ${params.huerustic_negative_add_only_missing} \
       ${params.singleLabelColumn} \
       "${params.keptContextColumns.join(',')}"
-    build_html_report.py --title "Boost negative labels" --output boost_report.html --inputs ${quant_table} ${counts_tsv} *_mod.tsv
-    mv boost_report.html ${quant_table.baseName}_boost_report.html
+    build_html_report.py --format json --step BOOST_NEGATIVE_LABELS --title "Boost negative labels" --elapsed-seconds \$SECONDS --output ${quant_table.baseName}_boost_summary.json --inputs ${quant_table} ${counts_tsv} *_mod.tsv
     """
 }
 
 process GET_ALL_LABEL_RECOUNTS{
     publishDir(
-        path: "${params.output_dir}/reports/",
-        pattern: "*.html"
+        path: "${params.output_dir}/label_counts",
+        pattern: "*_table.tsv",
+        mode: "copy",
+        enabled: !params.incremental_from
     )
-    
+
     input:
     path(tables_collected)
 
     output: 
     path("*_table.tsv"), emit: count
-    path("recount_report.html"), emit: html_report
+    path("recount_summary.json"), emit: summary
+    path("*_perf.json"), emit: perf, optional: true
         
     script:
     """
+    export BINFLOW_CPUS=${task.cpus}
     binary_table.py perlabel_table.tsv ${params.singleLabelColumn} ${tables_collected}
-    build_html_report.py --title "Per-label recount" --output recount_report.html --inputs perlabel_table.tsv
+    build_html_report.py --format json --step GET_ALL_LABEL_RECOUNTS --title "Per-label recount" --elapsed-seconds \$SECONDS --output recount_summary.json --inputs perlabel_table.tsv
     """
 }
 
-// Produce Batch based normalization - boxcox
-process BOXCOX_TRANSFORM {
+// Incremental runs: the new tables' label counts appended to the previous run's, and the
+// markers whose positive fraction moved by more than params.retrain_label_shift
+process LABEL_SHIFT {
     publishDir(
-        path: "${params.output_dir}/normalization_reports",
-        pattern: "*.html",
+        path: "${params.output_dir}/label_counts",
+        pattern: "*.tsv",
         mode: "copy"
     )
+
     input:
-    path(quant_table)
+    path(previous_counts, stageAs: 'previous/*')
+    path(previous_recounts, stageAs: 'previous/*')
+    path(counts, stageAs: 'new/*')
+    path(recounts, stageAs: 'new/*')
+
+    output:
+    path("label_counts.tsv"), emit: count
+    path("perlabel_table.tsv"), emit: recount
+    path("label_shift.tsv"), emit: shift
+    path("retrain_markers.txt"), emit: retrain
+    path("label_shift_summary.json"), emit: summary
+    path("*_perf.json"), emit: perf, optional: true
+
+    script:
+    """
+    export BINFLOW_CPUS=${task.cpus}
+    label_shift.py \
+      --previous-counts ${previous_counts} \
+      --previous-recounts ${previous_recounts} \
+      --counts ${counts} \
+      --recounts ${recounts} \
+      --threshold ${params.retrain_label_shift}
+    build_html_report.py --format json --step LABEL_SHIFT --title "Label shift against ${params.incremental_from}" --elapsed-seconds \$SECONDS --output label_shift_summary.json --inputs label_shift.tsv perlabel_table.tsv
+    """
+}
+
+// Produce Batch based normalization - boxcox
+process BOXCOX_TRANSFORM {
+    cpus { Resources.cpus(task, resources, quant_table, 8) }
+    memory { Resources.memory(task, resources, quant_table, '32 GB') }
+
+    input:
+    tuple path(quant_table), path(stats_catalog)
+    val(resources)
 
     output:
     path("*.tsv"), emit: quant_files
-    path("boxcox_*.html"), emit: html_report
+    path("*_boxcox_mod.tsv.stats.json"), emit: stats_catalog
+    path("boxcox_*_summary.json"), emit: summary
+    path("*_perf.json"), emit: perf, optional: true
 
     script:
     """
+    export BINFLOW_CPUS=${task.cpus}
     boxcox_transformer.py \
         ${quant_table} \
         ${params.qupath_object_type} \
@@ -154,8 +287,7 @@ process BOXCOX_TRANSFORM {
         ${params.transformation_group_by_column} \
         ${params.letterhead} \
         ${params.hasFOV}
-    build_html_report.py --title "BoxCox transform" --output boxcox_report.html --inputs ${quant_table} *.tsv
-    mv boxcox_report.html boxcox_${quant_table.baseName}.html
+    build_html_report.py --format json --step BOXCOX_TRANSFORM --title "BoxCox transform" --elapsed-seconds \$SECONDS --output boxcox_${quant_table.baseName}_summary.json --inputs ${quant_table} *.tsv
     """
 }
 
@@ -169,30 +301,32 @@ process CHECK_LABEL_COUNTS {
 
     script:
     """
+    export BINFLOW_CPUS=${task.cpus}
     check_label_counts.py ${label_counts}
     """
 }
 
 
 process PREPROCESS_QUANT_TABLE {
-    publishDir(
-        path: "${params.output_dir}/preprocessing_reports",
-        pattern: "*.html",
-        mode: "copy"
-    )
+    cpus { Resources.cpus(task, resources, quant_table, 4) }
+    memory { Resources.memory(task, resources, quant_table, '16 GB') }
 
     input:
     path(quant_table)
+    val(resources)
 
     output:
     path("*_preprocessed.tsv"), emit: quant_files
+    path("*_preprocessed.tsv.stats.json"), emit: stats_catalog
     path("*_gmm_summary.csv"), emit: gmm_summary
     path("*_gmm_summary.png"), emit: gmm_plot
-    path("*_preprocess_report.html"), emit: html_report
+    path("*_preprocess_summary.json"), emit: summary
+    path("*_perf.json"), emit: perf, optional: true
 
     script:
     def base = quant_table.baseName
     """
+    export BINFLOW_CPUS=${task.cpus}
     preprocess_quant_table.py \
       ${quant_table} \
       --output-table ${base}_preprocessed.tsv \
@@ -201,40 +335,87 @@ process PREPROCESS_QUANT_TABLE {
       --seed ${params.preprocessing_seed} \
       ${params.run_gmmgating ? '--run-gmmgating' : ''} \
       ${params.run_powertransform ? '--run-powertransform' : ''}
-    build_html_report.py --title "Preprocess quant table" --output preprocess_report.html --inputs ${base}_preprocessed.tsv ${base}_gmm_summary.csv ${base}_gmm_summary.png ${quant_table}
-    mv preprocess_report.html ${base}_preprocess_report.html
+    build_html_report.py --format json --step PREPROCESS_QUANT_TABLE --title "Preprocess quant table" --elapsed-seconds \$SECONDS --output ${base}_preprocess_summary.json --inputs ${base}_preprocessed.tsv ${base}_gmm_summary.csv ${base}_gmm_summary.png ${quant_table}
     """
 }
 
 
 process RECOMBINE_PREDICTIONS_WITH_CONTEXT {
+    cpus { Batching.workers(params.batch_workers, merged_files) }
+    memory { Resources.memory(task, resources, context_tables, '8 GB', task.cpus) }
+
     publishDir(
         path: "${params.output_dir}/final_merged_predictions",
         mode: "copy"
     )
 
     input:
-    tuple val(image_id), path(merged_file), val(context_tables)
+    path(merged_files)
+    val(context_tables)
+    val(resources)
 
     output:
-    tuple val(image_id), path("*_FINAL.tsv"), emit: merged_with_context
-    path("*_final_recombine_report.html"), emit: html_report
+    path("*_FINAL.tsv"), emit: merged_with_context
+    path("*_final_recombine_summary.json"), emit: summary
+    path("*_perf.json"), emit: perf, optional: true
 
     script:
-    def base = merged_file.baseName.replace('_MERGED','')
-    def ctx = context_tables.join(' ')
+    def jobs = Batching.items(merged_files).collect { merged_file ->
+        def base = merged_file.baseName.replace('_MERGED','')
+        Batching.job(
+            ["recombine_predictions_with_context.py", merged_file, "--context-columns", params.keptContextColumns.join(','),
+             "--output", "${base}_FINAL.tsv", "@context_tables.txt"],
+            ["build_html_report.py", "--format", "json", "--step", "RECOMBINE_PREDICTIONS_WITH_CONTEXT",
+             "--title", "Final merged predictions with context", "--elapsed-seconds", '$SECONDS',
+             "--output", "${base}_final_recombine_summary.json", "--inputs", merged_file, "${base}_FINAL.tsv", "@context_tables.txt"]
+        )
+    }
+    """
+    export BINFLOW_CPUS=${task.cpus}
+    ${Batching.writeLines(context_tables, 'context_tables.txt')}
+    ${Batching.writeLines(jobs, 'jobs.txt')}
+    binflow batch --workers ${task.cpus} jobs.txt
     """
-    recombine_predictions_with_context.py \
-      ${merged_file} \
-      --context-columns "${params.keptContextColumns.join(',')}" \
-      --output ${base}_FINAL.tsv \
-      ${ctx}
+}
+
+// One HTML report for the whole run, rendered from the per-step JSON summaries
+process REPORT_AGGREGATE {
+    publishDir(
+        path: "${params.output_dir}",
+        mode: "copy"
+    )
+
+    input:
+    path(summaries)
+
+    output:
+    path("run_report"), emit: report
+
+    script:
+    """
+    export BINFLOW_CPUS=${task.cpus}
+    aggregate_reports.py --output-dir run_report --title "BinFlow run report" --workers ${task.cpus} ${summaries}
+    """
+}
+
+// Run-wide hot-spot table from the *_perf.json trace every instrumented script writes
+process PERF_HOTSPOTS {
+    publishDir(
+        path: "${params.output_dir}/perf",
+        mode: "copy"
+    )
 
-    build_html_report.py \
-      --title "Final merged predictions with context" \
-      --output ${base}_final_recombine_report.html \
-      --inputs ${merged_file} ${base}_FINAL.tsv ${ctx}
+    input:
+    path(traces)
+
+    output:
+    path("perf_hotspots.tsv"), emit: hotspots
+    path("perf_traces.json"), emit: traces
 
+    script:
+    """
+    export BINFLOW_CPUS=${task.cpus}
+    merge_perf_traces.py --output perf_hotspots.tsv --combined perf_traces.json ${traces}
     """
 }
 
@@ -248,35 +429,149 @@ workflow {
         // Exit out and do not run anything else
         exit 1
     } else {
-        label_only_tables = EXTRACT_LABEL_COLUMN(inputTables)
-        label_tables_for_counts = label_only_tables.label_tables.map { _, label_table -> label_table }
+        // Incremental mode: only the tables the previous run has not seen are processed,
+        // against its label counts, models and training sets
+        previous = params.incremental_from ? file(params.incremental_from.toString()) : null
+        tables = inputTables
+        if (previous) {
+            def changed = Incremental.paramChanges(Incremental.previousParams(previous), params)
+            if (changed) {
+                error "Incremental run over ${previous} must relabel, normalize and gate new tables as that run did; changed params:\n  ${changed.join('\n  ')}"
+            }
+            def known = Incremental.knownTables(previous)
+            log.info "Incremental run over ${previous}: skipping ${known.size()} tables it already processed"
+            tables = inputTables.filter { t -> !known.contains(t.baseName) }
+                .ifEmpty { error "No new tables in ${params.input_dir}: every table was already processed by ${previous}" }
+        }
 
-        label_summary = ALL_LABEL_COUNTS(label_tables_for_counts.collect())
-        CHECK_LABEL_COUNTS(label_summary.count) // This will exit if no labels are found
+        // Tables are read where they are, so estimates are skipped for object-store inputs
+        if (params.estimate_resources && !params.input_dir.toString().contains('://')) {
+            estimated = ESTIMATE_RESOURCES(tables.map { it.toString() }.collect())
+            resources = estimated.estimates.map { f -> new groovy.json.JsonSlurper().parse(f.toFile()) }
+            estimate_perf = estimated.perf
+        } else {
+            resources = Channel.value([:])
+            estimate_perf = Channel.empty()
+        }
+
+        label_only_tables = EXTRACT_LABEL_COLUMN(batches(tables))
+        label_tables_for_counts = label_only_tables.label_tables.flatten()
 
-        //REPORT_PANEL_DESIGN(inputTables)
+        label_summary = ALL_LABEL_COUNTS(label_tables_for_counts.collect())
         recount = GET_ALL_LABEL_RECOUNTS(label_tables_for_counts.collect())
-        boost_inputs = inputTables.combine(recount.count)
+        catalogs = BUILD_STATS_CATALOG(tables)
+        step_summaries = label_summary.summary.mix(recount.summary)
+        perf_traces = label_only_tables.perf.mix(label_summary.perf, recount.perf, catalogs.perf, estimate_perf)
+
+        label_counts = label_summary.count
+        label_recounts = recount.count
+        retrain_markers = Channel.empty()
+        if (previous) {
+            shift = LABEL_SHIFT(
+                file(Incremental.labelCounts(previous)), file(Incremental.labelRecounts(previous)),
+                label_summary.count, recount.count
+            )
+            label_counts = shift.count
+            label_recounts = shift.recount
+            retrain_markers = shift.retrain.map { f -> f.readLines().findAll { it.trim() } }
+            step_summaries = step_summaries.mix(shift.summary)
+            perf_traces = perf_traces.mix(shift.perf)
+        }
+        CHECK_LABEL_COUNTS(label_counts) // This will exit if no labels are found
+
+        if (params.report_panel_design) {
+            panel_design = REPORT_PANEL_DESIGN(tables.collect(), catalogs.catalog.collect(), resources)
+            step_summaries = step_summaries.mix(panel_design.summary)
+            perf_traces = perf_traces.mix(panel_design.perf)
+        }
+        tables_with_stats = tables.map { t -> tuple(t.name, t) }
+            .join(catalogs.catalog.map { c -> tuple(c.name - '.stats.json', c) })
+            .map { _, table, catalog -> tuple(table, catalog) }
+        boost_inputs = tables_with_stats.combine(label_recounts)
         //boost_inputs.view()
-        boosted = BOOST_NEGATIVE_LABELS(boost_inputs)
+        boosted = BOOST_NEGATIVE_LABELS(boost_inputs, resources)
         boosted_quant = boosted.quant_files
 
+        step_summaries = step_summaries.mix(boosted.summary)
+        perf_traces = perf_traces.mix(boosted.perf)
+
         preprocessed_input_quant = boosted_quant
         if (params.use_boxcox_transformation) {
-            boxcox_results = BOXCOX_TRANSFORM(boosted_quant.flatten())
+            boxcox_results = BOXCOX_TRANSFORM(boosted.quant_with_stats, resources)
             preprocessed_input_quant = boxcox_results.quant_files.flatten()
+            step_summaries = step_summaries.mix(boxcox_results.summary)
+            perf_traces = perf_traces.mix(boxcox_results.perf)
+        }
+        preprocessedTables = PREPROCESS_QUANT_TABLE(preprocessed_input_quant, resources)
+
+        // Marker recovery is a whole-cohort analysis, so incremental runs leave the previous one in place
+        if (previous) {
+            recovery = [summary: Channel.empty(), perf: Channel.empty()]
+            supervised_out = supervised_wf(
+                preprocessedTables.quant_files, resources,
+                Channel.fromList(Incremental.latestModels(previous)),
+                Channel.fromPath("${previous}/training/*_all.tsv"),
+                retrain_markers
+            )
+        } else {
+            recovery = marker_recovery_wf(preprocessedTables.quant_files.collect(), resources)
+            supervised_out = supervised_wf(preprocessedTables.quant_files, resources, Channel.empty(), Channel.empty(), Channel.empty())
         }
-        preprocessedTables = PREPROCESS_QUANT_TABLE(preprocessed_input_quant)
-
-        marker_recovery_wf(preprocessedTables.quant_files.collect())
-        supervised_out = supervised_wf(preprocessedTables.quant_files, params.input_dir)
 
         context_tables = preprocessedTables.quant_files.collect()
-        final_merge_inputs = supervised_out.merged_tables.combine(context_tables)
-            .map { image_id, merged_file, context_list -> tuple(image_id, merged_file, context_list) }
-        RECOMBINE_PREDICTIONS_WITH_CONTEXT(final_merge_inputs)
+        merged_batches = batches(supervised_out.merged_tables.map { _, merged_file -> merged_file })
+        recombined = RECOMBINE_PREDICTIONS_WITH_CONTEXT(merged_batches, context_tables, resources)
+
+        step_summaries = step_summaries
+            .mix(preprocessedTables.summary, recovery.summary, supervised_out.summaries, recombined.summary)
+        REPORT_AGGREGATE(step_summaries.collect())
+
+        perf_traces = perf_traces
+            .mix(preprocessedTables.perf, recovery.perf, supervised_out.perf, recombined.perf)
+        if (params.perf_trace) {
+            PERF_HOTSPOTS(perf_traces.collect())
+        }
     }
     
 }
 
 
+
+// Run metadata for bin/perf_history.py (cohort size and params next to the Nextflow trace),
+// ingested into params.perf_history_db when one is configured
+workflow.onComplete {
+    if (params.output_dir.toString().contains('://')) {
+        return
+    }
+    def infoDir = file("${params.output_dir}/pipeline_info")
+    infoDir.mkdirs()
+    def inputs = files("${params.input_dir}/*.tsv")
+    def runMeta = [
+        run_name   : workflow.runName,
+        session_id : workflow.sessionId.toString(),
+        started_utc: workflow.start.toString(),
+        duration_s : workflow.duration.toMillis() / 1000.0,
+        success    : workflow.success,
+        cohort     : file(params.input_dir.toString()).name,
+        n_inputs   : inputs.size(),
+        input_bytes: inputs.sum(0L) { it.size() },
+        params     : params.collectEntries { k, v -> [(k): v instanceof Collection || v instanceof Number || v instanceof Boolean || v == null ? v : v.toString()] },
+    ]
+    def metaFile = infoDir.resolve("run_${workflow.runName}.json")
+    metaFile.text = groovy.json.JsonOutput.prettyPrint(groovy.json.JsonOutput.toJson(runMeta))
+
+    if (params.perf_history_db) {
+        def traces = infoDir.listFiles().findAll { it.name.startsWith('execution_trace_') && it.lastModified() >= workflow.start.toInstant().toEpochMilli() }
+        def perfTraces = file("${params.output_dir}/perf/perf_traces.json")
+        def cmd = ["python3", "${projectDir}/bin/perf_history.py", "--db", params.perf_history_db.toString(),
+                   "ingest", "--run-meta", metaFile.toString()]
+        if (traces) {
+            cmd += ["--nextflow-trace"] + traces*.toString()
+        }
+        if (perfTraces.exists()) {
+            cmd += ["--perf-traces", perfTraces.toString()]
+        }
+        def proc = cmd*.toString().execute()
+        proc.waitForProcessOutput(System.out, System.err)
+    }
+}
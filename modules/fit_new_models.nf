@@ -1,63 +1,120 @@
 // Assumption: File contians a single column with multiple +/- labels, matching a single Maker column.
 process GET_SINGLE_MARKER_TRAINING_DF {
+    cpus { Resources.cpus(task, resources, tables_collected, 2) }
+    memory { Resources.memory(task, resources, tables_collected, '8 GB') }
+
     input:
     path(tables_collected)
+    val(resources)
     
     output:
     path 'training_*.tsv', emit: trainingdata, optional: true
-    path('training_generation_report.html'), emit: html_report
+    path('*_training_generation_summary.json'), emit: summary
+    path("*_perf.json"), emit: perf, optional: true
 
     script:
     """
+    export BINFLOW_CPUS=${task.cpus}
     generate_training_sets.py ${params.singleLabelColumn} "|" ${tables_collected}
-    build_html_report.py --title "Generate single marker training" --output training_generation_report.html --inputs ${tables_collected} training_*.tsv
+    build_html_report.py --format json --step GET_SINGLE_MARKER_TRAINING_DF --title "Generate single marker training" --elapsed-seconds \$SECONDS --output ${tables_collected.baseName}_training_generation_summary.json --inputs ${tables_collected} training_*.tsv
     """
 }
 
 // Accept any panel design, assume all input files have common markers
 process BINARY_MODEL_TRAINING{
+    cpus { Resources.cpus(task, resources, training_df, 8) }
+    memory { Resources.memory(task, resources, training_df, '32 GB') }
+
+    // Kept for incremental runs (params.incremental_from), which reuse the models of unchanged markers
     publishDir(
-        path: "${params.output_dir}/reports/",
-        pattern: "*.html",
+        path: "${params.output_dir}/models",
+        pattern: "*.pkl",
         mode: "copy"
     )
 
     input:
     path(training_df)
+    val(resources)
     
     output: 
     path("*best_model*.pkl"), emit: model, optional: true
-    path("model_training_report.html"), emit: html_report
+    path("*_model_training_summary.json"), emit: summary
+    path("*_perf.json"), emit: perf, optional: true
     
     script:
     """
+    export BINFLOW_CPUS=${task.cpus}
     fit_models.py ${training_df}
-    build_html_report.py --title "Binary model training" --output model_training_report.html --inputs ${training_df} *best_model*.pkl
+    build_html_report.py --format json --step BINARY_MODEL_TRAINING --title "Binary model training" --elapsed-seconds \$SECONDS --output ${training_df.baseName}_model_training_summary.json --inputs ${training_df} *best_model*.pkl
     """
 }
 
-process PREDICTIONS_FROM_BEST_MODEL{
+// Header-only table -> columns index, read once for routing models to tables
+process INDEX_TABLE_FEATURES {
     publishDir(
-        path: "${params.output_dir}/reports/",
-        pattern: "*.html",
+        path: "${params.output_dir}/pipeline_info",
         mode: "copy"
     )
-    
+
+    input:
+    path(quant_tables)
+
+    output:
+    path("table_features.json"), emit: index
+    path("*_perf.json"), emit: perf, optional: true
+
+    script:
+    """
+    export BINFLOW_CPUS=${task.cpus}
+    route_predictions.py index --output table_features.json ${quant_tables}
+    """
+}
+
+// Which tables carry every feature column of a model; only those pairs get a prediction task
+process ROUTE_PREDICTIONS {
+    input:
+    path(best_model)
+    path(feature_index)
+
+    output:
+    tuple path(best_model), path("*_routing.tsv"), emit: routing
+    path("*_routing_summary.json"), emit: summary
+    path("*_perf.json"), emit: perf, optional: true
+
+    script:
+    """
+    export BINFLOW_CPUS=${task.cpus}
+    route_predictions.py route --index ${feature_index} ${best_model}
+    build_html_report.py --format json --step ROUTE_PREDICTIONS --title "Model to table routing" --elapsed-seconds \$SECONDS --output ${best_model.baseName}_routing_summary.json --inputs ${best_model.baseName}_routing.tsv
+    """
+}
+
+process PREDICTIONS_FROM_BEST_MODEL{
+    cpus { Resources.cpus(task, resources, original_df, 4) }
+    memory { Resources.memory(task, resources, original_df, '16 GB') }
+
     input:
     tuple path(best_model), path(original_df)
+    val(resources)
     
     output: 
     tuple val(original_df.baseName), path("*_PRED.tsv"), emit: classifications
-    path("prediction_report.html"), emit: html_report
+    path("*_prediction_summary.json"), emit: summary
+    path("*_perf.json"), emit: perf, optional: true
     
     script:
     """
+    export BINFLOW_CPUS=${task.cpus}
     best_model_predictions.py ${best_model} ${original_df}
-    build_html_report.py --title "Predictions from best model" --output prediction_report.html --inputs ${best_model} ${original_df} *_PRED.tsv
+    build_html_report.py --format json --step PREDICTIONS_FROM_BEST_MODEL --title "Predictions from best model" --elapsed-seconds \$SECONDS --output ${original_df.baseName}_${best_model.baseName}_prediction_summary.json --inputs ${best_model} ${original_df} *_PRED.tsv
     """
 }
 
+// Batched: each task merges the predictions of a batch of images (see Batching.groovy)
 process MERGE_BY_PRED_IMAGE {
+    cpus { Batching.workers(params.batch_workers, images) }
+    memory { Resources.memory(task, resources, pred_files, '16 GB', task.cpus) }
+
     publishDir(
         path: "${params.output_dir}/merged/",
         pattern: "*_MERGED.tsv",
@@ -65,65 +122,112 @@ process MERGE_BY_PRED_IMAGE {
     )
 
     input:
-    tuple val(image_id), path(pred_files)
+    tuple val(images), path(pred_files)
+    val(resources)
 
     output:
-    tuple val(image_id), path("*_MERGED.tsv"), emit: merged
-    path("*_merge_report.html"), emit: html_report
+    path("*_MERGED.tsv"), emit: merged
+    path("*_merge_summary.json"), emit: summary
+    path("*_perf.json"), emit: perf, optional: true
 
     script:
+    // images: [image_id, [_PRED.tsv names]] per image of the batch
+    def jobs = images.collect { image_id, preds ->
+        Batching.job(
+            ["merge_preds.py", image_id] + preds,
+            ["build_html_report.py", "--format", "json", "--step", "MERGE_BY_PRED_IMAGE", "--title", "Merge predictions by image",
+             "--elapsed-seconds", '$SECONDS', "--output", "${image_id}_merge_summary.json", "--inputs"] + preds + ["${image_id}_MERGED.tsv"]
+        )
+    }
     """
-    merge_preds.py ${image_id} ${pred_files}
-    out=\$(ls *_MERGED.tsv | head -n1)
-    build_html_report.py --title "Merge predictions by image" --output merge_report.html --inputs ${pred_files} $out
-    mv merge_report.html ${image_id}_merge_report.html
+    export BINFLOW_CPUS=${task.cpus}
+    ${Batching.writeLines(jobs, 'jobs.txt')}
+    binflow batch --workers ${task.cpus} jobs.txt
     """
 }
 
 process MERGE_TRAINING_BY_MARKER {
+    cpus { Resources.cpus(task, resources, training_files, 2) }
+    memory { Resources.memory(task, resources, training_files, '8 GB') }
+
+    publishDir(
+        path: "${params.output_dir}/training",
+        pattern: "*_all.tsv",
+        mode: "copy"
+    )
+
     input:
-    tuple val(mark), path(training_files)
+    // previous_training: the marker's merged training set of the run an incremental run extends
+    tuple val(mark), path(training_files), path(previous_training, stageAs: 'previous/*')
+    val(resources)
 
     output:
     path("*_all.tsv"), emit: merged
-    path("training_merge_report.html"), emit: html_report
+    path("*_training_merge_summary.json"), emit: summary
+    path("*_perf.json"), emit: perf, optional: true
 
     script:
     """
-    merge_training.py "${mark}_all.tsv"
-    build_html_report.py --title "Merge training by marker" --output training_merge_report.html --inputs ${training_files} ${mark}_all.tsv
+    export BINFLOW_CPUS=${task.cpus}
+    merge_training.py "${mark}_all.tsv" ${previous_training}
+    build_html_report.py --format json --step MERGE_TRAINING_BY_MARKER --title "Merge training by marker" --elapsed-seconds \$SECONDS --output ${mark}_training_merge_summary.json --inputs ${training_files} ${mark}_all.tsv
     """
 }
 
+// Batched like MERGE_BY_PRED_IMAGE; each image's reports are written to, and published from, its own folder
 process REPORT_PER_IMAGE {
+    cpus { Batching.workers(params.batch_workers, images) }
+    memory { Resources.memory(task, resources, merged_files, '8 GB', task.cpus) }
+
     publishDir(
-        path: "${params.output_dir}/per_image_reports/${image_id}",
+        path: "${params.output_dir}/per_image_reports",
+        pattern: "*/*",
         mode: "copy"
     )
 
     input:
-    tuple val(image_id), path(merged_file)
-    path(quant_file_inputDir)
+    tuple val(images), path(merged_files), path(pred_files)
+    val(resources)
 
     output:
-    path("*.png"), emit: plots
-    path("*.html"), emit: html
-    path("image_step_report.html"), emit: step_report
+    path("*/*.png"), emit: plots
+    path("*/*_report.html"), emit: html
+    path("*/*_image_step_summary.json"), emit: summary
+    path("*_perf.json"), emit: perf, optional: true
 
     script:
+    // images: [image_id, _MERGED.tsv name, [_PRED.tsv names]] per image of the batch
+    def jobs = images.collect { image_id, merged, preds ->
+        def up = { "../${it}" }
+        Batching.job(
+            ["cd", image_id],
+            ["generate_reports_per_image.py", up(merged), image_id] + preds.collect(up),
+            ["build_html_report.py", "--format", "json", "--step", "REPORT_PER_IMAGE", "--title", "Per-image report generation",
+             "--elapsed-seconds", '$SECONDS', "--output", "${image_id}_image_step_summary.json",
+             "--inputs", up(merged), "*.png", "*_report.html"]
+        )
+    }
     """
-    generate_reports_per_image.py ${merged_file} ${image_id} ${quant_file_inputDir}
-    build_html_report.py --title "Per-image report generation" --output image_step_report.html --inputs ${merged_file} ${quant_file_inputDir} *.png *.html
+    export BINFLOW_CPUS=${task.cpus}
+    mkdir -p ${images.collect { Batching.quote(it[0]) }.join(' ')}
+    export BINFLOW_PERF_DIR=\$PWD
+    ${Batching.writeLines(jobs, 'jobs.txt')}
+    binflow batch --workers ${task.cpus} jobs.txt
     """
 }
 
 workflow supervised_wf {
 	take: 
     tablesOfQuantification
-    input_dir
+    resources
+    // Incremental runs: the previous run's models and merged training sets, and the markers
+    // to retrain (list, value channel); all three are empty channels on a full run
+    previous_models
+    previous_training
+    retrain_markers
 	
 	main:
-	trainingMk = GET_SINGLE_MARKER_TRAINING_DF(tablesOfQuantification)
+	trainingMk = GET_SINGLE_MARKER_TRAINING_DF(tablesOfQuantification, resources)
 	//trainingMk.flatMap{ it }.view()
 	
     // Group training files by their basename (e.g., training_CD68.tsv)
@@ -137,25 +241,86 @@ workflow supervised_wf {
     }
     .groupTuple()
 
-    merged_training = MERGE_TRAINING_BY_MARKER(grouped_training)
-	fitting = BINARY_MODEL_TRAINING(merged_training.merged)
+    models = Channel.empty()
+    if (params.incremental_from) {
+        // Only markers whose labels shifted are retrained, on the previous training set plus the new
+        // one; every other marker keeps its previous model
+        grouped_training = grouped_training
+            .combine(retrain_markers.map { markers -> [markers] })
+            .filter { mark, _, markers -> markers.contains(mark - 'training_') }
+            .map { mark, files, _ -> tuple(mark, files) }
+            .join(previous_training.map { f -> tuple(f.name - '_all.tsv', f) }, remainder: true)
+            .filter { mark, files, _ -> files != null }
+            .map { mark, files, previous -> tuple(mark, files, previous ? [previous] : []) }
+        models = previous_models
+            .combine(retrain_markers.map { markers -> [markers] })
+            .filter { model, markers -> !markers.contains(Incremental.marker(model.name)) }
+            .map { model, _ -> model }
+    } else {
+        grouped_training = grouped_training.map { mark, files -> tuple(mark, files, []) }
+    }
+
+    merged_training = MERGE_TRAINING_BY_MARKER(grouped_training, resources)
+	fitting = BINARY_MODEL_TRAINING(merged_training.merged, resources)
+	models = models.mix(fitting.model.flatten())
 	//fitting.view()
 	
-	model_and_quant_pairs = fitting.model.combine(tablesOfQuantification)
+	// Pair each model only with the tables that have its feature columns (read from the headers);
+	// every pair, predicted or skipped, is listed in pipeline_info/prediction_routing.tsv
+	feature_index = INDEX_TABLE_FEATURES(tablesOfQuantification.collect())
+	routing = ROUTE_PREDICTIONS(models, feature_index.index)
+	routing.routing
+        .map { _, manifest -> manifest }
+        .collectFile(name: 'prediction_routing.tsv', keepHeader: true, skip: 1, sort: true,
+                     storeDir: "${params.output_dir}/pipeline_info")
+	tables_by_name = tablesOfQuantification.map { t -> tuple(t.name, t) }
+	model_and_quant_pairs = routing.routing
+        .flatMap { model, manifest ->
+            manifest.splitCsv(header: true, sep: '\t')
+                .findAll { row -> row.status == 'predict' }
+                .collect { row -> tuple(row.table, model) }
+        }
+        .combine(tables_by_name, by: 0)
+        .map { _, model, table -> tuple(model, table) }
     // model_and_quant_pairs is a tuple of (best_model, original_df)
-    predict = PREDICTIONS_FROM_BEST_MODEL(model_and_quant_pairs)
+    predict = PREDICTIONS_FROM_BEST_MODEL(model_and_quant_pairs, resources)
 
     // Group predictions by image_id (the first value in the tuple)
     merged_input = predict.classifications.groupTuple().map { id, files -> tuple(id, files instanceof List ? files : [files]) } //.distinct()
 	//merged_input.view()
 
-    merged = MERGE_BY_PRED_IMAGE(merged_input)
-	//merged.view()
+    merged = MERGE_BY_PRED_IMAGE(image_batches(merged_input), resources)
+    merged_tables = merged.merged.flatten().map { f -> tuple(f.name - '_MERGED.tsv', f) }
+	//merged_tables.view()
     
-    report = REPORT_PER_IMAGE(merged.merged, input_dir)
+    // Each report batch gets only its own merged tables and _PRED.tsv files, keyed by image_id
+    report_inputs = merged_tables.join(merged_input).map { id, merged_file, files -> tuple(id, [merged_file] + files) }
+    report_batches = image_batches(report_inputs).map { images, files ->
+        def isMerged = { it.toString().endsWith('_MERGED.tsv') }
+        tuple(
+            images.collect { id, names -> [id, names.find(isMerged), names.findAll { !isMerged(it) }] },
+            files.findAll(isMerged),
+            files.findAll { !isMerged(it) }
+        )
+    }
+    report = REPORT_PER_IMAGE(report_batches, resources)
 
     emit:
-    merged_tables = merged.merged
+    merged_tables
     prediction_tables = predict.classifications
+    summaries = trainingMk.summary
+        .mix(merged_training.summary, fitting.summary, routing.summary, predict.summary, merged.summary, report.summary)
+    perf = trainingMk.perf
+        .mix(merged_training.perf, fitting.perf, feature_index.perf, routing.perf, predict.perf, merged.perf, report.perf)
 }
 
+// (image_id, files) tuples grouped into batches of params.batch_size images (or about
+// params.batch_bytes of files): tuple([[image_id, [file names]], ...], all files of the batch)
+def image_batches(images) {
+    def grouped = !Batching.enabled(params.batch_size, params.batch_bytes) ? images.map { [it] } :
+        images.toSortedList { a, b -> a[0] <=> b[0] }
+            .flatMap { all ->
+                Batching.partition(all, params.batch_size, params.batch_bytes, { it[0] }, { it[1].sum { f -> f.size() } })
+            }
+    grouped.map { batch -> tuple(batch.collect { id, files -> [id, files.collect { it.name }] }, batch.collectMany { it[1] }) }
+}
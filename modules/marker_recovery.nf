@@ -1,4 +1,7 @@
 process MARKER_RECOVERY_ANALYSIS {
+    cpus { Resources.cpus(task, resources, quant_tables, 8) }
+    memory { Resources.memory(task, resources, quant_tables, '32 GB') }
+
     publishDir(
         path: "${params.output_dir}/marker_recovery",
         mode: "copy"
@@ -6,17 +9,24 @@ process MARKER_RECOVERY_ANALYSIS {
 
     input:
     path(quant_tables)
+    val(resources)
 
     output:
     path("marker_recovery_artifacts"), emit: artifacts
+    path("marker_recovery_summary.json"), emit: summary
+    path("*_perf.json"), emit: perf, optional: true
 
     script:
     def excludePatterns = (params.exclude_component_patterns ?: []).join(',')
+    def checkpointDir = params.marker_recovery_checkpoint_dir ?: (params.output_dir.toString().contains('://') ? '' : "${params.output_dir}/marker_recovery_checkpoints")
+    def embeddingReference = params.marker_recovery_embedding_reference ? "--embedding-reference ${params.marker_recovery_embedding_reference}" : ''
+    def markerArgs = params.marker_recovery_markers ? "--markers ${params.marker_recovery_markers.join(',')}" : "--marker ${params.marker_recovery_marker}"
     """
+    export BINFLOW_CPUS=${task.cpus}
     mkdir -p marker_recovery_artifacts
 
     marker_recovery_pipeline.py \
-      --marker ${params.marker_recovery_marker} \
+      ${markerArgs} \
       --classification-col ${params.marker_recovery_classification_col} \
       --output-dir marker_recovery_artifacts \
       --seed ${params.marker_recovery_seed} \
@@ -24,17 +34,38 @@ process MARKER_RECOVERY_ANALYSIS {
       --cv-splits ${params.marker_recovery_cv_splits} \
       --n-iter-search ${params.marker_recovery_n_iter_search} \
       --outlier-contamination ${params.marker_recovery_outlier_contamination} \
+      --outlier-n-neighbors ${params.marker_recovery_outlier_n_neighbors} \
+      --outlier-fit-rows ${params.marker_recovery_outlier_fit_rows} \
+      --svc-max-rows ${params.marker_recovery_svc_max_rows} \
+      --embedding-rows ${params.marker_recovery_embedding_rows} \
+      --embedding-fit-rows ${params.marker_recovery_embedding_fit_rows} \
+      ${embeddingReference} \
+      --n-jobs ${task.cpus} \
+      --checkpoint-dir "${checkpointDir}" \
       --exclude-component-patterns "${excludePatterns}" \
       ${quant_tables}
 
-    build_html_report.py       --title "Marker recovery workflow summary"       --output marker_recovery_artifacts/marker_recovery_summary.html       --inputs marker_recovery_artifacts/*.csv marker_recovery_artifacts/*.tsv marker_recovery_artifacts/*.png marker_recovery_artifacts/*.json
+    shopt -s nullglob
+    build_html_report.py --format json \
+      --step MARKER_RECOVERY_ANALYSIS \
+      --title "Marker recovery workflow summary" \
+      --elapsed-seconds \$SECONDS \
+      --output marker_recovery_summary.json \
+      --inputs marker_recovery_artifacts/*.csv marker_recovery_artifacts/*.tsv marker_recovery_artifacts/*.png marker_recovery_artifacts/*.json \
+        marker_recovery_artifacts/*/*.csv marker_recovery_artifacts/*/*.tsv marker_recovery_artifacts/*/*.png marker_recovery_artifacts/*/*.json
     """
 }
 
 workflow marker_recovery_wf {
     take:
     tables_of_quantification
+    resources
 
     main:
-    MARKER_RECOVERY_ANALYSIS(tables_of_quantification)
+    recovery = MARKER_RECOVERY_ANALYSIS(tables_of_quantification, resources)
+
+    emit:
+    artifacts = recovery.artifacts
+    summary = recovery.summary
+    perf = recovery.perf
 }